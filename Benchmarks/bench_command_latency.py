@@ -0,0 +1,87 @@
+'''Measures the latency from a TCP request to the tower starting the
+LoRa transmission, over the persistent raw REPL link (repl_link.py)
+against the former path of one rshell subprocess per command. Needs the
+tower esp32 on the port configured in External_Commands/config.py, and
+rshell on the PATH for the former path, e.g.
+
+    python Benchmarks/bench_command_latency.py 5
+
+The transmission starts right after FlasherOperationSNCT.send_cmd prints
+the command, so its first output line is taken as the transmit start.
+The former path is timed from starting rshell, as the request went
+through nc and the TCP server first.
+'''
+import socket
+import socketserver
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'External_Commands'))
+
+import external_commands
+from config import PORT
+from tcpserver import InclineFlasherTCPHandler
+
+
+def rshell_latency():
+    '''Runs query_voltage through rshell as external_commands did.
+    Returns: (secs to the command echo, secs to rshell exiting)
+    '''
+    start = time.perf_counter()
+    echo = None
+    process = subprocess.Popen(['rshell', '-p', PORT, '--quiet', 'repl', 'pyboard', 'import query_voltage~'],
+                               stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if echo is None and "'msg': 'VOLTAGE'" in line:
+            echo = time.perf_counter() - start
+    process.wait()
+    return echo, time.perf_counter() - start
+
+
+def tcp_latency(address):
+    '''Sends VOLTAGE to the TCP server, which uses the raw REPL link.
+    Returns: (secs to the transmit start, secs to the TCP response)
+    '''
+    start = time.perf_counter()
+    with socket.create_connection(address) as client:
+        client.sendall(b'VOLTAGE')
+        client.recv(1024)
+    end = time.perf_counter()
+    return external_commands.link.tx_started - start, end - start
+
+
+def report(name, samples):
+    '''Prints the transmit start latency and total time of one path.'''
+    starts = [sample[0] for sample in samples if sample[0] is not None]
+    totals = [sample[1] for sample in samples]
+    if not starts:
+        print('{:<12} no transmit start seen'.format(name))
+        return
+    print('{:<12}{:>10.3f}{:>10.3f}{:>10.3f}{:>12.3f}'.format(
+        name, statistics.median(starts), min(starts), max(starts), statistics.median(totals)))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    if not Path(PORT).exists():
+        sys.exit('no board on {}'.format(PORT))
+
+    print('{:<12}{:>10}{:>10}{:>10}{:>12}'.format('path', 'tx med s', 'min s', 'max s', 'total med s'))
+    try:
+        report('rshell', [rshell_latency() for i in range(count)])
+    except FileNotFoundError:
+        print('rshell not installed, former path skipped')
+
+    server = socketserver.TCPServer(('localhost', 0), InclineFlasherTCPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # the first command opens the link and creates the operation object
+        tcp_latency(server.server_address)
+        report('raw REPL', [tcp_latency(server.server_address) for i in range(count)])
+    finally:
+        server.shutdown()
+        external_commands.link.close()
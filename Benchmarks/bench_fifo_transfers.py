@@ -0,0 +1,66 @@
+'''Counts SPI transactions and bytes clocked to move one packet through
+the SX127x FIFO, comparing the old per-byte register path with the burst
+write_fifo / read_fifo_into path.
+
+Usage:
+    python bench_fifo_transfers.py [payload_length ...]
+'''
+import sys
+import time
+
+import fake_machine
+
+chip = fake_machine.install()
+
+import sx127x
+from sx127x import SX127x, REG_FIFO, REG_FIFO_ADDR_PTR
+from machine import SoftSPI
+
+sx127x.__DEBUG__ = False
+
+REPEATS = 50
+
+
+def per_byte_write(radio, payload):
+    '''The pre-burst SX127x.write() loop.'''
+    for i in range(len(payload)):
+        radio.write_register(REG_FIFO, payload[i])
+
+
+def per_byte_read(radio, length):
+    '''The pre-burst SX127x.read_payload() loop.'''
+    payload = bytearray()
+    for i in range(length):
+        payload.append(radio.read_register(REG_FIFO))
+    return bytes(payload)
+
+
+def measure(radio, label, func):
+    radio.write_register(REG_FIFO_ADDR_PTR, 0)
+    chip.reset_counters()
+    func()
+    transactions, clocked = chip.transactions, chip.bytes_clocked
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        radio.write_register(REG_FIFO_ADDR_PTR, 0)
+        func()
+    elapsed = (time.perf_counter() - start) / REPEATS
+    print('{:<28}{:>14}{:>16}{:>14.1f}'.format(
+        label, transactions, clocked, elapsed * 1E6))
+
+
+if __name__ == '__main__':
+    lengths = [int(arg) for arg in sys.argv[1:]] or [16, 64, 255]
+    radio = SX127x(SoftSPI(), pins={'ss': 5, 'dio_0': 25},
+                   parameters=SX127x.default_parameters)
+    print('{:<28}{:>14}{:>16}{:>14}'.format(
+        'path', 'transactions', 'bytes clocked', 'host us'))
+    for length in lengths:
+        payload = bytes(range(length))
+        buffer = bytearray(length)
+        print('--- payload {} bytes'.format(length))
+        measure(radio, 'write per byte', lambda: per_byte_write(radio, payload))
+        measure(radio, 'write_fifo burst', lambda: radio.write_fifo(payload))
+        measure(radio, 'read per byte', lambda: per_byte_read(radio, length))
+        measure(radio, 'read_fifo_into burst', lambda: radio.read_fifo_into(buffer))
+        assert bytes(buffer) == payload
@@ -0,0 +1,84 @@
+'''Time to look up the latest response in response_logs.txt as the log
+grows over years of hourly VOLTAGE polls: readlines()[-1], as
+tcpserver.get_response did, against ResponseLog (External_Commands/
+response_log.py), both with the offset of the record it just appended
+and reading back from the end of a log it did not write. Synthetic logs
+are written to a temporary directory; no board is needed.
+
+Usage:
+    python bench_log_tail.py [years ...]
+'''
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'External_Commands'))
+
+from response_log import ResponseLog
+
+REPEATS = 20
+
+
+def write_log(path, years):
+    '''Writes a log of hourly VOLTAGE responses with a nightly flash.
+    Returns: the number of records.
+    '''
+    rng = random.Random(years)
+    t = datetime(2020, 1, 1)
+    count = 0
+    with open(path, 'w') as log_file:
+        for hour in range(int(years * 365 * 24)):
+            stamp = {'time': t.strftime("%m/%d/%Y, %H:%M:%S")}
+            if hour % 24 == 2:
+                log_file.write(str({**stamp, 'msg': 'FLASH_FLASHER', 'rssi': rng.randint(-110, -80)}) + '\n')
+                count += 1
+            log_file.write(str({**stamp, 'msg': 'VOLTAGE', 'SOLAR': round(rng.uniform(0, 20), 3),
+                                'BATT1': round(rng.uniform(11.5, 13.5), 3), 'rssi': rng.randint(-110, -80)}) + '\n')
+            count += 1
+            t += timedelta(hours=1)
+    return count
+
+
+def timed(func):
+    '''Returns: the median time of func in ms over REPEATS calls.'''
+    times = []
+    for i in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return 1000 * statistics.median(times)
+
+
+def readlines_last(path):
+    with open(path) as openfile:
+        return openfile.readlines()[-1]
+
+
+def bench(path, years):
+    '''Prints the lookup times for one synthetic log.'''
+    count = write_log(path, years)
+    size = path.stat().st_size
+    written = ResponseLog(path)
+    written.append(str({'time': '01/01/2030, 00:00:00', 'msg': 'VOLTAGE', 'SOLAR': 13.8, 'BATT1': 12.7}))
+    other = ResponseLog(path)
+    assert readlines_last(path).rstrip('\n') == written.tail() == other.tail()
+    print('{:>6}{:>9}{:>9.1f}{:>12.3f}{:>12.3f}{:>12.3f}{:>15.3f}'.format(
+        years, count, size / 1e6,
+        timed(lambda: readlines_last(path)),
+        timed(written.tail),
+        timed(other.tail),
+        timed(lambda: other.tail(24))))
+
+
+if __name__ == '__main__':
+    years = [float(arg) for arg in sys.argv[1:]] or [0.1, 1, 3, 10]
+    print('{:>6}{:>9}{:>9}{:>12}{:>12}{:>12}{:>15}'.format(
+        'years', 'records', 'MB', 'readlines', 'offset', 'from end', '24th from end'))
+    print('{:>6}{:>9}{:>9}{:>12}{:>12}{:>12}{:>15}'.format('', '', '', 'ms', 'ms', 'ms', 'ms'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in years:
+            bench(Path(tmp) / 'response_logs.txt', n)
@@ -0,0 +1,89 @@
+'''Time for plot_voltages.create_dataframe to load years of hourly
+responses: the former eval() of every line into a list of dicts, against
+the streaming tokenizer into NumPy columns, without its cache, writing
+the cache, reading it back unchanged and after a day of new lines.
+Synthetic logs (as in bench_log_tail.py) are written to a temporary
+directory; needs numpy, pandas and matplotlib, no board.
+
+Usage:
+    python bench_plot_parse.py [years ...]
+'''
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'External_Commands'))
+
+import plot_voltages
+from bench_log_tail import write_log
+
+REPEATS = 3
+
+
+def eval_dataframe(file_path):
+    '''create_dataframe before the streaming parser.'''
+    data = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            try:
+                entry = eval(line.strip(), {"__builtins__": None})
+                if 'SOLA(1)R' in entry:
+                    entry['SOLAR'] = entry.pop('SOLA(1)R')
+                data.append(entry)
+            except Exception as e:
+                continue
+    df = pd.DataFrame(data)
+    df['time'] = pd.to_datetime(df['time'], format="%m/%d/%Y, %H:%M:%S")
+    return df
+
+
+def timed(func, setup=None):
+    '''Returns: the median time of func in s over REPEATS calls, each
+    after setup.
+    '''
+    times = []
+    for i in range(REPEATS):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench(path, years):
+    '''Prints the load times for one synthetic log.'''
+    count = write_log(path, years)
+    cache = path.with_name(path.name + plot_voltages.CACHE_SUFFIX)
+    load = lambda: plot_voltages.create_dataframe(path)
+    assert len(eval_dataframe(path)) == len(plot_voltages.create_dataframe(path, use_cache=False)) == count
+    day = ''.join(str({'time': (datetime(2030, 1, 1) + timedelta(hours=h)).strftime("%m/%d/%Y, %H:%M:%S"),
+                       'msg': 'VOLTAGE', 'SOLAR': 13.812, 'BATT1': 12.694, 'rssi': -97}) + '\n' for h in range(24))
+
+    def append_day():
+        load()
+        with open(path, 'a') as log_file:
+            log_file.write(day)
+
+    print('{:>6}{:>9}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+        years, count,
+        timed(lambda: eval_dataframe(path)),
+        timed(lambda: plot_voltages.create_dataframe(path, use_cache=False)),
+        timed(load, lambda: cache.unlink(missing_ok=True)),
+        timed(load, load),
+        timed(load, append_day)))
+
+
+if __name__ == '__main__':
+    years = [float(arg) for arg in sys.argv[1:]] or [1, 3, 10]
+    print('{:>6}{:>9}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'years', 'records', 'eval', 'stream', 'cold', 'cached', '+1 day'))
+    print('{:>6}{:>9}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('', '', 's', 's', 's', 's', 's'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in years:
+            bench(Path(tmp) / 'response_logs.txt', n)
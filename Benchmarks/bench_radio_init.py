@@ -0,0 +1,37 @@
+'''Counts SPI transactions for SX127x construction and set_channel
+reconfiguration with and without the shadow register cache, then runs the
+on-board timing benchmark (Micropython/bench_radio_init.py) against the
+chip model.
+'''
+import fake_machine
+
+chip = fake_machine.install()
+
+import bench_radio_init
+import sx127x
+from config import device_config, lora_parameters
+from sx127x import SX127x
+
+sx127x.__DEBUG__ = False
+
+
+def count(func):
+    chip.reset_counters()
+    result = func()
+    return chip.transactions, result
+
+
+if __name__ == '__main__':
+    bus = fake_machine.FakeBus(chip)
+    faster = dict(lora_parameters, spreading_factor = 9, signal_bandwidth = 250E3)
+    print('{:<8}{:>12}{:>12}{:>14}{:>14}'.format(
+        'shadow', 'first init', 're-init', 'set_channel', 'same channel'))
+    for shadow in (False, True):
+        chip.__init__()
+        first, radio = count(lambda: SX127x(bus, device_config, lora_parameters, shadow))
+        again, radio = count(lambda: SX127x(bus, device_config, lora_parameters, shadow))
+        changed, _ = count(lambda: radio.set_channel(faster))
+        same, _ = count(lambda: radio.set_channel(faster))
+        print('{:<8}{:>12}{:>12}{:>14}{:>14}'.format(str(shadow), first, again, changed, same))
+    print()
+    bench_radio_init.main(bus)
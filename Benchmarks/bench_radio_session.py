@@ -0,0 +1,23 @@
+'''Counts the SPI transactions of building a LoRa radio session, which
+the persistent FlasherOperation.radio now does once instead of per send
+and listen, then runs Micropython/bench_radio_session.py on the host.
+'''
+import fake_machine
+
+chip = fake_machine.install()
+
+import bench_radio_session
+import sx127x
+from LoRa import LoRa
+
+sx127x.__DEBUG__ = False
+
+if __name__ == '__main__':
+    LoRa()
+    chip.reset_counters()
+    lora = LoRa()
+    print('SPI transactions per LoRa(): {} (x2 per command before)'.format(chip.transactions))
+    chip.reset_counters()
+    lora.healthy()
+    print('SPI transactions per health check: {}'.format(chip.transactions))
+    bench_radio_session.main()
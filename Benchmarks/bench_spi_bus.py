@@ -0,0 +1,18 @@
+'''Runs the on-board SPI bus micro-benchmark (Micropython/bench_spi_bus.py)
+against the host-side chip model, for every backend plus the fake bus.
+Absolute numbers are host timings; run the same module on the board with
+`import bench_spi_bus; bench_spi_bus.main()` for real figures.
+'''
+import fake_machine
+
+chip = fake_machine.install()
+
+import bench_spi_bus
+from config import device_config, lora_parameters
+from sx127x import SX127x
+
+if __name__ == '__main__':
+    bench_spi_bus.main(device_config)
+    bench_spi_bus.bench(
+        SX127x(fake_machine.FakeBus(chip), pins=device_config, parameters=lora_parameters),
+        'fake')
@@ -0,0 +1,164 @@
+'''Load test of the TCP front end (External_Commands/tcpserver.py): many
+clients connect at once, most polling VOLTAGE and a few sending FLASH,
+against the threaded server with its single prioritized radio worker and
+against the handler it replaced: a plain socketserver.TCPServer running
+each command in the connection, one at a time, with no cache. The radio
+exchange is simulated by a sleep of EXCHANGE secs (plus the flash time
+scaled by FLASH_SCALE), so no board is needed, only the host
+dependencies of tcpserver.py.
+Concurrent VOLTAGE requests share one exchange, and later ones are
+answered from the telemetry cache; the cache is emptied before each run.
+
+Usage:
+    python bench_tcp_queue.py [clients] [flashes]
+'''
+import contextlib
+import io
+import socket
+import socketserver
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'External_Commands'))
+
+import tcpserver
+from tcpserver import FlashCommandParser, InclineFlasherTCPHandler, VoltageCommandParser
+
+EXCHANGE = 0.2
+FLASH_SCALE = 0.05
+
+
+class SimulatedVoltage(VoltageCommandParser):
+    def excecute(self, cmd):
+        time.sleep(EXCHANGE)
+        resp = {'msg': 'VOLTAGE', 'SOLAR': 13.812, 'BATT1': 12.694, 'rssi': -97}
+        tcpserver.voltages.update(resp)
+        return resp
+
+
+class SimulatedFlash(FlashCommandParser):
+    def excecute(self, cmd):
+        self.args = self.parse_args(cmd)
+        time.sleep(EXCHANGE + FLASH_SCALE * self.args[0])
+        return {'msg': 'FLASH_FLASHER', 'rssi': -97}
+
+    def duration(self, cmd):
+        return FLASH_SCALE * self.parse_args(cmd)[0]
+
+
+class BaselineHandler(socketserver.BaseRequestHandler):
+    '''The handler before the radio queue: each command is excecuted
+    directly, one radio exchange at a time under a lock, with no cache,
+    coalescing or priorities.
+    '''
+    cmds = {b'FLASH': SimulatedFlash(), b'VOLTAGE': SimulatedVoltage()}
+    lock = threading.Lock()
+
+    def handle(self):
+        cmd_list = self.request.recv(1024).strip().split(b' ')
+        parser = self.cmds[cmd_list[0]]
+        with self.lock:
+            resp = parser.excecute(cmd_list)
+        self.request.sendall(parser.format_response(resp))
+
+
+def client(address, command, results, start_gate):
+    '''Sends one command and records when the first line and the response
+    arrive (secs after sending) and the first queue position reported.
+    '''
+    start_gate.wait()
+    start = time.perf_counter()
+    first = None
+    position = None
+    data = b''
+    with socket.create_connection(address) as sock:
+        sock.sendall(command)
+        while True:
+            chunk = sock.recv(1024)
+            if not chunk:
+                break
+            if first is None:
+                first = time.perf_counter() - start
+            data += chunk
+    for line in data.decode().splitlines():
+        if line.startswith('QUEUED') and position is None:
+            position = int(line.split()[1])
+    results.append((command.split()[0].decode(), first, time.perf_counter() - start, position))
+
+
+def load(server, clients, flashes):
+    '''Runs clients VOLTAGE clients at once, with flashes FLASH clients
+    joining shortly after.
+    Returns: the client results.
+    '''
+    tcpserver.voltages.sample = None
+    if InclineFlasherTCPHandler.worker is not None:
+        InclineFlasherTCPHandler.worker.coalesced = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_clients(server, clients, flashes)
+
+
+def run_clients(server, clients, flashes):
+    '''Starts server and runs the clients of load against it.'''
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = []
+    gate = threading.Event()
+    threads = [threading.Thread(target=client, args=(server.server_address, b'VOLTAGE', results, gate))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    time.sleep(EXCHANGE / 2)
+    flash_gate = threading.Event()
+    flash_threads = [threading.Thread(target=client, args=(server.server_address, b'FLASH 10', results, flash_gate))
+                     for i in range(flashes)]
+    for thread in flash_threads:
+        thread.start()
+    flash_gate.set()
+    for thread in threads + flash_threads:
+        thread.join()
+    server.shutdown()
+    server.server_close()
+    return results
+
+
+def report(name, results):
+    '''Prints per-command latency to the first byte and to the response.'''
+    print(name)
+    print('{:<10}{:>8}{:>14}{:>14}{:>14}{:>14}'.format(
+        'command', 'clients', 'first med s', 'first max s', 'resp med s', 'resp max s'))
+    for command in ('VOLTAGE', 'FLASH'):
+        rows = [row for row in results if row[0] == command]
+        if not rows:
+            continue
+        firsts = [row[1] for row in rows]
+        totals = [row[2] for row in rows]
+        print('{:<10}{:>8}{:>14.2f}{:>14.2f}{:>14.2f}{:>14.2f}'.format(
+            command, len(rows), statistics.median(firsts), max(firsts), statistics.median(totals), max(totals)))
+    flashes = [row[3] for row in results if row[0] == 'FLASH' and row[3] is not None]
+    if flashes:
+        print('first queue position of FLASH clients: {}'.format(sorted(flashes)))
+    if InclineFlasherTCPHandler.worker is not None:
+        print('VOLTAGE requests coalesced onto a queued one: {}'.format(InclineFlasherTCPHandler.worker.coalesced))
+    print()
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    flashes = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    InclineFlasherTCPHandler.cmds = {b'FLASH': SimulatedFlash(), b'VOLTAGE': SimulatedVoltage()}
+    print('{} VOLTAGE and {} FLASH clients, {:.1f} s per simulated exchange'.format(clients, flashes, EXCHANGE))
+    print()
+
+    class PlainTCPServer(socketserver.TCPServer):
+        request_queue_size = clients + flashes
+
+    report('plain TCPServer, baseline handler',
+           load(PlainTCPServer(('localhost', 0), BaselineHandler), clients, flashes))
+    # no tower to listen to between the simulated exchanges
+    tcpserver.LISTEN_WINDOW = 0
+    report('threaded server, prioritized radio queue',
+           load(tcpserver.serve(('localhost', 0)), clients, flashes))
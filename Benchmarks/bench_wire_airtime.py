@@ -0,0 +1,95 @@
+'''Prints payload size and time on air of every message type floppaSNCT
+and floppaREC exchange, JSON against the binary wire format, at the
+configured lora_parameters, and what the snct_main calibration cycle
+costs as separate commands against one BATCH exchange, and the daily
+airtime of polled against pushed voltage history.
+'''
+import json
+
+import fake_machine
+
+chip = fake_machine.install()
+
+import sx127x
+import wire
+from config import device_config, lora_parameters, telemetry_parameters
+from snct_main import CALIBRATION
+from sx127x import SX127x
+
+sx127x.__DEBUG__ = False
+
+BATCH_COMMAND = {'msg': 'BATCH', 'steps': CALIBRATION}
+BATCH_REPLY = {'msg': 'BATCH', 'results': [[step[0], 'OK', 1.5 * i] for i, step in enumerate(CALIBRATION)],
+               'SOLAR': 13.812, 'BATT1': 12.694}
+TELEMETRY = {'msg': 'TELEMETRY', 'SOLAR': 13.812, 'BATT1': 12.694, 'cmd_rssi': -97, 'uptime': 86400}
+
+MESSAGES = [
+    ('command', {'msg': name}) for name in
+    ('FLASHER_ON', 'FLASHER_OFF', 'FLASHER_FIRE', 'FLASHER_CEASEFIRE',
+     'BATT1_ON', 'BATT1_OFF', 'BATT2_ON', 'BATT2_OFF', 'VOLTAGE')
+] + [
+    ('command', {'msg': 'FLASH_FLASHER', 'time': 30}),
+    ('command', {'msg': 'SET_DR', 'dr': 2}),
+    ('command', BATCH_COMMAND),
+    ('reply', {'msg': 'RELAY_ON', 'relay': 'flasher_pin'}),
+    ('reply', {'msg': 'RELAY_OFF', 'relay': 'batt1_pin'}),
+    ('reply', {'msg': 'VOLTAGE', 'SOLAR': 13.812, 'BATT1': 12.694}),
+    ('reply', {'msg': 'VOLTAGE', 'SOLAR': 13.812, 'BATT1': 12.694, 'BATT2': 12.701}),
+    ('reply', {'msg': 'VOLTAGE', 'SOLAR': 13.812, 'BATT1': 12.694, 'lsnr': 7.25}),
+    ('reply', {'msg': 'FLASH_FLASHER'}),
+    ('reply', {'msg': 'SET_DR', 'dr': 2}),
+    ('reply', BATCH_REPLY),
+    ('push', TELEMETRY),
+]
+
+REPLIES = {
+    'FLASHER_ON': {'msg': 'RELAY_ON', 'relay': 'flasher_pin'},
+    'FLASHER_FIRE': {'msg': 'RELAY_ON', 'relay': 'hv_pin'},
+    'FLASHER_CEASEFIRE': {'msg': 'RELAY_OFF', 'relay': 'hv_pin'},
+    'FLASHER_OFF': {'msg': 'RELAY_OFF', 'relay': 'flasher_pin'},
+    'VOLTAGE': {'msg': 'VOLTAGE', 'SOLAR': 13.812, 'BATT1': 12.694},
+}
+
+
+def check(msg, payload):
+    '''Decodes payload and checks it round-trips to msg.'''
+    decoded = wire.decode(payload)
+    for key, value in msg.items():
+        if isinstance(value, float):
+            assert abs(decoded[key] - value) < 1E-3, (msg, decoded)
+        else:
+            assert decoded[key] == value, (msg, decoded)
+
+
+if __name__ == '__main__':
+    radio = SX127x(fake_machine.FakeBus(chip), device_config, lora_parameters)
+    print('SF{} {:.0f} kHz'.format(radio._spreading_factor,
+                                   sx127x.BANDWIDTHS[sx127x.bandwidth_setting(radio._signal_bandwidth)] / 1E3))
+    print('{:<8}{:<20}{:>7}{:>7}{:>11}{:>11}{:>8}'.format(
+        '', 'message', 'json B', 'wire B', 'json ms', 'wire ms', 'saved'))
+    for kind, msg in MESSAGES:
+        old = json.dumps(msg).encode()
+        new = wire.encode(msg)
+        check(msg, old)
+        check(msg, new)
+        old_ms = 1000 * radio.time_on_air(len(old))
+        new_ms = 1000 * radio.time_on_air(len(new))
+        print('{:<8}{:<20}{:>7}{:>7}{:>11.1f}{:>11.1f}{:>7.0f}%'.format(
+            kind, msg['msg'], len(old), len(new), old_ms, new_ms, 100 * (1 - new_ms / old_ms)))
+
+    seconds = 0.0
+    for name, delay in CALIBRATION:
+        seconds += radio.time_on_air(len(wire.encode({'msg': name})))
+        seconds += radio.time_on_air(len(wire.encode(REPLIES[name])))
+    batch = radio.time_on_air(len(wire.encode(BATCH_COMMAND)))
+    batch += radio.time_on_air(len(wire.encode(BATCH_REPLY)))
+    print()
+    print('calibration cycle: {} exchanges {:.2f} s on air, one BATCH exchange {:.2f} s on air'.format(
+        len(CALIBRATION), seconds, batch))
+
+    poll = radio.time_on_air(len(wire.encode({'msg': 'VOLTAGE'})))
+    poll += radio.time_on_air(len(wire.encode(REPLIES['VOLTAGE'])))
+    push = radio.time_on_air(len(wire.encode(TELEMETRY)))
+    interval = telemetry_parameters['interval']
+    print('voltage history: hourly poll {:.1f} s/day on air, push every {} s {:.1f} s/day on air ({} samples)'.format(
+        24 * poll, interval, 86400 // interval * push, 86400 // interval))
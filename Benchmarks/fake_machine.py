@@ -0,0 +1,317 @@
+'''Host-side stand-ins for the MicroPython `machine` module and an SX127x
+register model, so the radio driver in ../Micropython can be exercised
+and measured on a PC without a board attached.
+
+Usage:
+    import fake_machine
+    chip = fake_machine.install()
+    from sx127x import SX127x
+'''
+import asyncio
+import sys
+import time
+import types
+from pathlib import Path
+
+MICROPYTHON_DIR = Path(__file__).resolve().parent.parent / 'Micropython'
+
+REG_FIFO = 0x00
+REG_OP_MODE = 0x01
+REG_FIFO_ADDR_PTR = 0x0d
+REG_FIFO_RX_CURRENT_ADDR = 0x10
+REG_IRQ_FLAGS = 0x12
+REG_RX_NB_BYTES = 0x13
+REG_PKT_RSSI_VALUE = 0x1a
+REG_PKT_SNR_VALUE = 0x1b
+REG_FIFO_RX_BASE_ADDR = 0x0f
+REG_VERSION = 0x42
+
+IRQ_CAD_DETECTED_MASK = 0x01
+IRQ_CAD_DONE_MASK = 0x04
+IRQ_TX_DONE_MASK = 0x08
+IRQ_RX_DONE_MASK = 0x40
+IRQ_RX_TIME_OUT_MASK = 0x80
+MODE_TX = 0x03
+MODE_RX_SINGLE = 0x06
+MODE_CAD = 0x07
+
+
+class FakeSX127xChip:
+    '''Register-level model of an SX127x. It decodes SPI frames the same
+    way the silicon does (first byte is the address with the write bit in
+    bit 7, following bytes auto-increment except on REG_FIFO) and counts
+    every SS-low transaction and every byte clocked.
+    '''
+    def __init__(self):
+        self.registers = bytearray(128)
+        self.registers[REG_VERSION] = 0x12
+        self.fifo = bytearray(256)
+        self.dio0 = None
+        self.channel_busy = False
+        self.pending_packet = None
+        self.reset_counters()
+        self._selected = False
+        self._address = None
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.bytes_clocked = 0
+
+    def select(self):
+        self._selected = True
+        self._address = None
+        self.transactions += 1
+
+    def deselect(self):
+        self._selected = False
+        self._address = None
+
+    def exchange(self, out_byte):
+        '''Clocks one byte in and returns the byte clocked out.'''
+        self.bytes_clocked += 1
+        if self._address is None:
+            self._address = out_byte
+            return 0
+        write = self._address & 0x80
+        address = self._address & 0x7f
+        if address == REG_FIFO:
+            ptr = self.registers[REG_FIFO_ADDR_PTR]
+            if write:
+                self.fifo[ptr] = out_byte
+                response = 0
+            else:
+                response = self.fifo[ptr]
+            self.registers[REG_FIFO_ADDR_PTR] = (ptr + 1) & 0xff
+            return response
+        response = self.registers[address]
+        if write:
+            self.write(address, out_byte)
+        self._address = ((address + 1) & 0x7f) | write
+        return response
+
+    def write(self, address, value):
+        if address == REG_IRQ_FLAGS:
+            # flags are cleared by writing a one
+            self.registers[address] &= ~value & 0xff
+            return
+        self.registers[address] = value
+        if address == REG_OP_MODE and value & 0x07 == MODE_TX:
+            self.registers[REG_IRQ_FLAGS] |= IRQ_TX_DONE_MASK
+            self.registers[REG_OP_MODE] = (value & 0xf8) | 0x01
+            self.raise_dio0()
+        if address == REG_OP_MODE and value & 0x07 == MODE_CAD:
+            self.registers[REG_IRQ_FLAGS] |= IRQ_CAD_DONE_MASK
+            if self.channel_busy:
+                self.registers[REG_IRQ_FLAGS] |= IRQ_CAD_DETECTED_MASK
+            self.registers[REG_OP_MODE] = (value & 0xf8) | 0x01
+        if address == REG_OP_MODE and value & 0x07 == MODE_RX_SINGLE:
+            if self.pending_packet is None:
+                self.registers[REG_IRQ_FLAGS] |= IRQ_RX_TIME_OUT_MASK
+            else:
+                self.inject_packet(self.pending_packet)
+                self.pending_packet = None
+
+    def inject_packet(self, payload, rssi = 60, snr = 40, flags = IRQ_RX_DONE_MASK):
+        '''Places a received packet in the FIFO as the modem would, and
+        raises DIO0.
+        '''
+        base = self.registers[REG_FIFO_RX_BASE_ADDR]
+        for i, b in enumerate(payload):
+            self.fifo[(base + i) & 0xff] = b
+        self.registers[REG_FIFO_RX_CURRENT_ADDR] = base
+        self.registers[REG_RX_NB_BYTES] = len(payload)
+        self.registers[REG_PKT_RSSI_VALUE] = rssi
+        self.registers[REG_PKT_SNR_VALUE] = snr
+        self.registers[REG_IRQ_FLAGS] |= flags
+        self.raise_dio0()
+
+    def raise_dio0(self):
+        if self.dio0 is not None and self.dio0.handler is not None:
+            self.dio0.handler(self.dio0)
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 2
+    PULL_DOWN = 1
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    chip = None
+    ss = None
+    dio_0 = None
+
+    def __init__(self, pin_id, mode = -1, pull = -1):
+        self.id = pin_id
+        self.handler = None
+        self._value = 0
+        if pin_id == Pin.dio_0 and Pin.chip is not None:
+            Pin.chip.dio0 = self
+
+    def value(self, value = None):
+        if value is None:
+            return self._value
+        self._value = value
+        if self.id == Pin.ss and Pin.chip is not None:
+            if value:
+                Pin.chip.deselect()
+            else:
+                Pin.chip.select()
+
+    def irq(self, trigger = None, handler = None):
+        self.handler = handler
+
+    def detach_irq(self):
+        self.handler = None
+
+
+class SoftSPI:
+    '''Byte-accurate SPI master wired to the fake chip.'''
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, *args, **kwargs):
+        self.chip = Pin.chip
+
+    def write(self, buf):
+        for b in buf:
+            self.chip.exchange(b)
+
+    def readinto(self, buf, write = 0x00):
+        for i in range(len(buf)):
+            buf[i] = self.chip.exchange(write)
+
+    def write_readinto(self, write_buf, read_buf):
+        for i in range(len(write_buf)):
+            read_buf[i] = self.chip.exchange(write_buf[i])
+
+
+class SPI(SoftSPI):
+    pass
+
+
+class FakeBus:
+    '''Implements the spi_bus.SPIBus interface directly on the chip model,
+    without going through Pin and SoftSPI. This is the bus to plug into
+    SX127x in host-side tests.
+    '''
+    def __init__(self, chip):
+        self.chip = chip
+
+    def transfer(self, address, value = 0x00):
+        self.chip.select()
+        self.chip.exchange(address)
+        response = self.chip.exchange(value)
+        self.chip.deselect()
+        return response
+
+    def write_burst(self, address, buffer):
+        self.chip.select()
+        self.chip.exchange(address | 0x80)
+        for b in buffer:
+            self.chip.exchange(b)
+        self.chip.deselect()
+
+    def read_burst_into(self, address, buffer):
+        self.chip.select()
+        self.chip.exchange(address & 0x7f)
+        for i in range(len(buffer)):
+            buffer[i] = self.chip.exchange(0x00)
+        self.chip.deselect()
+
+
+class SoftI2C:
+    '''Swallows display traffic.'''
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class FrameBuffer(SoftI2C):
+    pass
+
+
+class ADC:
+    ATTN_11DB = 3
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def atten(self, attenuation):
+        pass
+
+    def read(self):
+        return 3000
+
+
+class RTC:
+    '''machine.RTC: only the user memory that survives machine.reset().'''
+    user_memory = b''
+
+    def memory(self, data = None):
+        if data is None:
+            return RTC.user_memory
+        RTC.user_memory = bytes(data)
+
+
+class ThreadSafeFlag(asyncio.Event):
+    '''uasyncio.ThreadSafeFlag: an event that clears when waited on.'''
+    async def wait(self):
+        await super().wait()
+        self.clear()
+
+
+def install(ss = 5, dio_0 = 25):
+    '''Installs the fake `machine` and `utime` modules, puts the firmware
+    directory on sys.path, and returns the chip that the fake SPI bus is
+    wired to.
+    '''
+    chip = FakeSX127xChip()
+    Pin.chip = chip
+    Pin.ss = ss
+    Pin.dio_0 = dio_0
+
+    machine = types.ModuleType('machine')
+    machine.Pin = Pin
+    machine.SoftSPI = SoftSPI
+    machine.SPI = SPI
+    machine.ADC = ADC
+    machine.SoftI2C = SoftI2C
+    machine.RTC = RTC
+    machine.idle = lambda: None
+    machine.lightsleep = lambda ms = 0: None
+    machine.reset = lambda: None
+    machine.unique_id = lambda: b'\x00\x01\x02\x03\x04\x05'
+    sys.modules['machine'] = machine
+
+    utime = types.ModuleType('utime')
+    utime.time = time.time
+    utime.sleep = time.sleep
+    utime.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    utime.ticks_ms = lambda: int(time.perf_counter() * 1000)
+    utime.ticks_us = lambda: int(time.perf_counter() * 1000000)
+    utime.ticks_diff = lambda a, b: a - b
+    utime.ticks_add = lambda a, b: a + b
+    sys.modules['utime'] = utime
+
+    micropython = types.ModuleType('micropython')
+    micropython.const = lambda value: value
+    sys.modules['micropython'] = micropython
+
+    framebuf = types.ModuleType('framebuf')
+    framebuf.FrameBuffer = FrameBuffer
+    framebuf.MONO_VLSB = 0
+    sys.modules['framebuf'] = framebuf
+
+    uasyncio = types.ModuleType('uasyncio')
+    uasyncio.__dict__.update(asyncio.__dict__)
+    uasyncio.ThreadSafeFlag = ThreadSafeFlag
+    uasyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    sys.modules['uasyncio'] = uasyncio
+
+    if str(MICROPYTHON_DIR) not in sys.path:
+        sys.path.insert(0, str(MICROPYTHON_DIR))
+    return chip
@@ -1,5 +1,14 @@
 FLOPPA_DIR = '/home/tamember/FLOPPA/External_Commands/'
 PORT = '/dev/ttyACM0'
+BAUDRATE = 115200
+REPL_TIMEOUT = 10 #seconds for the tower to answer over the raw REPL
+DEADLINE_MARGIN = 5 #seconds allowed beyond the longest exchange the tower reports
 FLASH_TIME = 5 #seconds
 TCPPORT = '9999'
+EXCHANGE_TIME = 10 #seconds, first estimate of one radio exchange for the queue wait
+STATUS_INTERVAL = 1 #seconds between queue position updates to a waiting client
+LISTEN_WINDOW = 3 #seconds of one listen for pushed telemetry while no command is queued, the longest a new command waits for it; 0 to not listen
+TELEMETRY_MAX_AGE = 300 #seconds a voltage sample is answered from the cache
+TELEMETRY_STALE_AGE = 3600 #seconds an older sample is still answered while a new one is fetched
+TELEMETRY_STORE = 'telemetry' #directory in FLOPPA_DIR of the columnar response store
 MONITORING_INTERVAL = 3
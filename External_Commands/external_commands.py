@@ -1,57 +1,86 @@
-import os
-from time import sleep
 from datetime import datetime
 from pathlib import Path
-import ast
-import re
+from time import time
 
-from config import FLOPPA_DIR, PORT, FLASH_TIME
+from config import FLOPPA_DIR, FLASH_TIME, LISTEN_WINDOW, TELEMETRY_STORE
+from repl_link import ReplLink
+from response_log import ResponseLog
+from telemetry_cache import TelemetryCache
+from telemetry_store import TelemetryStore
 
-def run_pyscript_rshell(script: str) -> None:
-	'''This function invokes a python script on the esp32 via rshell.
-	Parameters: 
-	script: name of the script (string)
-	port: name of the port the esp32 is connected to (string)
+# the last voltages heard from the flasher site
+voltages = TelemetryCache()
+# log filename -> ResponseLog, which remembers where its last record is
+logs = {}
+# typed columns of every response, for reading back by time
+store = None
+
+def log_record(record: dict) -> None:
+	'''This function logs a message the tower received besides the
+	response to a command.
 	'''
-	cmd = f'rshell -p {PORT} --quiet repl pyboard import {script}~'
-	os.system(cmd)
-	
+	voltages.update(record)
+	log_response(record)
+
+# the tower esp32, kept open in its raw REPL between commands
+link = ReplLink(on_record=log_record)
+
+def send_cmd(cmd: str, **kwargs) -> dict:
+	'''This function has the tower send a command to the flasher and
+	returns the flasher's response, over the persistent serial link.
+	'''
+	return link.send_cmd(cmd, **kwargs)
+
+def listen_for_telemetry(secs: float = LISTEN_WINDOW) -> list:
+	'''This function has the tower listen for secs for the telemetry the
+	flasher site pushes, which is only received while the tower listens.
+	Every record is logged as it arrives (log_record).
+	Returns: the records received
+	'''
+	return link.listen(secs)
+
 def copy_file_from_esp(filename: str) -> None:
-	'''This function runs an rshell command on the esp32.
-	Parameters: 
-	cmd: name of the command e.g. cp, ls (string)
-	port: name of the port the esp32 is connected to (string)
+	'''This function copies a file from the esp32 to FLOPPA_DIR over the
+	serial link.
 	'''
 	target_path = Path(FLOPPA_DIR) / filename
-	os.system(f'rshell -p {PORT} --quiet cp /pyboard/{filename} {str(target_path)}')
+	target_path.write_text(link.read_file(filename))
+
+def get_log(log_filename: str) -> ResponseLog:
+	'''This function returns the ResponseLog of a logfile in FLOPPA_DIR.
+	'''
+	if log_filename not in logs:
+		logs[log_filename] = ResponseLog(Path(FLOPPA_DIR) / log_filename)
+	return logs[log_filename]
 
-def write_to_logfile(filename_from_esp: str, log_filename: str) -> None:
-	'''This is a generic function which appends the info copied from the 
-	esp to the specified logfile.
+def append_to_logfile(resp: dict, log_filename: str) -> None:
+	'''This is a generic function which appends a flasher response to the
+	specified logfile, with the current time.
 	'''
-	copy_file_from_esp(filename_from_esp)
+	print(resp)
 	current_time = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
-	parent = Path(FLOPPA_DIR)
-	esp_file_path = parent / filename_from_esp
-	log_file_path = parent / log_filename
-	with esp_file_path.open('r') as esp_file:
-		data = esp_file.readlines()[0]
-		print(data)
-		datadict = ast.literal_eval(re.search('({.+})', data).group(0))
-		timedict = {'time':current_time}
-		with log_file_path.open('a') as log_file:
-			#log_file.write('time: ' + current_time + ' ' + data)
-			log_file.write(str({**timedict,**datadict}) + '\n')
+	timedict = {'time':current_time}
+	get_log(log_filename).append(str({**timedict,**resp}))
+
+def log_response(resp: dict) -> None:
+	'''This function records a flasher response in response_logs.txt and
+	in the telemetry store.
+	'''
+	global store
+	append_to_logfile(resp, 'response_logs.txt')
+	if store is None:
+		store = TelemetryStore(Path(FLOPPA_DIR) / TELEMETRY_STORE)
+	store.append(time(), resp)
 
-def test_voltages() -> None:
-	'''This function queries the voltages at the remote site, transfers
-	the voltages to the rpi, and appends them to the voltages file on 
-	its storage.
+def test_voltages() -> dict:
+	'''This function queries the voltages at the remote site and appends
+	them to the response log on the rpi's storage.
+	Returns: the flasher's response
 	'''
-	run_pyscript_rshell('query_voltage')
-	sleep(10)
-	write_to_logfile('recent_response_log.txt', 'response_logs.txt')
-	#write_to_logfile('recent_voltage.txt', 'voltages.txt')
+	resp = send_cmd('VOLTAGE')
+	voltages.update(resp)
+	log_response(resp)
+	return resp
 
 # def test_voltages() -> None:
 	# '''This function queries the voltages at the remote site, transfers
@@ -88,11 +117,11 @@ def test_voltages() -> None:
 	# sleep(5)
 	# write_to_logfile('recent_response_log.txt', 'response_logs.txt')
 	
-def flash_flasher(ontime_secs: int = FLASH_TIME) -> None:
+def flash_flasher(ontime_secs: int = FLASH_TIME) -> dict:
 	'''This function sends the command to turn the flasher on, then off 
 	after the configured ontime.
+	Returns: the flasher's response
 	'''
-	cmd = f"rshell -p {PORT} repl pyboard 'import flash_flasher ~ flash_flasher.fl.send_cmd(flash_flasher.cmd,time={ontime_secs})'~"
-	os.system(cmd)
-	sleep(ontime_secs + 5)
-	write_to_logfile('recent_response_log.txt', 'response_logs.txt')
+	resp = send_cmd('FLASH_FLASHER', time=ontime_secs)
+	log_response(resp)
+	return resp
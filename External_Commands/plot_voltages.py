@@ -1,7 +1,10 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import argparse
+import os
+from pathlib import Path
 from typing import Optional
 
 """
@@ -20,7 +23,7 @@ Usage:
     python plot_data.py <file_path> [-n <num_days>]
 
 Arguments:
-    <file_path>      : Path to the input data file (required).
+    <file_path>      : Path to the input data file, or to a telemetry store directory (required).
     -n <num_days>    : Number of days to plot. Default is 7 days if not specified.
 
 Example:
@@ -28,6 +31,7 @@ Example:
     This will plot the 'SOLAR' and 'BATT1' columns vs time for the last 30 days from 'data.txt'.
 
 Dependencies:
+    - numpy: For the parsed data columns.
     - pandas: For data processing and manipulation.
     - matplotlib: For generating plots.
     - argparse: For handling command-line arguments.
@@ -43,36 +47,313 @@ File Format:
         {'time': '12/25/2023, 14:30:00', 'SOLAR': 3.45, 'BATT1': 4.12, 'rssi': -70.2}
 
 This script assumes that the data file is correctly formatted and that the necessary columns exist in the input data.
+The parsed data is cached next to the data file (e.g. data.txt.columns.npz), so later runs only parse the lines
+appended since; use --no-cache to parse the whole file without it.
 
 """
 
-def create_dataframe(file_path: str) -> pd.DataFrame:
+# Sidecar next to the data file holding the parsed columns
+CACHE_SUFFIX = '.columns.npz'
+# Bytes before the parsed offset kept in the cache, to tell an appended file from a rewritten one
+CACHE_CHECK_BYTES = 64
+# Shortest line of a record with a time and a message
+LINE_BYTES = 40
+TIME_FORMAT = "%m/%d/%Y, %H:%M:%S"
+
+
+class LogColumns:
+    """
+    Parsed records of a data file in preallocated NumPy columns: 'time' (datetime64[s]), 'msg' (codes into
+    'names', -1 if missing) and a float column per numeric key, nan where a record lacks the key.
+    String values other than 'msg' are not kept.
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.size = 0
+        self.capacity = capacity
+        self.time = np.empty(capacity, dtype='datetime64[s]')
+        self.msg = np.empty(capacity, dtype=np.int32)
+        self.names = []
+        self.codes = {}
+        self.values = {}
+
+    def reserve(self, rows: int) -> None:
+        """
+        Makes room for 'rows' more records, so parsing never reallocates.
+
+        :param rows: The number of records to make room for.
+        :return: None
+        """
+        if self.size + rows <= self.capacity:
+            return
+        self.capacity = self.size + rows
+        self.time = self.grown(self.time, np.datetime64('NaT'))
+        self.msg = self.grown(self.msg, -1)
+        for key, column in self.values.items():
+            self.values[key] = self.grown(column, np.nan)
+
+    def grown(self, column: np.ndarray, fill) -> np.ndarray:
+        new = np.full(self.capacity, fill, dtype=column.dtype)
+        new[:self.size] = column[:self.size]
+        return new
+
+    def column(self, key: str) -> np.ndarray:
+        if key == 'SOLA(1)R':
+            key = 'SOLAR'
+        if key not in self.values:
+            self.values[key] = np.full(self.capacity, np.nan)
+        return self.values[key]
+
+    def code(self, msg: Optional[str]) -> int:
+        if msg is None:
+            return -1
+        if msg not in self.codes:
+            self.codes[msg] = len(self.names)
+            self.names.append(msg)
+        return self.codes[msg]
+
+    def add(self, iso_time: str, msg: Optional[str], fields: list) -> None:
+        """
+        Appends one record.
+
+        :param iso_time: The record time, e.g. "2023-12-25T14:30:00".
+        :param msg: The message name, or None.
+        :param fields: (key, value) pairs of the numeric fields.
+        :return: None
+        """
+        i = self.size
+        self.time[i] = iso_time
+        self.msg[i] = self.code(msg)
+        for key, value in fields:
+            self.column(key)[i] = value
+        self.size += 1
+
+    def add_line(self, line: str) -> bool:
+        """
+        Tokenizes a line of the known shape, {'time': 'MM/DD/YYYY, HH:MM:SS', 'key': value, ...} with number
+        or plain string values, straight into the columns.
+
+        :param line: The line, without the newline.
+        :return: False if the line is not of that shape (nothing is added).
+        """
+        if not (line.startswith("{'time': '") and line.endswith('}') and line[30:33] == "', "):
+            return False
+        t = line[10:30]
+        if t[2] != '/' or t[5] != '/' or t[10:12] != ', ':
+            return False
+        msg = None
+        fields = []
+        for item in line[33:-1].split(', '):
+            key, sep, value = item.partition(': ')
+            if not sep or len(key) < 3 or key[0] != "'" or key[-1] != "'":
+                return False
+            if value[:1] == "'":
+                if len(value) < 2 or value[-1] != "'" or "'" in value[1:-1]:
+                    return False
+                if key == "'msg'":
+                    msg = value[1:-1]
+                continue
+            try:
+                fields.append((key[1:-1], float(value)))
+            except ValueError:
+                return False
+        try:
+            self.add(t[6:10] + '-' + t[0:2] + '-' + t[3:5] + 'T' + t[12:20], msg, fields)
+        except ValueError:
+            return False
+        return True
+
+    def add_entry(self, entry: dict) -> None:
+        """
+        Appends a record parsed by the fallback path.
+
+        :param entry: The record as a dictionary.
+        :return: None
+        """
+        iso_time = datetime.strptime(entry['time'], TIME_FORMAT).isoformat()
+        fields = [(k, float(v)) for k, v in entry.items() if isinstance(v, (int, float)) and k != 'time']
+        self.add(iso_time, entry.get('msg'), fields)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        n = self.size
+        names = np.array(self.names + [None], dtype=object)
+        data = {'time': self.time[:n].astype('datetime64[ns]'), 'msg': names[self.msg[:n]]}
+        for key, column in self.values.items():
+            data[key] = column[:n]
+        return pd.DataFrame(data)
+
+    def save(self, cache_path: Path, stat, offset: int, check: bytes) -> None:
+        """
+        Writes the columns to the cache sidecar, keyed by the source size, mtime and parsed offset.
+
+        :param cache_path: The sidecar path.
+        :param stat: os.stat() of the data file.
+        :param offset: Bytes of the data file parsed into the columns.
+        :param check: The CACHE_CHECK_BYTES bytes before offset.
+        :return: None
+        """
+        n = self.size
+        arrays = {
+            'key': np.array([stat.st_size, stat.st_mtime_ns, offset], dtype=np.int64),
+            'check': np.frombuffer(check, dtype=np.uint8),
+            'time': self.time[:n],
+            'msg': self.msg[:n],
+            'names': np.array(self.names, dtype=str),
+            'keys': np.array(list(self.values), dtype=str),
+        }
+        for i, column in enumerate(self.values.values()):
+            arrays[f'value{i}'] = column[:n]
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        tmp_path.replace(cache_path)
+
+    @classmethod
+    def from_cache(cls, cache, extra: int) -> 'LogColumns':
+        """
+        Reads the columns from an opened cache sidecar, with room for 'extra' more records.
+
+        :param cache: The sidecar, as opened by np.load.
+        :param extra: The number of records to make room for.
+        :return: The columns.
+        """
+        size = len(cache['time'])
+        columns = cls(size + extra)
+        columns.size = size
+        columns.time[:size] = cache['time']
+        columns.msg[:size] = cache['msg']
+        columns.names = [str(name) for name in cache['names']]
+        columns.codes = {name: code for code, name in enumerate(columns.names)}
+        for i, key in enumerate(cache['keys']):
+            columns.column(str(key))[:size] = cache[f'value{i}']
+        return columns
+
+
+def parse_line_fallback(line: str) -> dict:
+    """
+    Parses a line the tokenizer does not know, as a Python dictionary literal.
+
+    :param line: The line.
+    :return: The record as a dictionary.
+    """
+    entry = eval(line.strip(), {"__builtins__": None})  # Avoid unsafe eval
+    if not isinstance(entry, dict):
+        raise ValueError('not a dictionary')
+    return entry
+
+
+def parse_lines(text: str, columns: LogColumns) -> None:
+    """
+    Parses complete lines into the columns, taking the fallback path only for lines the tokenizer does not know.
+
+    :param text: The lines.
+    :param columns: The columns to append to.
+    :return: None
+    """
+    lines = text.split('\n')
+    columns.reserve(len(lines))
+    for line in lines:
+        line = line.rstrip('\r')
+        if not line.strip() or columns.add_line(line):
+            continue
+        try:
+            columns.add_entry(parse_line_fallback(line))
+        except Exception as e:
+            print(f"Error processing line: {line} \nError: {e}")
+            continue  # Skip problematic lines
+
+
+def load_cache(cache_path: Path, f, stat):
+    """
+    Reads the cache sidecar of a data file if it still describes the start of the file: the file has the cached
+    size and mtime, or it is no shorter and the CACHE_CHECK_BYTES before the cached offset are unchanged. The file
+    is taken to be append-only; an edit further back is not noticed (use --no-cache).
+
+    :param cache_path: The sidecar path.
+    :param f: The data file, opened in binary mode.
+    :param stat: os.stat() of the data file.
+    :return: (LogColumns, offset parsed), or (None, 0) if there is no usable cache.
+    """
+    if not cache_path.exists():
+        return None, 0
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            size, mtime_ns, offset = (int(v) for v in cache['key'])
+            if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                check = cache['check'].tobytes()
+                if stat.st_size < offset:
+                    return None, 0
+                f.seek(offset - len(check))
+                if f.read(len(check)) != check:
+                    return None, 0
+            # Room for the appended lines, at no less than LINE_BYTES each
+            return LogColumns.from_cache(cache, (stat.st_size - offset) // LINE_BYTES + 1), offset
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring cache {cache_path}: {e}")
+        return None, 0
+
+
+def create_dataframe(file_path: str, use_cache: bool = True) -> pd.DataFrame:
     """
     Reads data from a file and creates a pandas DataFrame.
-    Safely parses each line and fixes any known issues (e.g., typos in keys).
+    Lines are tokenized straight into NumPy columns; only lines of another shape are parsed as dictionaries,
+    and known issues are fixed (e.g., typos in keys). The columns are cached in a sidecar file
+    (file_path + CACHE_SUFFIX), so a later call only parses the lines appended since.
 
     :param file_path: The path to the data file.
+    :param use_cache: Whether to read and update the sidecar.
     :return: A pandas DataFrame containing the parsed data.
     """
-    data = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            try:
-                # Safely parse the line as a dictionary
-                entry = eval(line.strip(), {"__builtins__": None})  # Avoid unsafe eval
-                # Fix the typo in the key if it exists
-                if 'SOLA(1)R' in entry:
-                    entry['SOLAR'] = entry.pop('SOLA(1)R')
-                data.append(entry)
-            except Exception as e:
-                print(f"Error processing line: {line} \nError: {e}")
-                continue  # Skip problematic lines
-
-    # Convert the list of dictionaries to a pandas DataFrame
-    df = pd.DataFrame(data)
-
-    # Convert 'time' field to datetime objects
-    df['time'] = pd.to_datetime(df['time'], format="%m/%d/%Y, %H:%M:%S")
+    path = Path(file_path)
+    cache_path = path.with_name(path.name + CACHE_SUFFIX)
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        columns, offset = load_cache(cache_path, f, stat) if use_cache else (None, 0)
+        if columns is None:
+            columns, offset = LogColumns(), 0
+        f.seek(offset)
+        new = f.read()
+        # Parse the complete lines; a last line without its newline may still be being written
+        complete = new.rfind(b'\n') + 1
+        f.seek(max(offset + complete - CACHE_CHECK_BYTES, 0))
+        check = f.read(offset + complete - f.tell())
+
+    parse_lines(new[:complete].decode('utf-8', 'replace'), columns)
+    if use_cache and complete:
+        try:
+            columns.save(cache_path, stat, offset + complete, check)
+        except OSError as e:
+            print(f"Could not write cache {cache_path}: {e}")
+    parse_lines(new[complete:].decode('utf-8', 'replace'), columns)
+
+    return columns.to_dataframe()
+
+
+def load_store(directory: str, num_days: Optional[int] = None) -> pd.DataFrame:
+    """
+    Reads the rows of a telemetry store (see telemetry_store.py) into a pandas DataFrame
+    with the same columns as create_dataframe, reading only the chunks of the last 'num_days' days.
+
+    :param directory: The telemetry store directory.
+    :param num_days: The number of days to read, all rows if None.
+    :return: A pandas DataFrame containing the data.
+    """
+    from telemetry_store import TelemetryStore
+
+    store = TelemetryStore(directory)
+    start = None if num_days is None else (datetime.now() - timedelta(days=num_days)).timestamp()
+    columns = store.query(start)
+    df = pd.DataFrame({
+        'SOLAR': columns['solar'],
+        'BATT1': columns['batt1'],
+        'rssi': columns['rssi'],
+        'snr': columns['snr'],
+        'msg': [store.commands[code] for code in columns['command']],
+    })
+    # Epoch times to local times, as written in the response log, each with
+    # the UTC offset in force at that time (across DST changes)
+    times = pd.to_datetime([datetime.fromtimestamp(t) for t in columns['time']])
+    df.insert(0, 'time', times)
 
     return df
 
@@ -184,6 +465,13 @@ def parse_args() -> argparse.Namespace:
         help="Number of days to plot (default is 7)."
     )
 
+    # Optional flag to bypass the parsed data cache
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Parse the whole data file without reading or writing its cache."
+    )
+
     return parser.parse_args()
 
 
@@ -191,8 +479,11 @@ if __name__ == "__main__":
     # Parse the arguments from the command line
     args = parse_args()
 
-    # Step 1: Create the DataFrame from the file
-    df = create_dataframe(args.file_path)
+    # Step 1: Create the DataFrame from the file or the telemetry store
+    if Path(args.file_path).is_dir():
+        df = load_store(args.file_path, args.num_days)
+    else:
+        df = create_dataframe(args.file_path, use_cache=not args.no_cache)
 
     # Step 2: Plot SOLAR and BATT1 vs. TIME for the last 'num_days' days (e.g., 7 days)
     plot_solar_and_batt1_for_days(df, args.num_days)
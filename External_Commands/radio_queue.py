@@ -0,0 +1,133 @@
+'''Single radio worker for the TCP front end. Requests from any number
+of client connections are queued here, and one thread runs them one at
+a time over the tower link, lowest priority number first and in arrival
+order within a priority. Identical requests are coalesced: a request
+submitted with the key of one still queued or running shares its job
+and result. Clients can ask where their request stands: its position in
+line and the expected wait, from the expected duration of every request
+ahead of it. While nothing is queued the worker can run an idle
+function, e.g. a short listen for the telemetry the flasher site
+pushes, one slice at a time, so a new request waits for one slice at
+most.
+'''
+import heapq
+import itertools
+import threading
+import time
+
+from config import EXCHANGE_TIME, LISTEN_WINDOW
+
+class RadioJob:
+    '''This class is one queued request: the function that runs it over
+    the radio, and its result once done.
+    '''
+    def __init__(self, func, name: str, priority: int, duration: float, key=None):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        # secs the command keeps the flasher busy beyond the radio exchange
+        self.duration = duration
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.queued = time.monotonic()
+        self.started = None
+        # requests with the same key share this job while it is not done
+        self.key = key
+
+class RadioWorker(threading.Thread):
+    '''This class owns the radio: a thread that runs queued RadioJobs one
+    at a time. It learns how long an exchange of each command takes beyond
+    the command's own duration (starting from EXCHANGE_TIME), for the wait
+    estimates. If idle is given it is run as a job named IDLE, one slice
+    after another, whenever the queue is empty; after an idle job fails
+    the next one waits idle_retry secs.
+    '''
+    # weight of the last exchange in the running exchange time average
+    smoothing = 0.3
+    # priority of the idle job, behind every request
+    idle_priority = 99
+    idle_retry = 10
+
+    def __init__(self, idle=None, idle_duration: float = LISTEN_WINDOW):
+        super().__init__(daemon=True)
+        self.idle = idle
+        self.idle_duration = idle_duration
+        self.idle_failed = False
+        self.jobs = []
+        self.order = itertools.count()
+        self.lock = threading.Condition()
+        self.current = None
+        self.exchange_time = {}
+        # key -> job not done yet, for coalescing
+        self.keyed = {}
+        self.coalesced = 0
+
+    def submit(self, func, name: str, priority: int, duration: float = 0, key=None) -> RadioJob:
+        '''This method queues func to be run by the worker, unless a job
+        with the same key (if given) is queued or running.
+        Returns: the RadioJob, whose done event is set once it has run.
+        '''
+        with self.lock:
+            if key is not None and key in self.keyed:
+                self.coalesced += 1
+                return self.keyed[key]
+            job = RadioJob(func, name, priority, duration, key)
+            if key is not None:
+                self.keyed[key] = job
+            heapq.heappush(self.jobs, (priority, next(self.order), job))
+            self.lock.notify()
+        return job
+
+    def expected_time(self, job: RadioJob) -> float:
+        '''This method returns how long job is expected to take (secs).'''
+        return job.duration + self.exchange_time.get(job.name, EXCHANGE_TIME)
+
+    def status(self, job: RadioJob) -> tuple:
+        '''This method returns where job stands.
+        Returns: (requests ahead of it, expected secs until it starts),
+        (0, 0) once it has started.
+        '''
+        with self.lock:
+            if job.started is not None:
+                return 0, 0.0
+            ahead = sorted(self.jobs)
+            position = 0
+            wait = 0.0
+            if self.current is not None:
+                position = 1
+                elapsed = time.monotonic() - self.current.started
+                wait = max(0.0, self.expected_time(self.current) - elapsed)
+            for priority, order, queued in ahead:
+                if queued is job:
+                    break
+                position += 1
+                wait += self.expected_time(queued)
+            return position, wait
+
+    def run(self) -> None:
+        '''This method runs the queued jobs forever.'''
+        while True:
+            with self.lock:
+                while not self.jobs:
+                    if self.idle is None:
+                        self.lock.wait()
+                    elif not self.idle_failed or not self.lock.wait(self.idle_retry):
+                        job = RadioJob(self.idle, 'IDLE', self.idle_priority, self.idle_duration)
+                        heapq.heappush(self.jobs, (job.priority, next(self.order), job))
+                priority, order, job = heapq.heappop(self.jobs)
+                self.current = job
+                job.started = time.monotonic()
+            try:
+                job.result = job.func()
+            except Exception as e:
+                job.error = e
+            exchange = time.monotonic() - job.started - job.duration
+            with self.lock:
+                previous = self.exchange_time.get(job.name, EXCHANGE_TIME)
+                self.exchange_time[job.name] = (1 - self.smoothing) * previous + self.smoothing * max(exchange, 0.0)
+                self.current = None
+                self.keyed.pop(job.key, None)
+                if job.name == 'IDLE':
+                    self.idle_failed = job.error is not None
+            job.done.set()
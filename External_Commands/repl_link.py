@@ -0,0 +1,248 @@
+'''Persistent link to the tower esp32 over its USB serial console. The
+link keeps the port open and the board in the MicroPython raw REPL, so
+a command costs one round trip over the already open port instead of an
+rshell subprocess (interpreter startup, board enumeration, soft reboot).
+A FlasherOperationSNCT is created on the board once and send_cmd is
+called on it in place. The firmware prints every message it decodes as
+a framed record line (LoRa.emit_record), which is read off the console
+as it arrives: the first one is the response. The board first reports
+the longest the exchange can take (FlasherOperation.exchange_timeout),
+and the link gives up DEADLINE_MARGIN secs after that.
+'''
+import json
+import time
+import zlib
+
+import serial
+
+from config import PORT, BAUDRATE, REPL_TIMEOUT, DEADLINE_MARGIN
+
+CTRL_A = b'\x01'
+CTRL_B = b'\x02'
+CTRL_C = b'\x03'
+CTRL_D = b'\x04'
+CTRL_E = b'\x05'
+RAW_REPL_BANNER = b'raw REPL; CTRL-B to exit\r\n>'
+# as in Micropython/LoRa.py
+RECORD_START = '\x1e'
+DEADLINE_MARKER = 'DEADLINE '
+
+SETUP = 'from floppaSNCT import FlasherOperationSNCT\nfl = FlasherOperationSNCT()'
+
+def parse_record(line: str):
+    '''This function decodes a record line from the tower console: the
+    message as JSON and the CRC32 of the JSON in hex.
+    Returns: the message dict, or None if the line is not an intact record.
+    '''
+    if not line.startswith(RECORD_START):
+        return None
+    body, _, crc = line[len(RECORD_START):].rpartition(' ')
+    if not body or crc != '{:08x}'.format(zlib.crc32(body.encode())):
+        print(f'Corrupted record: {line!r}')
+        return None
+    return json.loads(body)
+
+class ReplError(Exception):
+    '''This is raised when code run on the board raises, or the board does
+    not answer the raw REPL protocol.
+    '''
+
+class ReplTimeout(ReplError):
+    '''This is raised when the board does not finish by the deadline.'''
+
+class ReplLink:
+    '''This class owns the serial port of the tower esp32. It is opened on
+    first use and reopened after an error, e.g.
+
+        link = ReplLink()
+        resp = link.send_cmd('FLASH_FLASHER', time=5)
+
+    Records that follow the response (messages from other nodes, pushed
+    telemetry) are passed to on_record, as are the records heard in a
+    listen window (link.listen(20)).
+    '''
+    def __init__(self, port: str = PORT, baudrate: int = BAUDRATE, timeout: float = REPL_TIMEOUT, on_record=None):
+        self.port = port
+        self.on_record = on_record
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.serial = None
+        self.buffer = bytearray()
+        self.raw_paste = True
+        # perf_counter() of the first board output of the last send_cmd,
+        # which send_cmd prints right before the transmission starts
+        self.tx_started = None
+        # time.monotonic() by which the current read must complete
+        self.deadline = None
+
+    def open(self) -> None:
+        '''This method opens the port, interrupts whatever runs on the
+        board, enters the raw REPL and creates the operation object.
+        '''
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=1)
+        self.serial.write(b'\r' + CTRL_C)
+        time.sleep(0.1)
+        self.serial.write(CTRL_C)
+        time.sleep(0.1)
+        self.serial.reset_input_buffer()
+        self.buffer = bytearray()
+        self.serial.write(b'\r' + CTRL_A)
+        self.read_until(RAW_REPL_BANNER, 10)
+        self.exec_(SETUP)
+
+    def close(self) -> None:
+        '''This method stops any code still running on the board (e.g. after
+        a timeout), leaves the raw REPL and releases the port.
+        '''
+        if self.serial is None:
+            return
+        try:
+            self.serial.write(CTRL_C + b'\r' + CTRL_B)
+        except OSError:
+            pass
+        self.serial.close()
+        self.serial = None
+
+    def read_until(self, ending: bytes, timeout: float, on_line=None) -> bytes:
+        '''This method reads from the board until ending, calling on_line
+        with every complete line on the way, which may move self.deadline.
+        Bytes after ending are kept for the next read.
+        Returns: the bytes read, without ending.
+        '''
+        self.deadline = time.monotonic() + timeout
+        line_start = 0
+        while True:
+            found = self.buffer.find(ending)
+            end = len(self.buffer) if found < 0 else found
+            if on_line is not None:
+                newline = self.buffer.find(b'\n', line_start, end)
+                while newline >= 0:
+                    on_line(self.buffer[line_start:newline].decode('utf-8', 'replace').rstrip('\r'))
+                    line_start = newline + 1
+                    newline = self.buffer.find(b'\n', line_start, end)
+            if found >= 0:
+                data = bytes(self.buffer[:found])
+                del self.buffer[:found + len(ending)]
+                return data
+            if time.monotonic() > self.deadline:
+                raise ReplTimeout(f'timeout waiting for {ending!r}, got {bytes(self.buffer[-80:])!r}')
+            self.buffer.extend(self.serial.read(max(1, self.serial.in_waiting)))
+
+    def write_code(self, code: bytes) -> None:
+        '''This method hands code to the raw REPL for compilation, with the
+        flow control of raw-paste mode if the board supports it, else in
+        small chunks.
+        '''
+        if self.raw_paste:
+            self.serial.write(CTRL_E + b'A' + CTRL_A)
+            answer = self.serial.read(2)
+            if answer == b'R\x01':
+                self.write_code_raw_paste(code)
+                return
+            if answer != b'R\x00':
+                # firmware without raw-paste mode echoes the request
+                self.read_until(b'>', 5)
+            self.raw_paste = False
+        for i in range(0, len(code), 256):
+            self.serial.write(code[i:i + 256])
+            time.sleep(0.01)
+        self.serial.write(CTRL_D)
+        if self.serial.read(2) != b'OK':
+            raise ReplError('raw REPL did not accept the code')
+
+    def write_code_raw_paste(self, code: bytes) -> None:
+        '''This method sends code in raw-paste mode: the board grants a
+        window of bytes, and one more window per CTRL_A it sends.
+        '''
+        window = int.from_bytes(self.serial.read(2), 'little')
+        remaining = window
+        i = 0
+        while i < len(code):
+            while remaining == 0 or self.serial.in_waiting:
+                flag = self.serial.read(1)
+                if flag == CTRL_A:
+                    remaining += window
+                elif flag == CTRL_D:
+                    self.serial.write(CTRL_D)
+                    raise ReplError('board aborted raw-paste')
+                elif not flag:
+                    raise ReplError('no raw-paste flow control from the board')
+            chunk = code[i:i + min(remaining, len(code) - i)]
+            self.serial.write(chunk)
+            remaining -= len(chunk)
+            i += len(chunk)
+        self.serial.write(CTRL_D)
+        self.read_until(CTRL_D, 5)
+
+    def exec_(self, code: str, on_line=None, timeout: float = None) -> str:
+        '''This method runs code on the board, opening the link first if
+        needed. Output lines are passed to on_line as they arrive. The link
+        is closed on any error, so the next call starts afresh.
+        Returns: the code's output.
+        '''
+        if self.serial is None:
+            self.open()
+        try:
+            self.write_code(code.encode('utf-8'))
+            out = self.read_until(CTRL_D, timeout or self.timeout, on_line)
+            err = self.read_until(CTRL_D, 5)
+            self.read_until(b'>', 5)
+        except (OSError, serial.SerialException, ReplError):
+            self.close()
+            raise
+        if err:
+            raise ReplError(err.decode('utf-8', 'replace'))
+        return out.decode('utf-8', 'replace')
+
+    def send_cmd(self, cmd: str, **kwargs) -> dict:
+        '''This method calls FlasherOperationSNCT.send_cmd on the board and
+        records when its output starts (tx_started). It raises ReplTimeout
+        if the exchange overruns the deadline the board reports.
+        Returns: the flasher's response dict, the first record streamed.
+        '''
+        self.tx_started = None
+        records = []
+
+        def on_line(line: str) -> None:
+            if line.startswith(DEADLINE_MARKER):
+                self.deadline = time.monotonic() + float(line[len(DEADLINE_MARKER):]) + DEADLINE_MARGIN
+                return
+            if self.tx_started is None:
+                self.tx_started = time.perf_counter()
+            record = parse_record(line)
+            if record is None:
+                return
+            if records and self.on_record is not None:
+                self.on_record(record)
+            records.append(record)
+
+        command = {'msg': cmd, **kwargs}
+        args = ''.join(f', {key}={value!r}' for key, value in kwargs.items())
+        self.exec_(f'print({DEADLINE_MARKER!r} + str(fl.exchange_timeout({command!r})))\n'
+                   f'fl.send_cmd({cmd!r}{args})', on_line)
+        if not records:
+            raise ReplError(f'no response to {cmd}')
+        return records[0]
+
+    def listen(self, secs: float) -> list:
+        '''This method has the tower listen for secs for the messages flasher
+        sites send on their own (FlasherOperationSNCT.listen_passively),
+        passing each record to on_record as it arrives.
+        Returns: the records received.
+        '''
+        records = []
+
+        def on_line(line: str) -> None:
+            record = parse_record(line)
+            if record is None:
+                return
+            if self.on_record is not None:
+                self.on_record(record)
+            records.append(record)
+
+        self.exec_(f'fl.listen_passively({secs!r})', on_line, secs + self.timeout)
+        return records
+
+    def read_file(self, filename: str) -> str:
+        '''This method returns the contents of a file on the board.'''
+        return self.exec_(f"with open({filename!r}) as f:\n    print(f.read(), end='')")
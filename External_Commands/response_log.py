@@ -0,0 +1,72 @@
+'''Append-only log of flasher responses, one record per line, that is
+read from the end. The log grows for as long as the site runs, so the
+latest record is not found by reading the whole file: the writer
+remembers where the last record it wrote starts, and any other record
+is found by reading back from the end of the file a block at a time.
+'''
+import ast
+import threading
+from pathlib import Path
+
+class ResponseLog:
+    '''This class appends records to a log file and looks up recent ones,
+    e.g.
+
+        log = ResponseLog('response_logs.txt')
+        log.append(str(resp))
+        log.latest()      # resp
+        log.latest(2)     # the record before it
+
+    It is shared by the TCP handler threads and the radio worker.
+    '''
+    # bytes read per step when reading back from the end
+    block_size = 4096
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        # offset of the last record written, valid while the file is
+        # still size bytes long (nobody else appended since)
+        self.last_offset = None
+        self.size = None
+
+    def append(self, line: str) -> None:
+        '''This method appends line as the newest record.'''
+        data = (line.rstrip('\n') + '\n').encode('utf-8')
+        with self.lock, self.path.open('ab') as log_file:
+            offset = log_file.seek(0, 2)
+            log_file.write(data)
+            self.last_offset = offset
+            self.size = offset + len(data)
+
+    def tail(self, n: int = 1) -> str:
+        '''This method returns the nth latest record line (n = 1 is the
+        latest), reading only the end of the file.
+        Raises: IndexError if the log has fewer than n records.
+        '''
+        if n < 1:
+            raise IndexError('n must be at least 1')
+        with self.lock, self.path.open('rb') as log_file:
+            size = log_file.seek(0, 2)
+            if n == 1 and self.last_offset is not None and size == self.size:
+                log_file.seek(self.last_offset)
+                return log_file.read(size - self.last_offset).decode('utf-8').rstrip('\n')
+            position = size
+            data = b''
+            while True:
+                step = min(self.block_size, position)
+                position -= step
+                log_file.seek(position)
+                data = log_file.read(step) + data
+                lines = data.rstrip(b'\n').split(b'\n')
+                # the first line is only known to be complete from the start
+                complete = len(lines) if position == 0 else len(lines) - 1
+                if complete >= n or position == 0:
+                    break
+        if not data.strip() or complete < n:
+            raise IndexError(f'{self.path} has fewer than {n} records')
+        return lines[-n].decode('utf-8')
+
+    def latest(self, n: int = 1) -> dict:
+        '''This method returns the nth latest record as a dict.'''
+        return ast.literal_eval(self.tail(n))
@@ -1,25 +1,49 @@
 import socketserver
-from pathlib import Path
 from datetime import datetime
-import ast
 from abc import ABC, abstractmethod
 
-from config import FLOPPA_DIR, FLASH_TIME
-from external_commands import flash_flasher, test_voltages
+from config import FLASH_TIME, LISTEN_WINDOW, STATUS_INTERVAL
+from external_commands import flash_flasher, listen_for_telemetry, test_voltages, voltages
+from radio_queue import RadioWorker
+from repl_link import ReplError, ReplTimeout
+from telemetry_cache import VOLTAGE_KEYS
 
 def get_current_utc() -> str:
     return datetime.utcnow().replace(microsecond=0).isoformat(' ')
 
 class CommandParser(ABC):
     '''This is the definition of an interface for parsing 
-    commands over the TCP connection.
+    commands over the TCP connection. Commands with a lower priority
+    number are run first, and identical requests of a command that
+    coalesces share one radio exchange.
     '''
     args = []
+    priority = 1
+    coalesce = False
+
+    def cache_state(self) -> str:
+        '''This method returns 'fresh' or 'stale' if the command can be
+        answered from a cache (a stale answer is fetched anew in the
+        background), else None.
+        '''
+        return None
+
+    def cached_response(self) -> bytes:
+        '''This method returns the answer from the cache.
+        '''
+        raise NotImplementedError
+
+    def duration(self, cmd: list[bytes]) -> float:
+        '''This method returns how long (secs) the command keeps the
+        flasher busy beyond the radio exchange.
+        '''
+        return 0
 
     @abstractmethod
-    def excecute(self, cmd: list[bytes]) -> None:
+    def excecute(self, cmd: list[bytes]) -> dict:
         '''This is the method which parses the command bytestring 
         and excecutes the appropriate function.
+        Returns: the flasher's response
         '''
 
     @abstractmethod
@@ -30,37 +54,47 @@ class CommandParser(ABC):
 
 class VoltageCommandParser(CommandParser):
     '''This is the implementation of a command parser for the voltage
-    TCP command.
+    TCP command. It is answered from the last known voltages while they
+    are recent enough (see telemetry_cache.py).
     '''
+    coalesce = True
 
-    def excecute(self, cmd: list[bytes]) -> None:
+    def excecute(self, cmd: list[bytes]) -> dict:
         '''This excecutes the voltage command.
         '''
-        test_voltages()
+        return test_voltages()
 
-    def format_response(self, resp: dict) -> bytes:
-        '''This formats the flasher's voltage response.
+    def cache_state(self) -> str:
+        return voltages.state()
+
+    def cached_response(self) -> bytes:
+        sample, age = voltages.get()
+        return self.format_response(sample, age)
+
+    def format_response(self, resp: dict, age: float = 0) -> bytes:
+        '''This formats the flasher's voltage response, with the age of the
+        sample in secs. Live and cached answers give the same VOLTAGE_KEYS;
+        a cached sample is stamped with the time it arrived, a live
+        response with the current time.
         '''
-        formatted_response = ""
-        now = get_current_utc()
-        for k, v in resp.items():
-            if k == "SOLA(1)R":
-                k = "SOLAR"
-            if k == "time":
-                continue
-            elif k == "msg":
-                formatted_response += "VOLTAGE " + now
-            else:
-                formatted_response += " " + k.lower() + " " + str(v)
+        resp = dict(resp)
+        if "SOLA(1)R" in resp:
+            resp["SOLAR"] = resp.pop("SOLA(1)R")
+        formatted_response = "VOLTAGE " + (resp.get("time") or get_current_utc())
+        for k in VOLTAGE_KEYS:
+            if k in resp:
+                formatted_response += " " + k.lower() + " " + str(resp[k])
+        formatted_response += f" age {age:.0f}"
         return bytes(formatted_response + "\n",'utf-8')
 
 class FlashCommandParser(CommandParser):
     '''This is the implementation of a command parser for the FLASH
-    command.
+    command. Flashes go ahead of queued voltage polls.
     '''
+    priority = 0
 
-    def excecute(self, cmd: list[bytes]) -> None:
-        '''This excecutes the flash command.
+    def parse_args(self, cmd: list[bytes]) -> list[int]:
+        '''This parses the flash time, at most 60 secs.
         '''
         if len(cmd) > 1:
             args = [int(arg) for arg in cmd[1:]]
@@ -68,8 +102,16 @@ class FlashCommandParser(CommandParser):
             args = [FLASH_TIME]
         if args[0] > 60:
             args[0] = 60
-        self.args = args
-        flash_flasher(*args)
+        return args
+
+    def duration(self, cmd: list[bytes]) -> float:
+        return self.parse_args(cmd)[0]
+
+    def excecute(self, cmd: list[bytes]) -> dict:
+        '''This excecutes the flash command.
+        '''
+        self.args = self.parse_args(cmd)
+        return flash_flasher(*self.args)
 
     def format_response(self, resp: dict) -> bytes:
         '''This is the method which takes the flasher's response 
@@ -93,10 +135,13 @@ class InclineFlasherTCPHandler(socketserver.BaseRequestHandler):
 
     It is instantiated once per connection to the server, and must
     override the handle() method to implement communication to the
-    client.
+    client. Connections are handled concurrently; the commands go
+    through the one RadioWorker (worker), and the client is sent
+    QUEUED <position> WAIT <secs> lines while its command waits.
     """
     cmds = {b'FLASH':FlashCommandParser(),
             b'VOLTAGE':VoltageCommandParser()}
+    worker = None
 
 
     @property
@@ -104,31 +149,48 @@ class InclineFlasherTCPHandler(socketserver.BaseRequestHandler):
         return ' '.join([str(key,'utf-8') for key in self.cmds])
 
     @staticmethod
-    def get_response() -> str:
-        '''This function reads the most recent response from the flasher.
+    def run_command(parser: CommandParser, cmd_list: list[bytes]) -> bytes:
+        '''This function excecutes a command on the radio worker and returns
+        the response for the client.
         '''
-        recent_response = Path(FLOPPA_DIR) / 'response_logs.txt'
-        with recent_response.open() as openfile:
-            response = openfile.readlines()[-1]
-        return response+'\n'
-
-    def format_response(self, command: str, response: str) -> str:
-        ''' This function reformats the response string to be human-readable.
-            Adds UTC ISO 8601 time stamp.
+        try:
+            flasher_resp = parser.excecute(cmd_list)
+            if flasher_resp["msg"] == "NOMESSAGE" or flasher_resp["msg"] == "Invalid Message":
+                return bytes("NO RESPONSE FROM FLASHER\n", 'utf-8')
+            return parser.format_response(flasher_resp)
+        except ReplTimeout as e:
+            print(e)
+            return bytes("NO RESPONSE FROM FLASHER\n", 'utf-8')
+        except (ReplError, OSError) as e:
+            print(e)
+            return bytes("NO CONNECTION TO TOWER\n", 'utf-8')
+
+    def submit(self, parser: CommandParser, cmd_list: list[bytes], duration: float):
+        '''This function queues a command on the radio worker, or joins the
+        identical request in flight if the command coalesces.
+        Returns: the RadioJob
         '''
-        formatted_response = ""
-        now = datetime.utcnow().replace(microsecond=0).isoformat(' ')
-        response_dict = ast.literal_eval(response)
-        for k, v in response_dict.items():
-            if k == "SOLA(1)R":
-                k = "SOLAR"
-            if k == "time":
-                continue
-            elif k == "msg":
-                formatted_response += str(command) + " " + now
-            else:
-                formatted_response += " " + k.lower() + " " + str(v)
-        return formatted_response + "\n"
+        key = b' '.join(cmd_list) if parser.coalesce else None
+        return self.worker.submit(lambda: self.run_command(parser, cmd_list),
+                                  str(cmd_list[0], 'utf-8'), parser.priority, duration, key)
+
+    def report_progress(self, job) -> None:
+        '''This function tells the client where its command stands until it
+        has run: its position in line and the expected wait whenever the
+        position changes, then RUNNING once it is on the radio.
+        '''
+        last = None
+        while True:
+            position, wait = self.worker.status(job)
+            state = 'RUNNING' if job.started is not None else position
+            if state != last:
+                if state == 'RUNNING':
+                    self.request.sendall(b'RUNNING\n')
+                else:
+                    self.request.sendall(bytes(f"QUEUED {position} WAIT {wait:.0f}\n", 'utf-8'))
+                last = state
+            if job.done.wait(STATUS_INTERVAL):
+                return
 
     def handle(self) -> None:
         ''' This function handles the request and response between TCP server and client.
@@ -140,26 +202,46 @@ class InclineFlasherTCPHandler(socketserver.BaseRequestHandler):
         print(self.data)
         try:
             parser = self.cmds[cmd_list[0]]
-            parser.excecute(cmd_list)
-            flasher_resp = ast.literal_eval(self.get_response())
-            if flasher_resp["msg"] == "NOMESSAGE" or flasher_resp["msg"] == "Invalid Message":
-                resp = bytes("NO RESPONSE FROM FLASHER\n", 'utf-8')
-            else:
-                resp = parser.format_response(flasher_resp)
-            #resp = self.format_response(' '.join([c.decode('utf-8') for c in cmd_list]), self.get_response())
-        except KeyError:
+            duration = parser.duration(cmd_list)
+        except (KeyError, ValueError):
             resp = f"{str(self.data,'utf-8')}: unrecognized command\nPossible commands: {self.cmd_ids}\n"
-            resp = bytes(resp,'utf-8')
-        self.request.sendall(resp)
-        # send back the flasher response
-        #self.request.sendall(bytes(self.get_response(),'utf-8'))
+            self.request.sendall(bytes(resp,'utf-8'))
+            return
+        state = parser.cache_state()
+        if state is not None:
+            if state == 'stale':
+                self.submit(parser, cmd_list, duration)
+            self.request.sendall(parser.cached_response())
+            return
+        job = self.submit(parser, cmd_list, duration)
+        self.report_progress(job)
+        if job.error is not None:
+            print(job.error)
+            self.request.sendall(bytes("NO CONNECTION TO TOWER\n", 'utf-8'))
+            return
+        self.request.sendall(job.result)
+
+class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''This is the TCP server, with one thread per connection.'''
+    daemon_threads = True
+    allow_reuse_address = True
+    # connections waiting to be accepted, beyond which clients are refused
+    request_queue_size = 64
+
+def serve(address: tuple) -> ThreadedTCPServer:
+    '''This function creates the server and starts its radio worker,
+    which has the tower listen for pushed telemetry between commands,
+    LISTEN_WINDOW secs at a time.
+    '''
+    InclineFlasherTCPHandler.worker = RadioWorker(listen_for_telemetry if LISTEN_WINDOW else None)
+    InclineFlasherTCPHandler.worker.start()
+    return ThreadedTCPServer(address, InclineFlasherTCPHandler)
 
 if __name__ == "__main__":
     HOST, PORT = "0.0.0.0", 9999
 
     # Create the server, binding to localhost on port 9999
-    with socketserver.TCPServer((HOST, PORT), InclineFlasherTCPHandler) as server:
+    with serve((HOST, PORT)) as server:
         # Activate the server; this will keep running until you
         # interrupt the program with Ctrl-C
         server.serve_forever()
-
@@ -0,0 +1,60 @@
+'''Last known voltages of the flasher site, as reported by any response
+or pushed telemetry record, with the time they arrived. A sample up to
+TELEMETRY_MAX_AGE secs old is fresh and answered from here; up to
+TELEMETRY_STALE_AGE it is still answered, while a new one is fetched;
+older samples are not used. A sample keeps only what a VOLTAGE reply
+carries, whichever message it came from.
+'''
+import threading
+import time
+from datetime import datetime
+
+from config import TELEMETRY_MAX_AGE, TELEMETRY_STALE_AGE
+
+# keys of a VOLTAGE reply kept from a message, in the order they are sent
+VOLTAGE_KEYS = ('SOLAR', 'BATT1', 'BATT2', 'lsnr', 'rssi', 'snr')
+
+class TelemetryCache:
+    '''This class holds the last voltage sample. It is shared by the TCP
+    handler threads and the radio worker.
+    '''
+    def __init__(self, max_age: float = TELEMETRY_MAX_AGE, stale_age: float = TELEMETRY_STALE_AGE):
+        self.max_age = max_age
+        self.stale_age = stale_age
+        self.lock = threading.Lock()
+        self.sample = None
+        self.received = None
+
+    def update(self, msg: dict) -> None:
+        '''This method stores the VOLTAGE_KEYS of msg, with the UTC time it
+        arrived under 'time', if it carries voltages.
+        '''
+        msg = dict(msg)
+        if 'SOLA(1)R' in msg:
+            msg['SOLAR'] = msg.pop('SOLA(1)R')
+        if 'SOLAR' not in msg:
+            return
+        sample = {'msg': 'VOLTAGE'}
+        sample.update((key, msg[key]) for key in VOLTAGE_KEYS if key in msg)
+        sample['time'] = datetime.utcnow().replace(microsecond=0).isoformat(' ')
+        with self.lock:
+            self.sample = sample
+            self.received = time.monotonic()
+
+    def get(self) -> tuple:
+        '''This method returns the last sample and its age (secs), or
+        (None, None) if there is none.
+        '''
+        with self.lock:
+            if self.sample is None:
+                return None, None
+            return self.sample, time.monotonic() - self.received
+
+    def state(self) -> str:
+        '''This method returns 'fresh', 'stale' or None if the sample is
+        missing or too old to use.
+        '''
+        sample, age = self.get()
+        if sample is None or age > self.stale_age:
+            return None
+        return 'fresh' if age <= self.max_age else 'stale'
@@ -0,0 +1,234 @@
+'''Columnar store of the flasher responses and pushed telemetry the tower
+hears, so they can be read back without parsing str(dict) log lines.
+Every column is its own append-only file of fixed-size values:
+
+    time      epoch secs                 float64
+    solar     solar panel voltage        float32 (nan if not reported)
+    batt1     battery 1 voltage          float32
+    rssi      rssi at the tower (dBm)    float32
+    snr       snr at the tower (dB)      float32
+    command   message name, an index     uint8
+              into commands.txt
+    status    an index into STATUSES     uint8
+
+Rows are appended in time order. The store keeps a sparse index of the
+time of the first row of every chunk of chunk_rows rows, so a time range
+query reads only the chunks it overlaps. Run as a script it imports an
+existing response log into an empty store:
+
+    python telemetry_store.py response_logs.txt [store directory]
+'''
+import ast
+import bisect
+import math
+import sys
+import threading
+from array import array
+from datetime import datetime
+from pathlib import Path
+
+from config import FLOPPA_DIR, TELEMETRY_STORE
+
+# name, array typecode
+COLUMNS = (('time', 'd'), ('solar', 'f'), ('batt1', 'f'), ('rssi', 'f'),
+           ('snr', 'f'), ('command', 'B'), ('status', 'B'))
+STATUSES = ('OK', 'NO_RESPONSE', 'INVALID', 'PUSHED')
+# messages the flasher site sends without being asked
+PUSHED = ('TELEMETRY',)
+LOG_TIME_FORMAT = "%m/%d/%Y, %H:%M:%S"
+
+def status_of(resp: dict) -> str:
+    '''This function classifies a message dict for the status column.'''
+    msg = resp.get('msg')
+    if msg == 'NOMESSAGE':
+        return 'NO_RESPONSE'
+    if msg == 'Invalid Message' or msg is None:
+        return 'INVALID'
+    if msg in PUSHED:
+        return 'PUSHED'
+    return 'OK'
+
+def value(resp: dict, *keys) -> float:
+    '''This function returns the first of keys present in resp as a
+    float, else nan.
+    '''
+    for key in keys:
+        if key in resp:
+            try:
+                return float(resp[key])
+            except (TypeError, ValueError):
+                return math.nan
+    return math.nan
+
+class TelemetryStore:
+    '''This class appends rows to the column files in directory and reads
+    time ranges back, e.g.
+
+        store = TelemetryStore('telemetry')
+        store.append(time.time(), resp)
+        columns = store.query(start, end)   # {'time': array('d', ...), ...}
+
+    It is shared by the TCP handler threads and the radio worker.
+    '''
+    chunk_rows = 1024
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        commands = self.directory / 'commands.txt'
+        self.commands = commands.read_text().splitlines() if commands.exists() else []
+        self.codes = {name: code for code, name in enumerate(self.commands)}
+        self.rows = self.repair()
+        self.index = self.build_index()
+
+    def path(self, column: str) -> Path:
+        return self.directory / f'{column}.bin'
+
+    def repair(self) -> int:
+        '''This method cuts the columns to the rows all of them hold, in
+        case an append was interrupted part way.
+        Returns: the number of rows.
+        '''
+        sizes = {}
+        for name, typecode in COLUMNS:
+            path = self.path(name)
+            sizes[name] = path.stat().st_size if path.exists() else -1
+        rows = min(max(sizes[name], 0) // array(typecode).itemsize for name, typecode in COLUMNS)
+        for name, typecode in COLUMNS:
+            if sizes[name] != rows * array(typecode).itemsize:
+                with self.path(name).open('ab') as column:
+                    column.truncate(rows * array(typecode).itemsize)
+        return rows
+
+    def build_index(self) -> array:
+        '''This method reads the time of the first row of every chunk.'''
+        index = array('d')
+        with self.path('time').open('rb') as column:
+            for row in range(0, self.rows, self.chunk_rows):
+                column.seek(row * index.itemsize)
+                index.frombytes(column.read(index.itemsize))
+        return index
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def command_code(self, name: str) -> int:
+        '''This method returns the code of a message name, adding it to
+        commands.txt if it is new.
+        '''
+        if name not in self.codes:
+            if len(self.commands) > 255:
+                raise ValueError(f'too many message names for the command column: {name}')
+            with (self.directory / 'commands.txt').open('a') as commands:
+                commands.write(name + '\n')
+            self.codes[name] = len(self.commands)
+            self.commands.append(name)
+        return self.codes[name]
+
+    def append(self, t: float, resp: dict) -> None:
+        '''This method appends one message dict received at epoch time t.'''
+        self.extend([(t, resp)])
+
+    def extend(self, entries) -> None:
+        '''This method appends (epoch time, message dict) pairs, in time
+        order, with one write per column.
+        '''
+        with self.lock:
+            columns = {name: array(typecode) for name, typecode in COLUMNS}
+            for t, resp in entries:
+                columns['time'].append(t)
+                columns['solar'].append(value(resp, 'SOLAR', 'SOLA(1)R'))
+                columns['batt1'].append(value(resp, 'BATT1'))
+                columns['rssi'].append(value(resp, 'rssi'))
+                columns['snr'].append(value(resp, 'snr'))
+                columns['command'].append(self.command_code(str(resp.get('msg'))))
+                columns['status'].append(STATUSES.index(status_of(resp)))
+            for name, typecode in COLUMNS:
+                with self.path(name).open('ab') as column:
+                    columns[name].tofile(column)
+            for i, t in enumerate(columns['time']):
+                if (self.rows + i) % self.chunk_rows == 0:
+                    self.index.append(t)
+            self.rows += len(columns['time'])
+
+    def read(self, name: str, first: int, last: int) -> array:
+        '''This method reads rows first to last (exclusive) of a column.'''
+        values = array(dict(COLUMNS)[name])
+        with self.path(name).open('rb') as column:
+            column.seek(first * values.itemsize)
+            values.frombytes(column.read((last - first) * values.itemsize))
+        return values
+
+    def query(self, start: float = None, end: float = None, columns=None) -> dict:
+        '''This method returns the rows with start <= time < end (either
+        bound may be None), reading only the chunks that overlap them.
+        Returns: a dict of column name to array, with the command column
+        as codes into self.commands.
+        '''
+        names = [name for name, typecode in COLUMNS] if columns is None else list(columns)
+        with self.lock:
+            first_chunk = 0 if start is None else max(bisect.bisect_left(self.index, start) - 1, 0)
+            last_chunk = len(self.index) if end is None else bisect.bisect_left(self.index, end)
+            first = first_chunk * self.chunk_rows
+            last = min(last_chunk * self.chunk_rows, self.rows)
+            if last <= first:
+                return {name: array(dict(COLUMNS)[name]) for name in names}
+            times = self.read('time', first, last)
+            lo = 0 if start is None else bisect.bisect_left(times, start)
+            hi = len(times) if end is None else bisect.bisect_left(times, end)
+            result = {}
+            for name in names:
+                result[name] = times[lo:hi] if name == 'time' else self.read(name, first + lo, first + hi)
+        return result
+
+    def records(self, start: float = None, end: float = None):
+        '''This method yields the rows of a time range as dicts, with the
+        command name, the status and without the unreported values.
+        '''
+        columns = self.query(start, end)
+        for i in range(len(columns['time'])):
+            record = {'time': columns['time'][i],
+                      'msg': self.commands[columns['command'][i]],
+                      'status': STATUSES[columns['status'][i]]}
+            for name in ('solar', 'batt1', 'rssi', 'snr'):
+                if not math.isnan(columns[name][i]):
+                    record[name] = columns[name][i]
+            yield record
+
+def parse_log_line(line: str) -> tuple:
+    '''This function parses a line of a response log written by
+    external_commands.append_to_logfile.
+    Returns: (epoch time, message dict)
+    '''
+    entry = ast.literal_eval(line)
+    t = datetime.strptime(entry.pop('time'), LOG_TIME_FORMAT).timestamp()
+    return t, entry
+
+def import_log(log_path, store: TelemetryStore) -> int:
+    '''This function imports a response log into an empty store. Lines
+    that cannot be parsed are reported and skipped.
+    Returns: the number of rows imported.
+    '''
+    if len(store):
+        raise ValueError(f'{store.directory} already holds {len(store)} rows')
+    entries = []
+    with open(log_path) as log_file:
+        for line in log_file:
+            if not line.strip():
+                continue
+            try:
+                entries.append(parse_log_line(line))
+            except (ValueError, SyntaxError, KeyError, TypeError, AttributeError) as e:
+                print(f'Error processing line: {line!r} Error: {e}')
+    # the log is written in time order, but keep the index valid anyway
+    entries.sort(key=lambda entry: entry[0])
+    store.extend(entries)
+    return len(entries)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    directory = sys.argv[2] if len(sys.argv) > 2 else Path(FLOPPA_DIR) / TELEMETRY_STORE
+    count = import_log(sys.argv[1], TelemetryStore(directory))
+    print(f'imported {count} rows into {directory}')
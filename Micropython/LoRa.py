@@ -1,21 +1,53 @@
 from config import *
-from machine import Pin, SoftSPI, ADC
+from machine import ADC, idle, lightsleep
 from time import sleep
 import utime
-from sx127x import SX127x
+from sx127x import SX127x, PacketRing, MAX_PKT_LENGTH, TX_DONE_MARGIN_MS
+from spi_bus import make_bus
+from adr import AdaptiveDataRate
 from display import Display
+import wire
+import link
+import uasyncio as asyncio
+from random import getrandbits
+from binascii import crc32
 import json
 
 class LoRa:
     '''This class contols the SX127x module on the heltec lora 32 v2'''
-    def __init__(self):
-        self.device_spi = SoftSPI(baudrate = 10000000, 
-                                    polarity = 0, phase = 0, bits = 8, firstbit = SoftSPI.MSB,
-                                    sck = Pin(device_config['sck'], Pin.OUT, Pin.PULL_DOWN),
-                                    mosi = Pin(device_config['mosi'], Pin.OUT, Pin.PULL_UP),
-                                    miso = Pin(device_config['miso'], Pin.IN, Pin.PULL_UP))
-        self.sx1276 = SX127x(self.device_spi, pins=device_config, parameters=lora_parameters)
-        
+    rx_ring = None
+    # data rate in use and link stats added to every sent payload (ADR)
+    parameters = lora_parameters
+    piggyback = {}
+    # link layer state shared by every session (see link.py); msg_id
+    # starts at random so a restarted tower does not reuse recent ids
+    msg_id = getrandbits(8)
+    sent_frames = []
+    reassembler = link.Reassembler(fragment_parameters['reassembly_timeout'] * 1000)
+    # serialises transmissions of concurrent uasyncio tasks
+    tx_lock = None
+    # messages a flasher site sends without being asked, never a response
+    unsolicited = ('TELEMETRY',)
+    # this board's link address; the tower sets it to TOWER_ADDRESS
+    address = NODE_ADDRESS
+
+    def __init__(self, parameters = None):
+        self.device_spi = make_bus(device_config)
+        self.sx1276 = SX127x(self.device_spi, pins=device_config,
+                             parameters=parameters or LoRa.parameters)
+        self.last_rx_airtime = 0.0
+        self.last_sent = None
+        self.acked = None
+        # messages received but not yet returned by wait_for_msg
+        self.pending = []
+        # node messages go to by default: at a flasher site the sender of
+        # the last message received, initially the tower; on the tower
+        # always the first site, so a push does not redirect commands
+        if LoRa.address == TOWER_ADDRESS:
+            self.peer = min(flasher_nodes)
+        else:
+            self.peer = TOWER_ADDRESS
+
     def listen(self):
         '''This method listens for a message.
         Returns: the message as a dict, or an empty dict if no message was received.
@@ -25,24 +57,377 @@ class LoRa:
         else:
             return {'msg': 'NOMESSAGE'}
         
+    def start_listening(self):
+        '''This method puts the radio in interrupt-driven continuous receive,
+        with frames collected in the shared receive ring.
+        '''
+        if LoRa.rx_ring is None:
+            LoRa.rx_ring = PacketRing(RX_RING_SLOTS)
+        self.sx1276.receive_into_ring(LoRa.rx_ring)
+
+    def stop_listening(self):
+        self.sx1276.stop_receiving()
+
+    def wait_for_msg(self, timeout = MSG_TIMEOUT, src = None):
+        '''This method blocks until a message is in the receive ring or the
+        timeout (secs) passes, idling the CPU between interrupts. Fragments
+        are reassembled on the way, missing ones are asked for with a NACK,
+        and NACKs for messages sent from here are answered. If src is given,
+        messages from other nodes are left in pending.
+        Returns: the message as a dict, or {'msg': 'NOMESSAGE'} on timeout.
+        '''
+        for msg in self.pending:
+            if self.expected(msg, src):
+                # received while waiting for an ACK or another node
+                self.pending.remove(msg)
+                return msg
+        self.last_rx_airtime = 0.0
+        start_time = utime.time()
+        gap_ms = self.fragment_gap_ms()
+        while True:
+            frame = self.sx1276.pop_packet()
+            if frame is not None:
+                payload, rssi, snr = frame
+                self.last_rx_airtime += self.sx1276.time_on_air(len(payload))
+                msg = self.receive_frame(payload, rssi, snr)
+                if msg is None:
+                    continue
+                if self.expected(msg, src):
+                    return msg
+                self.pending.append(msg)
+                continue
+            if not waiting_for_timeout(start_time, timeout):
+                return {'msg': 'NOMESSAGE'}
+            if len(LoRa.reassembler):
+                self.request_missing(gap_ms)
+            idle()
+
+    def expected(self, msg, src):
+        '''This method checks if msg comes from node src (any if None) and
+        can be a response, i.e. is not one the node sends on its own.
+        '''
+        if src is None:
+            return True
+        return msg.get('src', src) == src and msg['msg'] not in self.unsolicited
+
+    def rx_stats(self):
+        '''This method returns the receive ring and reassembly counters.'''
+        ring = LoRa.rx_ring
+        stats = {'received': 0, 'dropped': 0, 'overruns': 0}
+        if ring is not None:
+            stats = {'received': ring.received, 'dropped': ring.dropped, 'overruns': ring.overruns}
+        stats['reassembled'] = LoRa.reassembler.completed
+        stats['expired'] = LoRa.reassembler.expired
+        return stats
+
     def parse_payload(self):
-        '''This method loads the json payload data. If an incomplete message is received,
-        an empty dictionary is returned.
+        '''This method decodes the payload data. If an incomplete message is received,
+        an invalid message dict is returned, and for a fragment of a message that
+        is not complete yet a NOMESSAGE dict.
+        '''
+        msg = self.receive_frame(self.sx1276.read_payload(), self.sx1276.packet_rssi(),
+                                 self.sx1276.packet_snr())
+        return {'msg': 'NOMESSAGE'} if msg is None else msg
+
+    def receive_frame(self, frame, rssi, snr):
+        '''This method handles one received link frame (see link.py). A
+        complete message that asks for an ACK is acknowledged right away,
+        and tagged with its sequence number (seq).
+        Frames for other nodes are ignored.
+        Returns: the decoded message dict, or None if the frame was a
+        fragment of an incomplete message, an ACK, a NACK, not for us or
+        too short to hold its header.
+        '''
+        fields = link.parse(frame)
+        if fields is None:
+            return None
+        kind, dst, src, msg_id, index, count, body = fields
+        if dst != LoRa.address and dst != link.BROADCAST:
+            return None
+        if kind == link.FRAME_ACK:
+            self.acked = (src, msg_id)
+            return None
+        if kind == link.FRAME_NACK:
+            self.resend_fragments(src, msg_id, body)
+            return None
+        if kind == link.FRAME_FRAG:
+            body = LoRa.reassembler.add((src, msg_id), index, count, body)
+            if body is None:
+                return None
+        if link.wants_ack(frame):
+            self.send_frames([link.ack(src, LoRa.address, msg_id)])
+        msg = self.decode_payload(body, rssi, snr)
+        if msg_id is not None:
+            msg['seq'] = msg_id
+            msg['src'] = src
+            if LoRa.address != TOWER_ADDRESS:
+                self.peer = src
+        return msg
+
+    def decode_payload(self, payload, rssi, snr):
+        '''This method decodes the payload bytes (binary or json, see wire.py)
+        and tags them with the rssi and snr. If an incomplete message is received, an invalid message dict
+        is returned.
         '''
         try:
-            payload_dict = json.loads(self.sx1276.read_payload())
+            payload_dict = wire.decode(payload)
         except:
             payload_dict = {'msg': 'Invalid Message'}
-        payload_dict['rssi'] = self.sx1276.packet_rssi()
+        payload_dict['rssi'] = rssi
+        payload_dict['snr'] = snr
         return payload_dict
         
         
-    def send(self, payload_dict):
-        '''This method sends a message.
+    def send(self, payload_dict, on_done = None, listen_before_talk = lbt_parameters['enabled'], dst = None):
+        '''This method sends a message, split into fragments if it does not
+        fit one frame (see link.py). It blocks until the message is on air,
+        unless on_done is given, in which case it returns as soon as the
+        last frame is started and on_done(sx127x) is called from its TxDone
+        interrupt.
         Parameters:
         payload_dict: the dict to be sent
+        on_done: optional completion callback
+        listen_before_talk: back off while channel activity is detected
+        dst: the destination node, default the peer
+        Returns: the message's expected time on air in secs
+        '''
+        msg_id, frames = self.frame(payload_dict, dst = dst)
+        return self.send_frames(frames, on_done, listen_before_talk)
+
+    def frame(self, payload_dict, ack = False, dst = None):
+        '''This method encodes a message to node dst (default: the peer)
+        into link frames under the next msg_id, and caches them for
+        retransmission if it is fragmented.
+        Returns: (msg_id, list of frames)
+        '''
+        if LoRa.piggyback:
+            payload_dict = dict(payload_dict)
+            payload_dict.update(LoRa.piggyback)
+        self.last_sent = payload_dict
+        LoRa.msg_id = (LoRa.msg_id + 1) & 0xff
+        if dst is None:
+            dst = self.peer
+        frames = link.fragment(dst, LoRa.address, LoRa.msg_id, self.encode(payload_dict), ack)
+        if len(frames) > 1:
+            LoRa.sent_frames.append((LoRa.msg_id, frames))
+            if len(LoRa.sent_frames) > fragment_parameters['cache_messages']:
+                LoRa.sent_frames.pop(0)
+        return LoRa.msg_id, frames
+
+    def send_reliable(self, payload_dict, wake = False, dst = None):
+        '''This method sends a message that asks for an ACK, and resends it
+        under the same msg_id until it is acknowledged or max_retries is
+        used up. The retransmission timeout doubles per retry, capped at
+        max_rto_ms. A message received while waiting counts as an ACK and
+        is kept for the next wait_for_msg.
+        Parameters:
+        payload_dict: the dict to be sent
+        wake: send every attempt with the duty-cycle wake-up preamble
+        dst: the destination node, default the peer
+        Returns: (time on air in secs of all attempts, True if acknowledged)
+        '''
+        if dst is None:
+            dst = self.peer
+        msg_id, frames = self.frame(payload_dict, ack = True, dst = dst)
+        rto_ms = self.retransmission_timeout_ms()
+        airtime = 0.0
+        for attempt in range(reliability['max_retries'] + 1):
+            if wake:
+                self.sx1276.set_preamble_length(self.wake_preamble_length())
+            airtime += self.send_frames(frames)
+            self.sx1276.set_preamble_length(LoRa.parameters['preamble_length'])
+            self.start_listening()
+            acked = self.wait_for_ack(msg_id, rto_ms, dst)
+            self.stop_listening()
+            if acked:
+                return airtime, True
+            print('No ACK for message {} after {} ms'.format(msg_id, rto_ms))
+            rto_ms = min(2 * rto_ms, reliability['max_rto_ms'])
+        return airtime, False
+
+    def wait_for_ack(self, msg_id, timeout_ms, src):
+        '''This method waits up to timeout_ms for the ACK of msg_id from
+        node src, or for any message from it (which means the ACK was lost
+        but the command got through), idling the CPU between interrupts.
+        Returns: True if acknowledged
         '''
-        self.sx1276.println(json.dumps(payload_dict))
+        self.acked = None
+        start = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), start) < timeout_ms:
+            frame = self.sx1276.pop_packet()
+            if frame is None:
+                idle()
+                continue
+            payload, rssi, snr = frame
+            msg = self.receive_frame(payload, rssi, snr)
+            if msg is not None:
+                self.pending.append(msg)
+                if self.expected(msg, src):
+                    return True
+            if self.acked == (src, msg_id):
+                return True
+        return False
+
+    def retransmission_timeout_ms(self):
+        '''This method returns the initial retransmission timeout: two ACKs
+        on air (one for the receiver's CAD and backoff) plus the turnaround.
+        '''
+        ack_ms = 1000 * self.sx1276.time_on_air(len(link.ack(0, 0, 0)))
+        return int(2 * ack_ms) + reliability['ack_turnaround_ms']
+
+    def send_frames(self, frames, on_done = None, listen_before_talk = lbt_parameters['enabled']):
+        '''This method sends link frames back to back. Only the last one is
+        handed to on_done, if given.
+        Returns: the frames' expected time on air in secs
+        '''
+        airtime = 0.0
+        last = len(frames) - 1
+        for i, frame in enumerate(frames):
+            # a frame sent from a uasyncio task may still be on air
+            self.sx1276.wait_tx_done()
+            if listen_before_talk:
+                self.wait_for_clear_channel()
+            if i == last and on_done is not None:
+                airtime += self.sx1276.transmit(frame, on_done)
+            else:
+                airtime += self.sx1276.println(frame)
+            if i == 0 and last:
+                # a duty-cycled receiver stays awake once woken by the first
+                # frame, so only that one needs a long wake-up preamble
+                self.sx1276.set_preamble_length(LoRa.parameters['preamble_length'])
+        return airtime
+
+    def resend_fragments(self, src, msg_id, missing):
+        '''This method answers a NACK from node src by resending the missing
+        fragments of message msg_id from the cache of sent fragmented
+        messages.
+        '''
+        for cached_id, frames in LoRa.sent_frames:
+            if cached_id == msg_id:
+                print('Resending {} of {} fragments of message {}'.format(
+                    len(missing), len(frames), msg_id))
+                self.send_frames([frames[i] for i in missing if i < len(frames)])
+                return
+        print('NACK for unknown message {}'.format(msg_id))
+
+    def request_missing(self, gap_ms):
+        '''This method sends a NACK for every partial message that got no
+        fragment for gap_ms, at most max_nacks times per message.
+        '''
+        for key, nacks in LoRa.reassembler.stalled(gap_ms):
+            if nacks < fragment_parameters['max_nacks']:
+                src, msg_id = key
+                self.send_frames([link.nack(src, LoRa.address, msg_id, LoRa.reassembler.missing(key))])
+
+    def fragment_gap_ms(self):
+        '''This method returns how long a receiver waits for the next
+        fragment before asking for the missing ones: two full frames on
+        air plus the listen-before-talk backoff budget.
+        '''
+        frame_ms = 1000 * self.sx1276.time_on_air(MAX_PKT_LENGTH)
+        slot_ms = 1000 * self.sx1276.time_on_air(lbt_parameters['slot_bytes'])
+        return int(2 * frame_ms + 16 * slot_ms)
+
+    def encode(self, payload_dict):
+        '''This method encodes a message in the configured WIRE_FORMAT.'''
+        return wire.encode(payload_dict, WIRE_FORMAT == 'binary')
+
+    def wait_for_clear_channel(self):
+        '''This method runs CAD until the channel is clear, backing off a
+        random number of slots (binary exponential) while it is busy.
+        Returns: True if the channel was clear, False if it gave up.
+        '''
+        slot_ms = int(1000 * self.sx1276.time_on_air(lbt_parameters['slot_bytes']))
+        for attempt in range(lbt_parameters['max_attempts']):
+            if not self.sx1276.channel_activity_detected():
+                return True
+            slots = 1 + getrandbits(min(attempt + 1, 4))
+            print('Channel busy, backing off {} ms'.format(slots * slot_ms))
+            utime.sleep_ms(slots * slot_ms)
+        return False
+
+    def max_backoff(self):
+        '''This method returns the longest listen-before-talk backoff
+        (secs) before a transmission, see wait_for_clear_channel.
+        '''
+        if not lbt_parameters['enabled']:
+            return 0.0
+        slot = self.sx1276.time_on_air(lbt_parameters['slot_bytes'])
+        return slot * sum(1 << min(attempt + 1, 4) for attempt in range(lbt_parameters['max_attempts']))
+
+    def wake_preamble_length(self):
+        '''This method returns the preamble length (symbols) that spans one
+        duty-cycle sleep period plus a margin, so a sleeping receiver
+        always wakes up during the preamble of a command.
+        '''
+        symbol_ms = 1000 * self.sx1276.symbol_time()
+        return int(duty_cycle['sleep_ms'] / symbol_ms) + 1 + duty_cycle['margin_symbols']
+
+    def duty_cycle_report(self):
+        '''This method estimates what the duty_cycle settings cost and save:
+        the awake time per period (one CAD), the average supply current
+        against staying awake, and the latency the long preamble adds to
+        every command.
+        '''
+        symbol_ms = 1000 * self.sx1276.symbol_time()
+        awake_ms = 2 * symbol_ms
+        sleep_ms = duty_cycle['sleep_ms']
+        average = ((duty_cycle['current_sleep'] * sleep_ms + duty_cycle['current_awake'] * awake_ms)
+                   / (sleep_ms + awake_ms))
+        added = (self.wake_preamble_length() - lora_parameters['preamble_length']) * symbol_ms / 1000
+        return {'sleep_ms': sleep_ms,
+                'awake_ms': awake_ms,
+                'average_current_ma': average,
+                'always_on_current_ma': duty_cycle['current_awake'],
+                'added_latency_s': added}
+
+    def time_on_air(self, payload_dict):
+        '''This method returns the time on air in secs that sending
+        payload_dict takes with the configured lora_parameters.
+        '''
+        frames = link.fragment(0, 0, 0, self.encode(payload_dict))
+        return sum(self.sx1276.time_on_air(len(frame)) for frame in frames)
+
+    def healthy(self):
+        '''This method checks that the radio still answers and still holds
+        the configuration the driver believes it wrote (a brownout resets
+        the SX127x without the ESP32 noticing).
+        '''
+        return self.sx1276.verify_config()
+
+    async def send_async(self, payload_dict, dst = None):
+        '''This method sends a message to node dst (default: the peer) and
+        completes when TX_DONE fires, leaving the event loop free while the
+        packet is on air.
+        '''
+        msg_id, frames = self.frame(payload_dict, dst = dst)
+        return await self.send_frames_async(frames)
+
+    async def send_frames_async(self, frames):
+        '''This method sends link frames back to back, awaiting TX_DONE of
+        each one instead of blocking.
+        Returns: the frames' expected time on air in secs
+        '''
+        if LoRa.tx_lock is None:
+            LoRa.tx_lock = asyncio.Lock()
+        airtime = 0.0
+        async with LoRa.tx_lock:
+            for frame in frames:
+                if lbt_parameters['enabled']:
+                    self.wait_for_clear_channel()
+                done = asyncio.ThreadSafeFlag()
+                frame_airtime = self.sx1276.transmit(frame, lambda radio: done.set())
+                airtime += frame_airtime
+                if 'dio_0' in device_config:
+                    try:
+                        await asyncio.wait_for(done.wait(), frame_airtime + TX_DONE_MARGIN_MS / 1000)
+                    except asyncio.TimeoutError:
+                        # TxDone missed: completes from the flag or raises
+                        self.sx1276.wait_tx_done()
+                else:
+                    while not self.sx1276.tx_done():
+                        await asyncio.sleep_ms(10)
+        return airtime
 
 class Command:
     '''This is the base class for commands that the esp32 can
@@ -50,9 +435,53 @@ class Command:
     and the implementation must be added to the control class's
     command dictionary.
     '''
+    radio = None
+    # replies are collected here instead of sent while a BATCH runs
+    captured = None
+    # the same for BATCH steps run by the uasyncio loop, per task
+    captured_tasks = {}
+    # set by the uasyncio operation loop: replies are sent from a task
+    async_replies = False
+
     def excecute(self, msg):
         '''This method should be overridden by the specific command implementation'''
         pass
+
+    def captured_replies(self):
+        '''This method returns the list a reply is collected in instead of
+        being sent (a BATCH step), or None.
+        '''
+        if Command.captured is not None:
+            return Command.captured
+        if Command.captured_tasks:
+            return Command.captured_tasks.get(asyncio.current_task())
+        return None
+
+    def reply(self, payload_dict):
+        '''This method sends a response over the radio session of the
+        FlasherOperation the command belongs to.
+        '''
+        captured = self.captured_replies()
+        if captured is not None:
+            captured.append(payload_dict)
+            return 0.0
+        radio = self.radio or LoRa()
+        if Command.async_replies:
+            msg_id, frames = radio.frame(payload_dict)
+            asyncio.create_task(radio.send_frames_async(frames))
+            return sum(radio.sx1276.time_on_air(len(frame)) for frame in frames)
+        return radio.send(payload_dict)
+
+    async def reply_async(self, payload_dict):
+        '''This method sends a response from the uasyncio loop and completes
+        once it is on air.
+        '''
+        captured = self.captured_replies()
+        if captured is not None:
+            captured.append(payload_dict)
+            return 0.0
+        radio = self.radio or LoRa()
+        return await radio.send_async(payload_dict)
     
     def display_on_lcd(self, msg):
         '''This method displays the message on the LCD
@@ -85,6 +514,15 @@ def waiting_for_timeout(start_time, timeout_time = 10):
     '''
     return (utime.time() - start_time) < timeout_time
 
+def batch_step_msg(step):
+    '''This function returns the command message of one BATCH step, given
+    as [command, delay after (secs)] or [command, delay, {arguments}].
+    '''
+    msg = {'msg': step[0]}
+    if len(step) > 2:
+        msg.update(step[2])
+    return msg
+
 def write_msg_log(msg):
     '''This function writes the response from the flasher module to the
     file recent_response_log.txt
@@ -92,6 +530,18 @@ def write_msg_log(msg):
     with open('recent_response_log.txt', 'w') as log_file:
         log_file.write(str(msg) + ' \n')
 
+# first character of a record line on the USB console
+RECORD_START = '\x1e'
+
+def emit_record(msg):
+    '''This function prints a decoded message on the USB console as one
+    framed line for the host (External_Commands/repl_link.py):
+    RECORD_START, the message as JSON, a space and the CRC32 of the JSON
+    in hex.
+    '''
+    body = json.dumps(msg)
+    print('{}{} {:08x}'.format(RECORD_START, body, crc32(body.encode())))
+
 class FlasherOperation:
     '''This is the interface class for point to point communication 
     between flasher controllers in the field. Subclasses need to define
@@ -101,23 +551,244 @@ class FlasherOperation:
     cmds = {'NOMESSAGE':NoMessage(),
             'INVALIDMESSAGE':InvalidMessage()
             }
+
+    # cumulative time on air (secs) per direction, and the last exchange
+    airtime_tx = 0.0
+    airtime_rx = 0.0
+    last_rx_airtime = 0.0
+    last_rx_ticks = 0
+    last_latency = None
+    adr = AdaptiveDataRate()
+    # ticks_ms of the last message heard from the flasher site
+    last_heard_ticks = None
+    _radio = None
+
+    @property
+    def radio(self):
+        '''This is the long-lived radio session (a LoRa object) shared by
+        this operation and its commands. It is built on first use and
+        kept across commands, so the bus, pins and modem configuration
+        are set up once instead of per send and listen.
+        '''
+        if self._radio is None:
+            self._radio = LoRa()
+            for command in self.cmds.values():
+                command.radio = self._radio
+        return self._radio
+
+    def reinit_radio(self):
+        '''This method drops the radio session and builds a new one. It is
+        called when the radio raises an error or fails its health check.
+        '''
+        print('Reinitialising radio')
+        self._radio = None
+        return self.radio
+
+    def check_radio(self, error = None):
+        '''This method reinitialises the radio session after an error, or
+        if the radio no longer holds its configuration.
+        '''
+        if error is not None:
+            print('Radio error: {}'.format(error))
+        if error is not None or not self.radio.healthy():
+            self.reinit_radio()
             
     def create_cmd_msg(self, cmd):
         '''This method returns a command message dictionary to be used as
         a transmission payload'''
         return {'msg': cmd}
     
-    def send_cmd(self, cmd, **kwargs):
-        '''This method sends a command over LORA, then listens for a 
-        response command.
+    def send_cmd(self, cmd, dst = None, **kwargs):
+        '''This method sends a command over LORA to node dst (default: the
+        peer, see LoRa), then listens for its response command. Messages
+        from other nodes that arrive meanwhile are decoded afterwards.
+        Returns: the response message dict, {'msg': 'NOMESSAGE'} if none.
         '''
         command = {'msg': cmd}
         if kwargs:
             for key in kwargs:
                 command[key] = kwargs[key]
         print(command)
-        LoRa().send(command)
-        self.listen_for_cmd()
+        try:
+            lora = self.radio
+            if dst is None:
+                dst = lora.peer
+            if adr_parameters['enabled']:
+                self.sync_data_rate(self.time_to_air(command))
+            start = utime.ticks_ms()
+            if reliability['enabled']:
+                # the flasher site samples the channel once per sleep period
+                tx_airtime, acked = lora.send_reliable(command, wake = duty_cycle['enabled'], dst = dst)
+            else:
+                if duty_cycle['enabled']:
+                    lora.sx1276.set_preamble_length(lora.wake_preamble_length())
+                tx_airtime, acked = lora.send(command, dst = dst), True
+                lora.sx1276.set_preamble_length(LoRa.parameters['preamble_length'])
+        except OSError as e:
+            self.check_radio(e)
+            msg = {'msg': 'NOMESSAGE'}
+            self.decode_cmd(msg)
+            return msg
+        self.airtime_tx += tx_airtime
+        if acked:
+            msg = self.listen_for_cmd(self.response_timeout(command), src = dst)
+        else:
+            print('Command not acknowledged')
+            msg = {'msg': 'NOMESSAGE'}
+            self.last_rx_airtime = 0.0
+            self.check_radio()
+            self.decode_cmd(msg)
+        self.report_latency(start, tx_airtime)
+        self.heard(msg)
+        if adr_parameters['enabled']:
+            self.adapt_data_rate(msg)
+        while lora.pending:
+            self.decode_cmd(lora.pending.pop(0))
+        return msg
+
+    def response_timeout(self, command):
+        '''This method returns how long (secs) to wait for the response to
+        a command once it is on air (and acknowledged): its excecution and
+        a full response frame on air, plus the turnaround. A response held
+        back by a busy channel at the flasher site is given up on.
+        '''
+        lora = self.radio
+        return (self.command_duration(command) + lora.sx1276.time_on_air(MAX_PKT_LENGTH)
+                + reliability['ack_turnaround_ms'] / 1000)
+
+    def exchange_timeout(self, command):
+        '''This method returns the longest send_cmd takes for a command
+        (secs): every attempt on air after the longest channel access
+        backoff, with its retransmission timeout, the response, and the
+        data rate negotiation that may follow. The host sets its deadline
+        from it.
+        '''
+        lora = self.radio
+        airtime = self.time_to_air(command)
+        timeout = self.response_timeout(command)
+        if reliability['enabled']:
+            rto_ms = lora.retransmission_timeout_ms()
+            for attempt in range(reliability['max_retries'] + 1):
+                timeout += airtime + rto_ms / 1000
+                rto_ms = min(2 * rto_ms, reliability['max_rto_ms'])
+        else:
+            timeout += airtime
+        if adr_parameters['enabled'] and command['msg'] != 'SET_DR':
+            # waiting out a flasher site reset, and the negotiation after
+            timeout += airtime + adr_parameters['reset_margin']
+            timeout += self.exchange_timeout({'msg': 'SET_DR', 'dr': 0})
+        return timeout
+
+    def time_to_air(self, command):
+        '''This method returns the longest time (secs) until a command is
+        through to the flasher site on its first attempt: channel access
+        backoff, the wake preamble and its time on air.
+        '''
+        lora = self.radio
+        airtime = lora.time_on_air(command) + lora.max_backoff()
+        if duty_cycle['enabled']:
+            airtime += duty_cycle['sleep_ms'] / 1000
+        return airtime
+
+    def command_duration(self, command):
+        '''This method returns how long (secs) the flasher site takes to
+        excecute a command before it replies, beyond the radio exchange.
+        '''
+        if command['msg'] == 'FLASH_FLASHER':
+            return command.get('time', 0) + 1
+        if command['msg'] == 'BATCH':
+            duration = 0
+            for step in command.get('steps', []):
+                duration += self.command_duration(batch_step_msg(step)) + step[1]
+            return duration
+        return 0
+
+    def heard(self, msg):
+        '''This method records when the flasher site was last heard from:
+        it resets MSG_TIMEOUT after its last message at the latest.
+        '''
+        if not self.waiting_for_msg(msg) and msg.get('msg') != 'Invalid Message':
+            self.last_heard_ticks = utime.ticks_ms()
+
+    def sync_data_rate(self, lead = 0):
+        '''This method returns to the default data rate once the flasher
+        site has reset, which it does after MSG_TIMEOUT without a command
+        and comes back at the default rate. A message on air for lead secs
+        that would reach the site around its reset waits for the reset.
+        '''
+        if self.adr.index == 0 or self.last_heard_ticks is None:
+            return
+        silent = utime.ticks_diff(utime.ticks_ms(), self.last_heard_ticks) / 1000
+        if silent + lead < MSG_TIMEOUT:
+            return
+        reset_after = MSG_TIMEOUT + adr_parameters['reset_margin']
+        if silent < reset_after:
+            sleep(reset_after - silent)
+        print('Flasher site has reset, back to the default data rate')
+        self.set_data_rate(0)
+
+    def adapt_data_rate(self, msg):
+        '''This method steps the data rate from the link stats of the last
+        exchange: the SNR the flasher site measured on the command (lsnr)
+        and the SNR measured here on its response. If the response was
+        lost at a faster rate, both ends fall back to the default (the
+        flasher site resets after MSG_TIMEOUT without a command, see
+        sync_data_rate).
+        '''
+        if self.waiting_for_msg(msg):
+            if self.adr.index > 0:
+                print('Link lost, falling back to the default data rate')
+                self.set_data_rate(0)
+            return
+        if 'lsnr' not in msg or 'snr' not in msg:
+            return
+        proposal = self.adr.propose(msg['lsnr'], msg['snr'])
+        if proposal is not None:
+            self.negotiate_data_rate(proposal)
+
+    def negotiate_data_rate(self, index):
+        '''This method asks the flasher site to switch to data rate index.
+        Both ends switch only after the acknowledgement, which is sent at
+        the old rate.
+        '''
+        lora = self.radio
+        tx_airtime, acked = lora.send_reliable({'msg': 'SET_DR', 'dr': index},
+                                               wake = duty_cycle['enabled'])
+        lora.start_listening()
+        reply = lora.wait_for_msg(2 * tx_airtime + 2, lora.peer) if acked else {}
+        lora.stop_listening()
+        if reply.get('msg') == 'SET_DR' and reply.get('dr') == index:
+            self.heard(reply)
+            self.set_data_rate(index)
+        else:
+            print('No data rate acknowledgement, staying at {}'.format(self.adr.index))
+
+    def set_data_rate(self, index):
+        '''This method switches the radio session, and any rebuilt one, to
+        data rate index.
+        '''
+        self.adr.index = index
+        LoRa.parameters = self.adr.parameters()
+        self.radio.sx1276.set_channel(LoRa.parameters)
+        print('Data rate {}: {}'.format(index, LoRa.parameters))
+
+    def report_latency(self, start, tx_airtime):
+        '''This method compares the time on air of the command and its
+        response with the measured time from transmit start to reception.
+        '''
+        if not self.last_rx_airtime:
+            self.last_latency = {'expected': None, 'measured': None}
+            print('Latency: no response (command {:.2f} s on air)'.format(tx_airtime))
+            return
+        expected = tx_airtime + self.last_rx_airtime
+        measured = utime.ticks_diff(self.last_rx_ticks, start) / 1000
+        self.last_latency = {'expected': expected, 'measured': measured}
+        print('Latency: {:.2f} s on air expected ({:.2f} s cmd + {:.2f} s response), {:.2f} s measured'.format(
+            expected, tx_airtime, self.last_rx_airtime, measured))
+
+    def airtime(self):
+        '''This method returns the cumulative time on air per direction.'''
+        return {'tx': self.airtime_tx, 'rx': self.airtime_rx}
         
     def waiting_for_msg(self, msg):
         '''This method checks if a command message has been received.
@@ -129,17 +800,69 @@ class FlasherOperation:
         except:
             return True
 
-    def listen_for_cmd(self):
-        '''This method listens for an incoming LORA signal. If one is
-        received, it decodes the command and excecutes it.
+    def listen_for_cmd(self, timeout = MSG_TIMEOUT, src = None):
+        '''This method listens for an incoming LORA signal for up to timeout
+        secs, from node src if given. If one is received, it decodes the
+        command and excecutes it.
+        Returns: the received message dict.
         '''
-        start_time = utime.time()
         #Display().display_text('Listening...')
-        msg = {'msg':'NOMESSAGE'}
-        lora = LoRa()
-        while self.waiting_for_msg(msg) and waiting_for_timeout(start_time, MSG_TIMEOUT):
-            msg = lora.listen()
+        lora = self.radio
+        try:
+            lora.start_listening()
+            msg = lora.wait_for_msg(timeout, src)
+            self.last_rx_ticks = utime.ticks_ms()
+            lora.stop_listening()
+        except OSError as e:
+            self.check_radio(e)
+            msg = {'msg': 'NOMESSAGE'}
+        if self.waiting_for_msg(msg):
+            self.check_radio()
+        self.last_rx_airtime = lora.last_rx_airtime
+        self.airtime_rx += lora.last_rx_airtime
+        self.decode_cmd(msg)
+        return msg
+
+    def listen_duty_cycled(self):
+        '''This method is the low power variant of listen_for_cmd. Radio and
+        ESP32 sleep between receive windows; each wake-up runs a CAD and
+        only opens an RX_SINGLE window when a (long) preamble is on air.
+        Gives up with NOMESSAGE after MSG_TIMEOUT like listen_for_cmd.
+        Returns: the received message dict.
+        '''
+        lora = self.radio
+        radio = lora.sx1276
+        wake_preamble = lora.wake_preamble_length()
+        window_ms = int(1000 * radio.time_on_air(MAX_PKT_LENGTH))
+        msg = {'msg': 'NOMESSAGE'}
+        lora.last_rx_airtime = 0.0
+        start_time = utime.time()
+        while waiting_for_timeout(start_time, MSG_TIMEOUT):
+            radio.set_preamble_length(wake_preamble)
+            radio.sleep()
+            lightsleep(duty_cycle['sleep_ms'])
+            if not radio.channel_activity_detected():
+                continue
+            payload = radio.receive_single(duty_cycle['rx_symbol_timeout'], window_ms)
+            if payload is not None:
+                airtime = radio.time_on_air(len(payload))
+            # the ACK and any reply go out with the normal preamble
+            radio.set_preamble_length(LoRa.parameters['preamble_length'])
+            if payload is not None:
+                msg = lora.receive_frame(payload, radio.packet_rssi(), radio.packet_snr())
+                if msg is None:
+                    # the rest of a fragmented message follows right away
+                    lora.start_listening()
+                    msg = lora.wait_for_msg(fragment_parameters['reassembly_timeout'])
+                    lora.stop_listening()
+                lora.last_rx_airtime += airtime
+                break
+        self.last_rx_ticks = utime.ticks_ms()
+        radio.set_preamble_length(LoRa.parameters['preamble_length'])
+        self.last_rx_airtime = lora.last_rx_airtime
+        self.airtime_rx += lora.last_rx_airtime
         self.decode_cmd(msg)
+        return msg
 
     def get_command_obj(self, msg):
         '''This method retrieves the appropriate command class requested
@@ -155,9 +878,12 @@ class FlasherOperation:
         the appropriate command class.
         '''
         command = self.get_command_obj(msg)
+        if RESPONSE_OUTPUT == 'stream':
+            emit_record(msg)
         print(command)
         command.excecute(msg)
-        write_msg_log(msg)
+        if RESPONSE_OUTPUT == 'file':
+            write_msg_log(msg)
         print('cmd excecuted')
             
     def listen_for_time(self, time):
@@ -1,10 +1,19 @@
 from floppaREC import *
+from config import duty_cycle, async_parameters
 
 def main():
     '''Create the flopparec class and isten for a command forever.
     '''
+    if async_parameters['enabled']:
+        asyncio.run(AsyncFlasherOperationRec().run())
     fl = FlasherOperationRec()
+    if duty_cycle['enabled']:
+        print(fl.radio.duty_cycle_report())
+        while True:
+            fl.push_telemetry()
+            fl.listen_duty_cycled()
     while True:
+        fl.push_telemetry()
         fl.listen_for_cmd()
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+from config import lora_parameters, adr_parameters
+from sx127x import BANDWIDTHS, bandwidth_setting
+import math
+
+# SNR (dB) the SX127x needs to demodulate each spreading factor
+REQUIRED_SNR = {6: -5, 7: -7.5, 8: -10, 9: -12.5, 10: -15, 11: -17.5, 12: -20}
+
+class AdaptiveDataRate:
+    '''This class tracks the data rate both ends of the link use. Data
+    rates are indices into adr_parameters['profiles'], ordered from the
+    robust default (index 0, plain lora_parameters) to the fastest. The
+    decision uses the SNR each end measured on the last exchange.
+    '''
+    def __init__(self, profiles = adr_parameters['profiles']):
+        self.profiles = profiles
+        self.index = 0
+
+    def parameters(self, index = None):
+        '''This method returns the full lora parameters of a data rate.'''
+        params = dict(lora_parameters)
+        params.update(self.profiles[self.index if index is None else index])
+        return params
+
+    def predicted_margin(self, snr, index):
+        '''This method predicts the SNR margin (dB above the demodulation
+        floor) at data rate index, from snr measured at the current one.
+        A wider bandwidth lets in proportionally more noise, and a TX
+        power change shifts the received signal one to one.
+        '''
+        current = self.parameters()
+        target = self.parameters(index)
+        bandwidth_ratio = (BANDWIDTHS[bandwidth_setting(target['signal_bandwidth'])]
+                           / BANDWIDTHS[bandwidth_setting(current['signal_bandwidth'])])
+        snr = (snr
+               - 10 * math.log10(bandwidth_ratio)
+               + target['tx_power_level'] - current['tx_power_level'])
+        return snr - REQUIRED_SNR[target['spreading_factor']]
+
+    def propose(self, uplink_snr, downlink_snr):
+        '''This method returns the data rate index to step to, or None to
+        stay. It steps down when the weaker direction is below min_margin,
+        and up when the faster rate would still keep step_up_margin.
+        '''
+        worst = min(uplink_snr, downlink_snr)
+        if self.index > 0 and self.predicted_margin(worst, self.index) < adr_parameters['min_margin']:
+            return self.index - 1
+        if (self.index + 1 < len(self.profiles)
+                and self.predicted_margin(worst, self.index + 1) >= adr_parameters['step_up_margin']):
+            return self.index + 1
+        return None
+
+    def fall_back(self):
+        '''This method returns to the robust default data rate.'''
+        self.index = 0
@@ -0,0 +1,231 @@
+from config import MSG_TIMEOUT, RESPONSE_OUTPUT, reliability, async_parameters, adr_parameters
+from LoRa import LoRa, Command, write_msg_log, emit_record
+from display import Display
+import uasyncio as asyncio
+import utime
+
+class AsyncFlasherOperation:
+    '''This is the uasyncio variant of FlasherOperation, to be mixed in
+    ahead of a FlasherOperation subclass, e.g.
+
+        class AsyncFlasherOperationRec(AsyncFlasherOperation, FlasherOperationRec)
+
+    run() starts separate tasks for radio reception, telemetry sampling and
+    display/log refresh, and every received command is excecuted in a task
+    of its own, so a long command (a flash) does not keep the controller
+    from hearing and excecuting the next one. Commands may define an
+    async excecute_async(msg); the plain excecute(msg) is used otherwise,
+    and replies are sent from a task of their own.
+    The mixin does not call super(), since MicroPython resolves multiple
+    inheritance depth first; the subclass's __init__ calls both.
+    '''
+    # commands whose arrival cancels running ones, e.g.
+    # {'FLASHER_CEASEFIRE': ('FLASH_FLASHER',)}
+    cancels = {}
+
+    def __init__(self):
+        self.running = {}
+        self.telemetry = None
+        self.last_msg = None
+        self.log_pending = False
+        self._reply = None
+        self._reply_from = None
+        self._reply_event = asyncio.Event()
+        Command.async_replies = True
+
+    async def run(self):
+        '''This method runs the operation's tasks forever.'''
+        asyncio.create_task(self.telemetry_loop())
+        asyncio.create_task(self.display_loop())
+        await self.receive_loop()
+
+    async def receive_loop(self):
+        '''This task keeps the radio session in interrupt-driven receive and
+        dispatches every complete message. It asks for missing fragments,
+        and checks the radio after MSG_TIMEOUT without a frame. With ADR it
+        also falls back to the default data rate then, as the reset after
+        MSG_TIMEOUT does in the blocking loop.
+        '''
+        frame_ready = asyncio.ThreadSafeFlag()
+        lora = None
+        while True:
+            if lora is not self.radio:
+                lora = self.radio
+                lora.sx1276.on_frame = frame_ready.set
+                lora.start_listening()
+            gap_ms = lora.fragment_gap_ms()
+            timeout = gap_ms / 1000 if len(LoRa.reassembler) else MSG_TIMEOUT
+            try:
+                await asyncio.wait_for(frame_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                if len(LoRa.reassembler):
+                    lora.request_missing(gap_ms)
+                else:
+                    self.check_radio()
+                    if adr_parameters['enabled'] and self.adr.index > 0:
+                        self.set_data_rate(0)
+                        self.radio.start_listening()
+                continue
+            frame = lora.sx1276.pop_packet()
+            while frame is not None:
+                payload, rssi, snr = frame
+                airtime = lora.sx1276.time_on_air(len(payload))
+                self.airtime_rx += airtime
+                self.last_rx_airtime = airtime
+                self.last_rx_ticks = utime.ticks_ms()
+                msg = lora.receive_frame(payload, rssi, snr)
+                if msg is not None:
+                    self.dispatch(msg)
+                frame = lora.sx1276.pop_packet()
+
+    def dispatch(self, msg):
+        '''This method hands a received message to a waiting send_cmd, and
+        starts its excecution task after cancelling the tasks it cancels.
+        '''
+        if RESPONSE_OUTPUT == 'stream':
+            emit_record(msg)
+        if self._reply_from is not None and self.radio.expected(msg, self._reply_from):
+            self._reply = msg
+            self._reply_event.set()
+        for name in self.cancels.get(msg['msg'], ()):
+            task = self.running.get(name)
+            if task is not None:
+                print('{} cancels {}'.format(msg['msg'], name))
+                task.cancel()
+        self.running[msg['msg']] = asyncio.create_task(self.command_task(msg))
+
+    async def command_task(self, msg):
+        '''This is the task a received command runs in. It leaves running
+        alone if a newer task of the same command has taken its place.
+        '''
+        try:
+            await self.run_command(msg)
+        except asyncio.CancelledError:
+            print('cmd cancelled')
+        finally:
+            if self.running.get(msg['msg']) is asyncio.current_task():
+                self.running.pop(msg['msg'])
+
+    async def run_command(self, msg):
+        '''This method excecutes one command and queues the message for the
+        display and log task.
+        '''
+        command = self.get_command_obj(msg)
+        print(command)
+        if hasattr(command, 'excecute_async'):
+            await command.excecute_async(msg)
+        else:
+            command.excecute(msg)
+        print('cmd excecuted')
+        self.last_msg = msg
+        self.log_pending = True
+
+    async def send_cmd(self, cmd, dst = None, **kwargs):
+        '''This method sends a command to node dst (default: the peer) and
+        awaits its response, resending the command (same sequence number)
+        until it is acknowledged as FlasherOperation.send_cmd does, without
+        blocking the other tasks.
+        Returns: the response message dict, {'msg': 'NOMESSAGE'} if none.
+        '''
+        command = {'msg': cmd}
+        command.update(kwargs)
+        print(command)
+        lora = self.radio
+        if dst is None:
+            dst = lora.peer
+        msg_id, frames = lora.frame(command, ack = reliability['enabled'], dst = dst)
+        rto_ms = lora.retransmission_timeout_ms()
+        self._reply = None
+        self._reply_from = dst
+        self._reply_event.clear()
+        start = utime.ticks_ms()
+        acked = False
+        for attempt in range(reliability['max_retries'] + 1):
+            lora.acked = None
+            self.airtime_tx += await lora.send_frames_async(frames)
+            if not reliability['enabled']:
+                acked = True
+                break
+            acked = await self.wait_for_ack(lora, dst, msg_id, rto_ms)
+            if acked:
+                break
+            print('No ACK for message {} after {} ms'.format(msg_id, rto_ms))
+            rto_ms = min(2 * rto_ms, reliability['max_rto_ms'])
+        msg = {'msg': 'NOMESSAGE'}
+        if acked:
+            try:
+                await asyncio.wait_for(self._reply_event.wait(), self.response_timeout(command))
+                msg = self._reply
+            except asyncio.TimeoutError:
+                pass
+        self._reply_from = None
+        if self.waiting_for_msg(msg):
+            self.dispatch(msg)
+        print('Response after {} ms'.format(utime.ticks_diff(utime.ticks_ms(), start)))
+        return msg
+
+    async def wait_for_ack(self, lora, src, msg_id, timeout_ms):
+        '''This method awaits the ACK of msg_id from node src, which
+        receive_loop records in the radio session, or any message from it
+        (the ACK was lost).
+        Returns: True if acknowledged
+        '''
+        start = utime.ticks_ms()
+        while utime.ticks_diff(utime.ticks_ms(), start) < timeout_ms:
+            if lora.acked == (src, msg_id) or self._reply is not None:
+                return True
+            await asyncio.sleep_ms(10)
+        return False
+
+    def sample_telemetry(self):
+        '''This method returns a telemetry sample (dict), or None if the
+        operation has none. Subclasses override it.
+        '''
+        return None
+
+    async def publish_telemetry(self, sample):
+        '''This method is called with every telemetry sample. Subclasses
+        override it to send samples over the radio.
+        '''
+        pass
+
+    async def telemetry_loop(self):
+        '''This task samples telemetry every telemetry_interval secs.'''
+        while True:
+            sample = self.sample_telemetry()
+            if sample is None:
+                return
+            sample['ticks'] = utime.ticks_ms()
+            self.telemetry = sample
+            self.log_pending = True
+            try:
+                await self.publish_telemetry(sample)
+            except OSError as e:
+                self.check_radio(e)
+            await asyncio.sleep(async_parameters['telemetry_interval'])
+
+    async def display_loop(self):
+        '''This task shows the last message and telemetry sample on the
+        display and writes the message log, off the command path.
+        '''
+        try:
+            display = Display()
+        except OSError:
+            display = None
+        while True:
+            await asyncio.sleep(async_parameters['display_interval'])
+            if not self.log_pending:
+                continue
+            self.log_pending = False
+            lines = []
+            if self.last_msg is not None:
+                if RESPONSE_OUTPUT == 'file':
+                    write_msg_log(self.last_msg)
+                lines.append(str(self.last_msg['msg']))
+                lines.append('rssi ' + str(self.last_msg.get('rssi')))
+            if self.telemetry is not None:
+                for key in self.telemetry:
+                    if key != 'ticks':
+                        lines.append('{} {}'.format(key, self.telemetry[key]))
+            if display is not None:
+                display.display_lines(lines)
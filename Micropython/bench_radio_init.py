@@ -0,0 +1,35 @@
+from config import device_config, lora_parameters
+from sx127x import SX127x
+from spi_bus import make_bus
+import sx127x
+import utime
+
+REPEATS = 10
+
+def time_init(bus, shadow_registers):
+    '''This function returns the mean SX127x construction time in us.'''
+    start = utime.ticks_us()
+    for i in range(REPEATS):
+        radio = SX127x(bus, pins=device_config, parameters=lora_parameters,
+                       shadow_registers=shadow_registers)
+    return utime.ticks_diff(utime.ticks_us(), start) / REPEATS, radio
+
+def time_reconfig(radio, parameters):
+    '''This function returns the set_channel time in us.'''
+    start = utime.ticks_us()
+    radio.set_channel(parameters)
+    return utime.ticks_diff(utime.ticks_us(), start)
+
+def main(bus = None):
+    sx127x.__DEBUG__ = False
+    bus = bus or make_bus(device_config)
+    faster = dict(lora_parameters, spreading_factor = 9, signal_bandwidth = 250E3)
+    for shadow in (False, True):
+        init_us, radio = time_init(bus, shadow)
+        print('shadow {:<5}  init: {:>8.0f} us  set_channel: {:>6} us  same channel: {:>6} us'.format(
+            str(shadow), init_us,
+            time_reconfig(radio, faster), time_reconfig(radio, faster)))
+        radio.set_channel(lora_parameters)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+from LoRa import LoRa
+import sx127x
+import utime
+
+REPEATS = 10
+
+def main():
+    '''This function measures the radio setup that the persistent session
+    removes. Before, every send_cmd built two LoRa objects (send and
+    listen) and the flasher site two per command (listen and response).
+    '''
+    sx127x.__DEBUG__ = False
+    start = utime.ticks_us()
+    for i in range(REPEATS):
+        LoRa()
+    setup_us = utime.ticks_diff(utime.ticks_us(), start) / REPEATS
+
+    lora = LoRa()
+    start = utime.ticks_us()
+    for i in range(REPEATS):
+        lora.healthy()
+    check_us = utime.ticks_diff(utime.ticks_us(), start) / REPEATS
+
+    print('LoRa() setup: {:.0f} us, per command before: {:.0f} us'.format(setup_us, 2 * setup_us))
+    print('session health check: {:.0f} us (only after a timeout or error)'.format(check_us))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+from config import device_config, lora_parameters
+from sx127x import SX127x, REG_VERSION, REG_FIFO_ADDR_PTR, MAX_PKT_LENGTH
+from spi_bus import SoftSPIBus, HardSPIBus, HSPI, VSPI
+import sx127x
+import utime
+
+REG_READS = 1000
+PACKETS = 20
+
+def bench(radio, label):
+    '''This function reports register reads per second and the time to
+    move one full packet into and out of the FIFO over radio's bus.
+    '''
+    start = utime.ticks_us()
+    for i in range(REG_READS):
+        radio.read_register(REG_VERSION)
+    reads_us = utime.ticks_diff(utime.ticks_us(), start)
+
+    packet = bytearray(MAX_PKT_LENGTH)
+    start = utime.ticks_us()
+    for i in range(PACKETS):
+        radio.write_register(REG_FIFO_ADDR_PTR, 0)
+        radio.write_fifo(packet)
+    write_us = utime.ticks_diff(utime.ticks_us(), start) / PACKETS
+
+    start = utime.ticks_us()
+    for i in range(PACKETS):
+        radio.write_register(REG_FIFO_ADDR_PTR, 0)
+        radio.read_fifo_into(packet)
+    read_us = utime.ticks_diff(utime.ticks_us(), start) / PACKETS
+
+    print('{:<8} reads/s: {:>9.0f}  packet write: {:>8.0f} us  packet read: {:>8.0f} us'.format(
+        label, REG_READS * 1E6 / reads_us, write_us, read_us))
+
+def backends(config):
+    '''Yields (label, bus factory) for every backend on this board.'''
+    yield 'soft', lambda: SoftSPIBus(config)
+    yield 'vspi', lambda: HardSPIBus(config, VSPI)
+    yield 'hspi', lambda: HardSPIBus(config, HSPI)
+
+def main(config = device_config):
+    sx127x.__DEBUG__ = False
+    for label, factory in backends(config):
+        try:
+            bus = factory()
+        except Exception as e:
+            print('{:<8} unavailable: {}'.format(label, e))
+            continue
+        bench(SX127x(bus, pins=config, parameters=lora_parameters), label)
+        if hasattr(bus.spi, 'deinit'):
+            bus.spi.deinit()
+
+if __name__ == '__main__':
+    main()
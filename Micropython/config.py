@@ -14,6 +14,11 @@
 #
 
 MSG_TIMEOUT = 60 #Timeout in seconds
+RX_RING_SLOTS = 4 #Received frames buffered between interrupt and main loop
+NODE_ADDRESS = 1 #This flasher site's link address (link.py), 1 and up; the tower always uses TOWER_ADDRESS
+TOWER_ADDRESS = 0
+WIRE_FORMAT = 'binary' #Payload encoding sent: 'binary' (wire.py) or 'json' for debugging; both are always understood
+RESPONSE_OUTPUT = 'stream' #Decoded messages: 'stream' (framed lines on the USB console, see LoRa.emit_record) or 'file' (recent_response_log.txt)
 
 """
 # ES32 TTGO v1.0 
@@ -51,6 +56,7 @@ device_config = {
 
 
 # ~ # wroom with external radio
+# 'spi' selects the radio bus: 'vspi' or 'hspi' (hardware), 'soft' (bit-banged)
 device_config= {
     'miso':19,
     'mosi':23,
@@ -59,6 +65,8 @@ device_config= {
     'dio_0':25,
     'reset':26,
     'led':33, 
+    'spi':'vspi',
+    'spi_baudrate':10000000,
 }
 
 # wroom with battery and external radio (vape battery)
@@ -114,6 +122,101 @@ lora_parameters = {
     'invert_IQ': False,
 }
 
+# listen-before-talk: CAD before every send, random backoff in slots of
+# slot_bytes packets while the channel is busy, then transmit anyway
+lbt_parameters = {
+    'enabled': True,
+    'max_attempts': 6,
+    'slot_bytes': 16,
+}
+
+# fragmentation of payloads longer than one frame (link.py): a partial
+# message is dropped after reassembly_timeout secs without a fragment, and
+# missing fragments are asked for at most max_nacks times. The sender keeps
+# its last cache_messages fragmented messages for retransmission.
+fragment_parameters = {
+    'reassembly_timeout': 60,
+    'max_nacks': 3,
+    'cache_messages': 4,
+}
+
+# reliable command delivery: the flasher site ACKs every command as soon
+# as it is in. Without an ACK the command is resent with the same sequence
+# number after a retransmission timeout of two ACKs on air plus
+# ack_turnaround_ms, doubling per retry up to max_rto_ms.
+reliability = {
+    'enabled': True,
+    'max_retries': 3,
+    'ack_turnaround_ms': 500,
+    'max_rto_ms': 20000,
+}
+
+# flasher sites the tower polls and commands (scheduler.py), by link
+# address. Each is polled for voltages every poll_interval secs; a site
+# that stops answering is retried after retry_interval secs, doubling per
+# failure up to its poll_interval.
+flasher_nodes = {
+    1: {'name': 'flasher1', 'poll_interval': 3600},
+}
+scheduler_parameters = {
+    'retry_interval': 60,
+}
+
+# telemetry pushed by the flasher site: voltages, the RSSI of the last
+# command and the uptime are sent to the tower every interval secs,
+# without a query. The tower logs them to telemetry_log.txt while it
+# listens between commands. Without the uasyncio loop the site checks
+# once per listen (MSG_TIMEOUT), so shorter intervals are rounded up.
+telemetry_parameters = {
+    'enabled': False,
+    'interval': 900,
+}
+
+# uasyncio variant of the operation loop (async_operation.py): telemetry
+# is sampled every telemetry_interval secs, and the display and message
+# log are refreshed at most every display_interval secs
+async_parameters = {
+    'enabled': False,
+    'telemetry_interval': 60,
+    'display_interval': 2,
+}
+
+# duty-cycled receive at the flasher site: the radio and ESP32 sleep for
+# sleep_ms, wake for a CAD, and only open an RX window when a preamble is
+# seen. The tower stretches the command preamble over a whole sleep
+# period. Supply currents (mA) are only used for the trade-off report.
+duty_cycle = {
+    'enabled': False,
+    'sleep_ms': 2000,
+    'margin_symbols': 16,
+    'rx_symbol_timeout': 16,
+    'current_sleep': 0.8,
+    'current_awake': 50,
+}
+
+# adaptive data rate: profiles override lora_parameters, from the robust
+# default (index 0) to the fastest. Both ends must use the same table.
+# Margins are dB of SNR above the spreading factor's demodulation floor.
+# The flasher site resets to the default after MSG_TIMEOUT without a
+# command; the tower follows once the site has been silent that long
+# plus reset_margin secs (its last push and the reboot). The tower keeps
+# one data rate for all sites, so it turns ADR off when flasher_nodes
+# holds more than one.
+adr_parameters = {
+    'enabled': False,
+    'min_margin': 5,
+    'step_up_margin': 10,
+    'reset_margin': 10,
+    'profiles': [
+        {},
+        {'spreading_factor': 10},
+        {'spreading_factor': 9},
+        {'spreading_factor': 8, 'signal_bandwidth': 250E3},
+        {'spreading_factor': 7, 'signal_bandwidth': 250E3},
+        {'spreading_factor': 7, 'signal_bandwidth': 250E3, 'tx_power_level': 14},
+    ],
+}
+
 wifi_config = {
     'ssid':'',
     'password':''
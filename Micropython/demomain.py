@@ -5,14 +5,10 @@ import LoRaSender
 import LoRaReceiver
 
 from config import *
-from machine import Pin, SoftSPI
 from sx127x import SX127x
+from spi_bus import make_bus
 
-device_spi = SoftSPI(baudrate = 10000000, 
-        polarity = 0, phase = 0, bits = 8, firstbit = SoftSPI.MSB,
-        sck = Pin(device_config['sck'], Pin.OUT, Pin.PULL_DOWN),
-        mosi = Pin(device_config['mosi'], Pin.OUT, Pin.PULL_UP),
-        miso = Pin(device_config['miso'], Pin.IN, Pin.PULL_UP))
+device_spi = make_bus(device_config)
 
 lora = SX127x(device_spi, pins=device_config, parameters=lora_parameters)
 
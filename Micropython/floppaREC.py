@@ -1,10 +1,15 @@
-from machine import Pin, ADC, reset
+from machine import Pin, ADC, RTC, reset
 from time import sleep
+import utime
 from display import Display
 import json
-from LoRa import LoRa, Command, FlasherOperation
+import struct
+from LoRa import LoRa, Command, FlasherOperation, batch_step_msg
 from voltage import ReadVoltages
-from config import fadcratios, relay_pins, relay_names
+from config import fadcratios, relay_pins, relay_names, adr_parameters, telemetry_parameters, TOWER_ADDRESS
+from adr import AdaptiveDataRate
+from async_operation import AsyncFlasherOperation
+import uasyncio as asyncio
 
 class NoMessage(Command):
     '''This class is the excecutes a hardware reset. (Only invoked if no
@@ -36,7 +41,7 @@ class RelayON(Command):
         '''
         #self.display_on_lcd(msg)
         self.relay.value(0)
-        LoRa().send({'msg':'RELAY_ON', 'relay':relay_names[self.pin]})
+        self.reply({'msg':'RELAY_ON', 'relay':relay_names[self.pin]})
         print('Relay ON sent')
 
 class RelayOFF(Command):
@@ -55,7 +60,7 @@ class RelayOFF(Command):
         '''
         #self.display_on_lcd(msg)
         self.relay.value(1)
-        LoRa().send({'msg':'RELAY_OFF', 'relay':relay_names[self.pin]})
+        self.reply({'msg':'RELAY_OFF', 'relay':relay_names[self.pin]})
         print('Relay OFF sent')
 
 def read_batteries():
@@ -93,7 +98,7 @@ class Voltage(Command):
         #self.display_on_lcd(msg)
         sol, v1 = read_batteries()
         voltages = self.voltage_dict(sol, v1)
-        LoRa().send(voltages)
+        self.reply(voltages)
         print('voltage msg sent')
         
 class FlashFlasher(Command):
@@ -113,9 +118,216 @@ class FlashFlasher(Command):
         hvpin.value(1)
         sleep(.5)
         flpin.value(1)
-        LoRa().send({'msg':'FLASH_FLASHER'})
+        self.reply({'msg':'FLASH_FLASHER'})
+
+    async def excecute_async(self, msg):
+        '''This is the excecute command for the uasyncio operation loop. The
+        flash can be cancelled (FLASHER_CEASEFIRE); the relays are switched
+        off either way, but only a complete flash is replied to.
+        '''
+        flpin = RelayON(relay_pins['flasher_pin']).relay
+        hvpin = RelayON(relay_pins['hv_pin']).relay
+        flpin.value(0)
+        try:
+            await asyncio.sleep(.5)
+            hvpin.value(0)
+            await asyncio.sleep(msg['time'])
+        finally:
+            hvpin.value(1)
+            await asyncio.sleep_ms(500)
+            flpin.value(1)
+        self.reply({'msg':'FLASH_FLASHER'})
     
     
+class SetDataRate(Command):
+    '''This is the implementation of the data rate change requested by
+    the tower (adaptive data rate). It acknowledges at the current rate,
+    then switches. A reset (e.g. after MSG_TIMEOUT without a command)
+    returns to the default rate.
+    '''
+    def __init__(self):
+        self.adr = AdaptiveDataRate()
+
+    def __str__(self):
+        return 'SetDataRate command'
+
+    def excecute(self, msg):
+        index = self.requested(msg)
+        if index is None:
+            return
+        self.reply({'msg':'SET_DR', 'dr':index})
+        self.switch(index)
+
+    async def excecute_async(self, msg):
+        '''This is the excecute command for the uasyncio operation loop: the
+        acknowledgement is on air before the switch.
+        '''
+        index = self.requested(msg)
+        if index is None:
+            return
+        await self.reply_async({'msg':'SET_DR', 'dr':index})
+        self.switch(index)
+
+    def requested(self, msg):
+        '''This method returns the data rate index asked for, or None if
+        there is no such rate.
+        '''
+        index = msg.get('dr', 0)
+        if not 0 <= index < len(self.adr.profiles):
+            print('Unknown data rate {}'.format(index))
+            return None
+        return index
+
+    def switch(self, index):
+        '''This method switches the radio session to data rate index.'''
+        self.adr.index = index
+        LoRa.parameters = self.adr.parameters()
+        self.radio.sx1276.set_channel(LoRa.parameters)
+        print('Data rate {}'.format(index))
+
+class Batch(Command):
+    '''This is the implementation of the batch command. It excecutes an
+    ordered list of steps through the operation's command table, waiting
+    the step's delay after each, and sends one response with every
+    step's status and start time (secs after the batch started) and the
+    fields of the steps' replies (e.g. the voltages).
+    '''
+    # commands that must go through their own exchange
+    not_batchable = ('BATCH', 'SET_DR', 'NOMESSAGE')
+
+    def __init__(self, cmds):
+        self.cmds = cmds
+
+    def __str__(self):
+        return 'Batch command'
+
+    def excecute(self, msg):
+        response = {'msg':'BATCH'}
+        results = []
+        start = utime.ticks_ms()
+        for step in msg.get('steps', []):
+            name = step[0]
+            started = utime.ticks_diff(utime.ticks_ms(), start) / 1000
+            status = self.run_step(batch_step_msg(step), response)
+            print('Batch step {}: {}'.format(name, status))
+            results.append([name, status, started])
+            sleep(step[1])
+        response['results'] = results
+        self.reply(response)
+
+    async def excecute_async(self, msg):
+        '''This is the excecute command for the uasyncio operation loop: the
+        step delays, and steps with an excecute_async (a flash), are
+        awaited instead of blocking the loop.
+        '''
+        response = {'msg':'BATCH'}
+        results = []
+        start = utime.ticks_ms()
+        for step in msg.get('steps', []):
+            name = step[0]
+            started = utime.ticks_diff(utime.ticks_ms(), start) / 1000
+            status = await self.run_step_async(batch_step_msg(step), response)
+            print('Batch step {}: {}'.format(name, status))
+            results.append([name, status, started])
+            await asyncio.sleep(step[1])
+        response['results'] = results
+        await self.reply_async(response)
+
+    def run_step(self, step_msg, response):
+        '''This method excecutes one step, adding its reply fields to the
+        batch response.
+        Returns: the step status ('OK', 'NOREPLY', 'UNKNOWN' or 'ERROR')
+        '''
+        name = step_msg['msg']
+        if name not in self.cmds or name in self.not_batchable:
+            return 'UNKNOWN'
+        Command.captured = []
+        try:
+            self.cmds[name].excecute(step_msg)
+        except Exception as e:
+            print('Batch step {} failed: {}'.format(name, e))
+            return 'ERROR'
+        finally:
+            replies = Command.captured
+            Command.captured = None
+        return self.merge_replies(replies, response)
+
+    async def run_step_async(self, step_msg, response):
+        '''This method is run_step for the uasyncio loop. Only the replies
+        of this task are collected, so commands running next to the batch
+        still send theirs.
+        '''
+        name = step_msg['msg']
+        if name not in self.cmds or name in self.not_batchable:
+            return 'UNKNOWN'
+        command = self.cmds[name]
+        task = asyncio.current_task()
+        replies = Command.captured_tasks[task] = []
+        try:
+            if hasattr(command, 'excecute_async'):
+                await command.excecute_async(step_msg)
+            else:
+                command.excecute(step_msg)
+        except Exception as e:
+            print('Batch step {} failed: {}'.format(name, e))
+            return 'ERROR'
+        finally:
+            del Command.captured_tasks[task]
+        return self.merge_replies(replies, response)
+
+    def merge_replies(self, replies, response):
+        '''This method adds the fields of a step's replies to the batch
+        response.
+        Returns: the step status ('OK' or 'NOREPLY')
+        '''
+        for reply in replies:
+            for key in reply:
+                if key not in ('msg', 'relay'):
+                    response[key] = reply[key]
+        return 'OK' if replies else 'NOREPLY'
+
+class TelemetryState:
+    '''This class keeps the power on time, the time of the last telemetry
+    push and the RSSI of the last command in RTC memory, so they survive
+    the reset after MSG_TIMEOUT without a command (not a power cycle).
+    '''
+    layout = '<IIh'
+    no_rssi = -32768
+
+    def __init__(self):
+        self.rtc = RTC()
+        saved = self.rtc.memory()
+        if len(saved) == struct.calcsize(self.layout):
+            self.power_on, self.last_push, rssi = struct.unpack(self.layout, saved)
+        else:
+            self.power_on, self.last_push, rssi = int(utime.time()), 0, self.no_rssi
+        self.cmd_rssi = None if rssi == self.no_rssi else rssi
+        self.save()
+
+    def save(self):
+        '''This method writes the state to RTC memory.'''
+        rssi = self.no_rssi if self.cmd_rssi is None else self.cmd_rssi
+        self.rtc.memory(struct.pack(self.layout, self.power_on, self.last_push, rssi))
+
+    def uptime(self):
+        '''This method returns the secs since power on.'''
+        return int(utime.time()) - self.power_on
+
+    def due(self):
+        '''This method checks if the telemetry interval has passed.'''
+        return int(utime.time()) - self.last_push >= telemetry_parameters['interval']
+
+    def pushed(self):
+        '''This method records a telemetry push.'''
+        self.last_push = int(utime.time())
+        self.save()
+
+    def command_received(self, msg):
+        '''This method records the RSSI a command arrived with.'''
+        if 'rssi' in msg:
+            self.cmd_rssi = msg['rssi']
+            self.save()
+
 class InvalidMessage(Command):
     '''This is the implementation of the invalid message command.
     '''
@@ -140,8 +352,10 @@ class FlasherOperationRec(FlasherOperation):
             'BATT2_ON':RelayOFF(relay_pins['batt2_pin']),
             'BATT2_OFF':RelayON(relay_pins['batt2_pin']),
             'VOLTAGE':Voltage(),
+            'SET_DR':SetDataRate(),
             'NOMESSAGE':NoMessage()
             }
+    cmds['BATCH'] = Batch(cmds)
     
     flasher_pin = Pin(relay_pins['flasher_pin'], Pin.OUT)
     solar_pin = Pin(relay_pins['hv_pin'], Pin.OUT)
@@ -149,10 +363,118 @@ class FlasherOperationRec(FlasherOperation):
     batt2_pin = Pin(relay_pins['batt2_pin'], Pin.OUT)
             
     def __init__(self):
+        if LoRa.address == TOWER_ADDRESS:
+            raise ValueError('NODE_ADDRESS is the tower address {}, set it to this flasher site\'s address in config.py'.format(TOWER_ADDRESS))
         self.flasher_pin.value(1)
         self.solar_pin.value(1)
         self.batt1_pin.value(1)
         self.batt2_pin.value(1)
         # self.display = Display()
         # self.display.display_text('Flasher active')
+        self.push_state = TelemetryState()
         print('Flasher active')
+
+    # sequence number and name of the last command excecuted, and its reply
+    last_seq = None
+    last_cmd = None
+    last_reply = None
+
+    def decode_cmd(self, msg):
+        '''This method reports the SNR the command arrived with back to the
+        tower in every response when adaptive data rate is enabled. A
+        command resent by the tower (same sequence number, see link.py) is
+        not excecuted again; the reply to the first copy is resent instead.
+        '''
+        if self.is_duplicate(msg):
+            print('Duplicate command {}, resending reply'.format(msg['seq']))
+            if self.last_reply is not None:
+                self.radio.send(self.last_reply)
+            return
+        self.push_state.command_received(msg)
+        if adr_parameters['enabled'] and 'snr' in msg:
+            LoRa.piggyback = {'lsnr': msg['snr']}
+        self.radio.last_sent = None
+        try:
+            super().decode_cmd(msg)
+        except OSError as e:
+            # the reply did not go out (SX127x.check_tx_deadline)
+            self.check_radio(e)
+        if 'seq' in msg:
+            self.last_seq = msg['seq']
+            self.last_cmd = msg['msg']
+            self.last_reply = self.radio.last_sent
+
+    def is_duplicate(self, msg):
+        '''This method checks if msg is a resent copy of the last command.'''
+        return ('seq' in msg and msg['seq'] == self.last_seq
+                and msg['msg'] == self.last_cmd)
+
+    def telemetry_msg(self, sol, batt1):
+        '''This method returns the telemetry message for the voltages read.'''
+        msg = {'msg':'TELEMETRY', 'SOLAR':sol, 'BATT1':batt1, 'uptime':self.push_state.uptime()}
+        if self.push_state.cmd_rssi is not None:
+            msg['cmd_rssi'] = self.push_state.cmd_rssi
+        return msg
+
+    def push_telemetry(self):
+        '''This method sends the voltages, the RSSI of the last command and
+        the uptime to the tower, without an ACK, if telemetry is enabled and
+        its interval has passed since the last push.
+        '''
+        if not telemetry_parameters['enabled'] or not self.push_state.due():
+            return
+        sol, batt1 = read_batteries()
+        self.push_state.pushed()
+        try:
+            self.airtime_tx += self.radio.send(self.telemetry_msg(sol, batt1), dst = TOWER_ADDRESS)
+        except OSError as e:
+            self.check_radio(e)
+
+class AsyncFlasherOperationRec(AsyncFlasherOperation, FlasherOperationRec):
+    '''This is the uasyncio variant of FlasherOperationRec. A flash runs
+    in its own task, so the flasher site still answers a voltage query
+    during it, and a FLASHER_CEASEFIRE or FLASHER_OFF cuts it short.
+    '''
+    cancels = {'FLASHER_CEASEFIRE': ('FLASH_FLASHER',),
+               'FLASHER_OFF': ('FLASH_FLASHER',),
+               }
+
+    def __init__(self):
+        FlasherOperationRec.__init__(self)
+        AsyncFlasherOperation.__init__(self)
+
+    async def run_command(self, msg):
+        '''This method applies the duplicate suppression and link stats of
+        FlasherOperationRec.decode_cmd. A resent copy of a command that is
+        still running is ignored.
+        '''
+        if self.is_duplicate(msg):
+            print('Duplicate command {}'.format(msg['seq']))
+            if self.last_reply is not None:
+                await self.radio.send_async(self.last_reply)
+            return
+        self.push_state.command_received(msg)
+        if adr_parameters['enabled'] and 'snr' in msg:
+            LoRa.piggyback = {'lsnr': msg['snr']}
+        if 'seq' in msg:
+            self.last_seq = msg['seq']
+            self.last_cmd = msg['msg']
+            self.last_reply = None
+        self.radio.last_sent = None
+        await AsyncFlasherOperation.run_command(self, msg)
+        if 'seq' in msg and msg['seq'] == self.last_seq:
+            self.last_reply = self.radio.last_sent
+
+    def sample_telemetry(self):
+        sol, batt1 = read_batteries()
+        return {'SOLAR':sol, 'BATT1':batt1}
+
+    async def publish_telemetry(self, sample):
+        '''This method pushes the sample to the tower once the telemetry
+        interval has passed, as FlasherOperationRec.push_telemetry does.
+        '''
+        if not telemetry_parameters['enabled'] or not self.push_state.due():
+            return
+        self.push_state.pushed()
+        msg = self.telemetry_msg(sample['SOLAR'], sample['BATT1'])
+        self.airtime_tx += await self.radio.send_async(msg, dst = TOWER_ADDRESS)
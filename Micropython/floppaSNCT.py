@@ -2,7 +2,9 @@ from machine import Pin, ADC
 from time import sleep
 import utime
 from display import Display
-from LoRa import LoRa, Command, FlasherOperation
+from LoRa import LoRa, Command, FlasherOperation, waiting_for_timeout
+from config import MSG_TIMEOUT, TOWER_ADDRESS, adr_parameters, flasher_nodes
+from async_operation import AsyncFlasherOperation
 
 def write_flasher_log(msg):
     '''This function writes the response from the flasher module to the
@@ -16,6 +18,33 @@ def write_flasher_log(msg):
     with open('recent_flash_log.txt', 'w') as log_file:
         log_file.write('Command: {} rssi: {} \n'.format(flasher_msg,rssi))
 
+def write_batch_log(msg):
+    '''This function writes the per-step results of a batch response to
+    the file recent_flash_log.txt
+    '''
+    try:
+        results = msg['results']
+        rssi = msg['rssi']
+    except:
+        results = []
+        rssi = 'InvalidResponse'
+    with open('recent_flash_log.txt', 'w') as log_file:
+        log_file.write('Command: BATCH rssi: {} \n'.format(rssi))
+        for name, status, started in results:
+            log_file.write('Step: {} status: {} t: {} \n'.format(name, status, started))
+
+def write_telemetry_log(msg):
+    '''This function appends a telemetry message pushed by a flasher site
+    to the file telemetry_log.txt, one dict per line, with the time it was
+    received.
+    '''
+    entry = {'time': utime.time(), 'node': msg.get('src')}
+    for key in ('SOLAR', 'BATT1', 'BATT2', 'cmd_rssi', 'uptime', 'rssi', 'snr'):
+        if key in msg:
+            entry[key] = msg[key]
+    with open('telemetry_log.txt', 'a') as log_file:
+        log_file.write(str(entry) + '\n')
+
 class RelayON(Command):    
     def excecute(self, msg):
         self.display_on_lcd(msg)
@@ -55,6 +84,20 @@ class FlashFlasher(Command):
         write_flasher_log(msg)
         print(msg)        
         
+class Batch(Command):
+    def excecute(self, msg):
+        write_batch_log(msg)
+        if 'SOLAR' in msg:
+            Voltage().write_voltages(msg)
+        self.display_on_lcd({'msg': 'BATCH', 'steps': len(msg.get('results', []))})
+        print(msg)
+
+class Telemetry(Command):
+    def excecute(self, msg):
+        write_telemetry_log(msg)
+        Voltage().write_voltages(msg)
+        print(msg)
+
 class NoMessage(Command):
     def excecute(self, msg):
         self.display_on_lcd(msg)
@@ -75,9 +118,58 @@ class FlasherOperationSNCT(FlasherOperation):
             'RELAY_OFF':RelayOFF(),
             'VOLTAGE':Voltage(),
             'FLASH_FLASHER':FlashFlasher(),
+            'BATCH':Batch(),
+            'TELEMETRY':Telemetry(),
             'NOMESSAGE':NoMessage()
             }
     def __init__(self):
+        # both boards share config.py, so the tower does not take its
+        # address from NODE_ADDRESS
+        LoRa.address = TOWER_ADDRESS
+        if adr_parameters['enabled'] and len(flasher_nodes) > 1:
+            # the tower has one data rate for every site; at a rate agreed
+            # with one of them it would no longer hear the others
+            print('ADR disabled: {} flasher sites'.format(len(flasher_nodes)))
+            adr_parameters['enabled'] = False
         self.display = Display()
         self.display.display_text('Flasher active')
         print('Flasher control module active')
+
+    def listen_passively(self, time):
+        '''This method listens for time secs for the messages flasher sites
+        send on their own (telemetry) and decodes them, without the
+        NOMESSAGE handling of listen_for_cmd. With ADR it follows the
+        flasher site back to the default data rate when the site resets.
+        Returns: the list of messages received.
+        '''
+        received = []
+        lora = self.radio
+        start_time = utime.time()
+        while waiting_for_timeout(start_time, time):
+            if adr_parameters['enabled']:
+                self.sync_data_rate()
+            remaining = time - (utime.time() - start_time)
+            try:
+                lora.start_listening()
+                msg = lora.wait_for_msg(min(MSG_TIMEOUT, remaining))
+                lora.stop_listening()
+            except OSError as e:
+                self.check_radio(e)
+                continue
+            self.airtime_rx += lora.last_rx_airtime
+            if self.waiting_for_msg(msg):
+                self.check_radio()
+                continue
+            self.heard(msg)
+            self.decode_cmd(msg)
+            received.append(msg)
+        return received
+
+class AsyncFlasherOperationSNCT(AsyncFlasherOperation, FlasherOperationSNCT):
+    '''This is the uasyncio variant of FlasherOperationSNCT, with an
+    awaitable send_cmd, e.g. msg = await fl.send_cmd('VOLTAGE') from a
+    task running next to fl.run().
+    '''
+    def __init__(self):
+        FlasherOperationSNCT.__init__(self)
+        AsyncFlasherOperation.__init__(self)
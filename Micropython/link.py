@@ -0,0 +1,145 @@
+'''Link layer between LoRa.send/wait_for_msg and the radio. Every frame
+starts with a type byte, the destination and source node addresses and
+a message id:
+
+    FRAME_SINGLE | dst | src | msg_id | payload
+    FRAME_FRAG   | dst | src | msg_id | index | count | chunk
+    FRAME_NACK   | dst | src | msg_id | n | n missing fragment indices
+    FRAME_ACK    | dst | src | msg_id
+
+A node only takes frames sent to its own address or to BROADCAST. The
+ACK_REQUEST bit on a SINGLE or FRAG type asks the receiver to send a
+FRAME_ACK as soon as the whole message is in. The msg_id doubles as the
+sequence number: a resent message keeps its id, so the receiver can
+tell it from a new one.
+
+Payloads that do not fit one frame are split into fragments, which the
+receiver collects in a Reassembler. A receiver that stops getting
+fragments asks for the missing ones with a NACK, and the sender resends
+just those from its cache. Frames whose first byte is below 0x80 (a bare
+wire or json payload) are passed through as broadcast single frames.
+'''
+from sx127x import MAX_PKT_LENGTH
+import utime
+
+FRAME_SINGLE = 0x80
+FRAME_FRAG = 0x81
+FRAME_NACK = 0x82
+FRAME_ACK = 0x83
+ACK_REQUEST = 0x10
+
+BROADCAST = 0xff
+
+SINGLE_HEADER = 4
+FRAG_HEADER = 6
+FRAG_PAYLOAD = MAX_PKT_LENGTH - FRAG_HEADER
+MAX_FRAGMENTS = 255
+
+def fragment(dst, src, msg_id, payload, ack = False, size = FRAG_PAYLOAD):
+    '''This function frames payload from node src to node dst as one
+    FRAME_SINGLE, or as FRAME_FRAG fragments of at most size bytes if it
+    does not fit one frame. With ack set, the frames carry the
+    ACK_REQUEST bit.
+    Returns: the list of frames.
+    '''
+    flag = ACK_REQUEST if ack else 0
+    if len(payload) <= MAX_PKT_LENGTH - SINGLE_HEADER:
+        return [bytes((FRAME_SINGLE | flag, dst, src, msg_id)) + payload]
+    count = (len(payload) + size - 1) // size
+    if count > MAX_FRAGMENTS:
+        raise ValueError('payload too large: {} bytes'.format(len(payload)))
+    return [bytes((FRAME_FRAG | flag, dst, src, msg_id, i, count)) + payload[i * size:(i + 1) * size]
+            for i in range(count)]
+
+def ack(dst, src, msg_id):
+    '''This function returns the ACK frame for message msg_id.'''
+    return bytes((FRAME_ACK, dst, src, msg_id))
+
+def wants_ack(frame):
+    '''This function checks if a frame carries the ACK_REQUEST bit.'''
+    return len(frame) > 0 and frame[0] >= 0x80 and frame[0] & ACK_REQUEST != 0
+
+def nack(dst, src, msg_id, missing):
+    '''This function returns a NACK frame asking for the fragments missing.'''
+    missing = missing[:MAX_PKT_LENGTH - 5]
+    return bytes((FRAME_NACK, dst, src, msg_id, len(missing))) + bytes(missing)
+
+def parse(frame):
+    '''This function splits a frame into its header fields.
+    Returns: (frame type without the ACK_REQUEST bit, dst, src, msg_id,
+    index, count, body), or None if the frame is shorter than its header
+    (corrupted or truncated). A bare payload comes back as
+    (None, BROADCAST, None, None, 0, 1, frame).
+    '''
+    if not frame or frame[0] < 0x80:
+        return None, BROADCAST, None, None, 0, 1, frame
+    kind = frame[0] & ~ACK_REQUEST
+    if kind == FRAME_FRAG:
+        if len(frame) < FRAG_HEADER:
+            return None
+        return kind, frame[1], frame[2], frame[3], frame[4], frame[5], frame[6:]
+    if kind == FRAME_NACK:
+        if len(frame) < 5 or len(frame) < 5 + frame[4]:
+            return None
+        return kind, frame[1], frame[2], frame[3], 0, frame[4], frame[5:5 + frame[4]]
+    if len(frame) < SINGLE_HEADER:
+        return None
+    return kind, frame[1], frame[2], frame[3], 0, 1, frame[4:]
+
+class Reassembler:
+    '''This class collects the fragments of partially received messages,
+    keyed by (source node, msg_id). A message that gets no fragment for
+    timeout_ms is dropped.
+    '''
+    def __init__(self, timeout_ms):
+        self.timeout_ms = timeout_ms
+        # key -> [chunks, last fragment ticks, last fragment or nack ticks, nacks sent]
+        self.partial = {}
+        self.completed = 0
+        self.expired = 0
+
+    def add(self, key, index, count, chunk):
+        '''This method stores one fragment.
+        Returns: the whole payload once every fragment is in, else None.
+        '''
+        now = utime.ticks_ms()
+        entry = self.partial.get(key)
+        if entry is None or len(entry[0]) != count:
+            entry = [[None] * count, now, now, 0]
+            self.partial[key] = entry
+        if index < count:
+            entry[0][index] = bytes(chunk)
+        entry[1] = now
+        entry[2] = now
+        if None in entry[0]:
+            return None
+        del self.partial[key]
+        self.completed += 1
+        return b''.join(entry[0])
+
+    def missing(self, key):
+        '''This method returns the indices still missing from message key.'''
+        chunks = self.partial[key][0]
+        return [i for i in range(len(chunks)) if chunks[i] is None]
+
+    def stalled(self, gap_ms):
+        '''This method expires old partial messages and returns the ids of
+        the ones that got no fragment for gap_ms, restarting their gap
+        timer and counting the NACK the caller is about to send.
+        Returns: a list of (key, nacks sent before this one).
+        '''
+        now = utime.ticks_ms()
+        stalled = []
+        for key in list(self.partial):
+            entry = self.partial[key]
+            if utime.ticks_diff(now, entry[1]) > self.timeout_ms:
+                del self.partial[key]
+                self.expired += 1
+            elif utime.ticks_diff(now, entry[2]) > gap_ms:
+                stalled.append((key, entry[3]))
+                entry[2] = now
+                entry[3] += 1
+        return stalled
+
+    def __len__(self):
+        return len(self.partial)
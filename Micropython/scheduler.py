@@ -0,0 +1,128 @@
+from config import flasher_nodes, scheduler_parameters
+import utime
+
+class NodeScheduler:
+    '''This class lets one tower operation (FlasherOperationSNCT) run
+    several flasher sites. Commands are queued per node, and the scheduler
+    serves the nodes round robin, one exchange per turn, so a site with a
+    long queue or a dead link does not hold up the others. Between queued
+    commands each node is polled for voltages every poll_interval secs,
+    unless it pushed telemetry since. A node that stops answering is
+    retried with a backoff instead of costing a full exchange every turn.
+    Usage:
+
+        scheduler = NodeScheduler(FlasherOperationSNCT())
+        scheduler.queue(2, 'FLASH_FLASHER', time=10)
+        scheduler.run()
+    '''
+    def __init__(self, operation, nodes = flasher_nodes):
+        self.operation = operation
+        self.nodes = nodes
+        self.order = sorted(nodes)
+        self.turn = 0
+        self.queues = {}
+        self.next_poll = {}
+        self.health = {}
+        now = utime.time()
+        for node in self.order:
+            self.queues[node] = []
+            self.next_poll[node] = now
+            self.health[node] = {'name': nodes[node]['name'],
+                                 'exchanges': 0,
+                                 'replies': 0,
+                                 'telemetry': 0,
+                                 'failures': 0,
+                                 'lost': 0,
+                                 'rssi': None,
+                                 'snr': None,
+                                 'lsnr': None,
+                                 'latency': None,
+                                 'last_seen': None,
+                                 }
+
+    def queue(self, node, cmd, **kwargs):
+        '''This method queues a command for node.'''
+        self.queues[node].append((cmd, kwargs))
+
+    def next_job(self):
+        '''This method picks the next exchange: starting after the node
+        served last, the first node with a queued command or a poll due.
+        Returns: (node, command, arguments), or None if nothing is due.
+        '''
+        now = utime.time()
+        for i in range(len(self.order)):
+            node = self.order[(self.turn + i) % len(self.order)]
+            if self.queues[node]:
+                cmd, kwargs = self.queues[node].pop(0)
+            elif now >= self.next_poll[node]:
+                cmd, kwargs = 'VOLTAGE', {}
+            else:
+                continue
+            self.turn = (self.turn + i + 1) % len(self.order)
+            return node, cmd, kwargs
+        return None
+
+    def run_once(self):
+        '''This method runs the next exchange, if one is due.
+        Returns: True if an exchange was run.
+        '''
+        job = self.next_job()
+        if job is None:
+            return False
+        node, cmd, kwargs = job
+        msg = self.operation.send_cmd(cmd, dst = node, **kwargs)
+        self.record(node, msg)
+        return True
+
+    def record(self, node, msg):
+        '''This method updates the link health table of node with the
+        outcome of an exchange and schedules its next poll.
+        '''
+        health = self.health[node]
+        health['exchanges'] += 1
+        now = utime.time()
+        poll_interval = self.nodes[node]['poll_interval']
+        if self.operation.waiting_for_msg(msg):
+            health['failures'] += 1
+            health['lost'] += 1
+            retry = scheduler_parameters['retry_interval'] * 2 ** (health['failures'] - 1)
+            self.next_poll[node] = now + min(retry, poll_interval)
+            print('Node {} not answering ({} in a row)'.format(node, health['failures']))
+            return
+        health['replies'] += 1
+        health['failures'] = 0
+        health['rssi'] = msg.get('rssi')
+        health['snr'] = msg.get('snr')
+        health['lsnr'] = msg.get('lsnr', health['lsnr'])
+        health['last_seen'] = now
+        if self.operation.last_latency is not None:
+            health['latency'] = self.operation.last_latency['measured']
+        self.next_poll[node] = now + poll_interval
+
+    def heard(self, msg):
+        '''This method updates the link health table with a message a node
+        sent on its own. Telemetry counts as its voltage poll.
+        '''
+        node = msg.get('src')
+        if node not in self.health or msg['msg'] != 'TELEMETRY':
+            return
+        health = self.health[node]
+        health['telemetry'] += 1
+        health['failures'] = 0
+        health['rssi'] = msg.get('rssi')
+        health['snr'] = msg.get('snr')
+        health['last_seen'] = utime.time()
+        self.next_poll[node] = health['last_seen'] + self.nodes[node]['poll_interval']
+
+    def run(self):
+        '''This method serves the nodes forever, logging pushed telemetry
+        while no exchange is due.
+        '''
+        while True:
+            if not self.run_once():
+                for msg in self.operation.listen_passively(1):
+                    self.heard(msg)
+
+    def report(self):
+        '''This method returns the link health table, by node address.'''
+        return self.health
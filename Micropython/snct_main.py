@@ -1,19 +1,19 @@
 from floppaSNCT import *
-from time import sleep        
+
+# one calibration cycle as a single exchange: [command, delay after (secs)]
+CALIBRATION = [['FLASHER_ON', 1],
+               ['FLASHER_FIRE', 5],
+               ['FLASHER_CEASEFIRE', 1],
+               ['FLASHER_OFF', 1],
+               ['VOLTAGE', 0],
+               ]
 
 def main():
     fl = FlasherOperationSNCT()
     while True:    
-        fl.send_cmd('FLASHER_ON')
-        sleep(1)
-        fl.send_cmd('FLASHER_FIRE')
-        sleep(5)
-        fl.send_cmd('FLASHER_CEASEFIRE')
-        sleep(1)
-        fl.send_cmd('FLASHER_OFF')
-        sleep(1)
-        fl.send_cmd('VOLTAGE')
-        sleep(3600)
+        fl.send_cmd('BATCH', steps=CALIBRATION)
+        # log the telemetry the flasher site pushes in between
+        fl.listen_passively(3600)
 
     
 if __name__ == '__main__':
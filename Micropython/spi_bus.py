@@ -0,0 +1,91 @@
+from machine import Pin, SoftSPI, SPI
+
+# ESP32 hardware SPI peripherals
+HSPI = 1
+VSPI = 2
+
+DEFAULT_BAUDRATE = 10000000
+
+class SPIBus:
+    '''This is the bus interface the SX127x driver talks through. It owns
+    the slave select pin and frames every access as one SS-low
+    transaction. Any object with transfer(), write_burst() and
+    read_burst_into() can stand in for it (e.g. a host-side fake bus).
+    '''
+    def __init__(self, spi, ss):
+        self.spi = spi
+        self._pin_ss = Pin(ss, Pin.OUT)
+        self._pin_ss.value(1)
+
+        # preallocated buffers, so register access does not allocate
+        self._reg_tx = bytearray(2)
+        self._reg_rx = bytearray(2)
+        self._addr = bytearray(1)
+
+    def transfer(self, address, value = 0x00):
+        '''Clocks out an address byte and a value byte, and returns the
+        byte clocked in with the value (the register content on reads).
+        '''
+        self._reg_tx[0] = address
+        self._reg_tx[1] = value
+
+        self._pin_ss.value(0)
+        self.spi.write_readinto(self._reg_tx, self._reg_rx)
+        self._pin_ss.value(1)
+
+        return self._reg_rx[1]
+
+    def write_burst(self, address, buffer):
+        '''Writes buffer starting at address in one SS-low transaction.'''
+        self._addr[0] = address | 0x80
+
+        self._pin_ss.value(0)
+        self.spi.write(self._addr)
+        self.spi.write(buffer)
+        self._pin_ss.value(1)
+
+    def read_burst_into(self, address, buffer):
+        '''Fills buffer starting at address in one SS-low transaction.'''
+        self._addr[0] = address & 0x7f
+
+        self._pin_ss.value(0)
+        self.spi.write(self._addr)
+        self.spi.readinto(buffer)
+        self._pin_ss.value(1)
+
+class SoftSPIBus(SPIBus):
+    '''Bit-banged bus on any GPIOs. Slow, but always available.'''
+    def __init__(self, config, baudrate = DEFAULT_BAUDRATE):
+        spi = SoftSPI(baudrate = baudrate,
+                      polarity = 0, phase = 0, bits = 8, firstbit = SoftSPI.MSB,
+                      sck = Pin(config['sck'], Pin.OUT, Pin.PULL_DOWN),
+                      mosi = Pin(config['mosi'], Pin.OUT, Pin.PULL_UP),
+                      miso = Pin(config['miso'], Pin.IN, Pin.PULL_UP))
+        super().__init__(spi, config['ss'])
+
+class HardSPIBus(SPIBus):
+    '''Bus on one of the ESP32 SPI peripherals (HSPI or VSPI). The pins
+    are routed through the GPIO matrix, so any pin assignment works, but
+    the VSPI defaults (sck 18, mosi 23, miso 19) use the direct IO_MUX path.
+    '''
+    def __init__(self, config, spi_id = VSPI, baudrate = DEFAULT_BAUDRATE):
+        spi = SPI(spi_id, baudrate = baudrate,
+                  polarity = 0, phase = 0, bits = 8, firstbit = SPI.MSB,
+                  sck = Pin(config['sck']),
+                  mosi = Pin(config['mosi']),
+                  miso = Pin(config['miso']))
+        super().__init__(spi, config['ss'])
+
+def make_bus(config):
+    '''This function builds the bus selected by config['spi'] ('vspi',
+    'hspi' or 'soft', default 'soft'). If the hardware peripheral cannot
+    be claimed it falls back to SoftSPI.
+    '''
+    backend = config.get('spi', 'soft')
+    baudrate = config.get('spi_baudrate', DEFAULT_BAUDRATE)
+    if backend in ('vspi', 'hspi'):
+        try:
+            return HardSPIBus(config, VSPI if backend == 'vspi' else HSPI, baudrate)
+        except Exception as e:
+            print('Hardware SPI unavailable ({}), using SoftSPI'.format(e))
+    return SoftSPIBus(config, baudrate)
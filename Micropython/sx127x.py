@@ -1,5 +1,7 @@
 from time import sleep
-from machine import SoftSPI, Pin
+from utime import sleep_ms, ticks_ms, ticks_add, ticks_diff
+from machine import Pin, idle
+from spi_bus import SPIBus
 import gc
 
 PA_OUTPUT_RFO_PIN = 0
@@ -29,6 +31,7 @@ REG_PKT_RSSI_VALUE = 0x1a
 REG_PKT_SNR_VALUE = 0x1b
 REG_MODEM_CONFIG_1 = 0x1d
 REG_MODEM_CONFIG_2 = 0x1e
+REG_SYMB_TIMEOUT_LSB = 0x1f
 REG_PREAMBLE_MSB = 0x20
 REG_PREAMBLE_LSB = 0x21
 REG_PAYLOAD_LENGTH = 0x22
@@ -61,11 +64,14 @@ MODE_STDBY = 0x01
 MODE_TX = 0x03
 MODE_RX_CONTINUOUS = 0x05
 MODE_RX_SINGLE = 0x06
+MODE_CAD = 0x07
 
 # PA config
 PA_BOOST = 0x80
 
 # IRQ masks
+IRQ_CAD_DETECTED_MASK = 0x01
+IRQ_CAD_DONE_MASK = 0x04
 IRQ_TX_DONE_MASK = 0x08
 IRQ_PAYLOAD_CRC_ERROR_MASK = 0x20
 IRQ_RX_DONE_MASK = 0x40
@@ -74,8 +80,85 @@ IRQ_RX_TIME_OUT_MASK = 0x80
 # Buffer size
 MAX_PKT_LENGTH = 255
 
+# ms past the expected time on air before a transmission without TxDone
+# is given up
+TX_DONE_MARGIN_MS = 250
+
+# configuration registers that only change when the driver writes them,
+# so they can be served from the shadow copy
+SHADOWED_REGISTERS = (
+    REG_FRF_MSB, REG_FRF_MID, REG_FRF_LSB, REG_PA_CONFIG, REG_LNA,
+    REG_FIFO_TX_BASE_ADDR, REG_FIFO_RX_BASE_ADDR, REG_MODEM_CONFIG_1,
+    REG_MODEM_CONFIG_2, REG_SYMB_TIMEOUT_LSB, REG_PREAMBLE_MSB, REG_PREAMBLE_LSB,
+    REG_PAYLOAD_LENGTH, REG_MODEM_CONFIG_3, REG_DETECTION_OPTIMIZE,
+    REG_INVERTIQ, REG_DETECTION_THRESHOLD, REG_SYNC_WORD, REG_INVERTIQ2,
+    REG_DIO_MAPPING_1,
+)
+
+# bandwidth register settings in Hz
+BANDWIDTHS = (7.8E3, 10.4E3, 15.6E3, 20.8E3, 31.25E3, 41.7E3, 62.5E3, 125E3, 250E3, 500E3)
+
+def bandwidth_setting(sbw):
+    '''Returns the bandwidth register setting (0-9) for sbw, either a
+    setting already or a bandwidth in Hz, rounded up to the next one
+    the modem supports.
+    '''
+    if sbw < 10:
+        return int(sbw)
+    for i in range(len(BANDWIDTHS) - 1):
+        if sbw <= BANDWIDTHS[i]:
+            return i
+    return 9
+
 __DEBUG__ = True
 
+class PacketRing:
+    '''Fixed-size ring of received frames, filled from the DIO0 interrupt
+    and drained by the main loop. All storage is allocated up front. The
+    IRQ side only advances _written and the reader only advances _read,
+    so neither needs to disable interrupts.
+    '''
+    def __init__(self, slots = 4):
+        self.slots = slots
+        self._payloads = [bytearray(MAX_PKT_LENGTH) for i in range(slots)]
+        self._views = [memoryview(p) for p in self._payloads]
+        self._lengths = bytearray(slots)
+        self._rssi = bytearray(slots)     # raw REG_PKT_RSSI_VALUE
+        self._snr = bytearray(slots)      # raw REG_PKT_SNR_VALUE
+        self._written = 0
+        self._read = 0
+        self.received = 0   # frames stored in the ring
+        self.dropped = 0    # frames discarded for CRC / header errors
+        self.overruns = 0   # good frames lost because the ring was full
+
+    def __len__(self):
+        return self._written - self._read
+
+    def free_slot(self):
+        '''Returns the index of the slot to write next, or None if full.'''
+        if self._written - self._read >= self.slots:
+            return None
+        return self._written % self.slots
+
+    def commit(self, slot, length, rssi, snr):
+        self._lengths[slot] = length
+        self._rssi[slot] = rssi
+        self._snr[slot] = snr
+        self._written += 1
+        self.received += 1
+
+    def pop(self):
+        '''Returns (payload, raw rssi, raw snr) of the oldest frame, or
+        None if the ring is empty.
+        '''
+        if self._written == self._read:
+            return None
+        slot = self._read % self.slots
+        frame = (bytes(self._views[slot][:self._lengths[slot]]),
+                 self._rssi[slot], self._snr[slot])
+        self._read += 1
+        return frame
+
 class SX127x:
 
     default_parameters = {
@@ -92,20 +175,45 @@ class SX127x:
             }
 
     def __init__(self,
-                 SoftSPI,
+                 bus,
                  pins,
-                 parameters=default_parameters):
-        
-        self._SoftSPI = SoftSPI
+                 parameters=default_parameters,
+                 shadow_registers=True):
+
+        # a bare SPI object is wrapped so it can be driven through the bus interface
+        if not hasattr(bus, 'read_burst_into'):
+            bus = SPIBus(bus, pins['ss'])
+        self._bus = bus
         self._pins = pins
-        self._parameters = parameters
+        self._parameters = dict(parameters)
         self._lock = False
 
+        # write-through copy of the configuration registers
+        self._shadow = bytearray(128) if shadow_registers else None
+        self._shadowed = bytearray(128)
+
+        # preallocated FIFO buffer, so receiving does not allocate
+        self._fifo_buffer = bytearray(MAX_PKT_LENGTH)
+        self._fifo_view = memoryview(self._fifo_buffer)
+        self._rx_ring = None
+        self._tx_busy = False
+        self._on_tx_done = None
+        self._tx_deadline = 0
+        # called from the interrupt after frames went into the receive
+        # ring, e.g. a uasyncio ThreadSafeFlag's set
+        self.on_frame = None
+
+        # cumulative time on air (secs) and packets per direction
+        self.airtime_tx = 0.0
+        self.airtime_rx = 0.0
+        self.packets_tx = 0
+        self.packets_rx = 0
+
         # setting pins
+        self._pin_rx_done = None
+        self._led_status = None
         if "dio_0" in self._pins:
             self._pin_rx_done = Pin(self._pins["dio_0"], Pin.IN)
-        if "ss" in self._pins:
-            self._pin_ss = Pin(self._pins["ss"], Pin.OUT)
         if "led" in self._pins:
             self._led_status = Pin(self._pins["led"], Pin.OUT)
 
@@ -123,39 +231,23 @@ class SX127x:
         if __DEBUG__:
             print("SX version: {}".format(version))
 
-        # put in LoRa and sleep mode
+        # put in LoRa and sleep mode; LongRangeMode only changes in sleep
+        # mode, so a chip still in FSK mode takes a second write
         self.sleep()
+        if self.read_register(REG_OP_MODE) & MODE_LONG_RANGE_MODE == 0:
+            self.sleep()
 
-        # config
-        self.set_frequency(self._parameters['frequency'])
-        self.set_signal_bandwidth(self._parameters['signal_bandwidth'])
+        # registers 0x0D-0x3F differ between the FSK and LoRa banks, so the
+        # shadow is only loaded once the chip is in LoRa mode
+        if self._shadow is not None:
+            self.load_shadow()
 
         # set LNA boost
         self.write_register(REG_LNA, self.read_register(REG_LNA) | 0x03)
 
-        # set auto AGC
-        self.write_register(REG_MODEM_CONFIG_3, 0x04)
-
-        self.set_tx_power(self._parameters['tx_power_level'])
+        # config, auto AGC and LowDataRateOptimize
         self._implicit_header_mode = None
-        self.implicit_header_mode(self._parameters['implicit_header'])
-        self.set_spreading_factor(self._parameters['spreading_factor'])
-        self.set_coding_rate(self._parameters['coding_rate'])
-        self.set_preamble_length(self._parameters['preamble_length'])
-        self.set_sync_word(self._parameters['sync_word'])
-        self.enable_CRC(self._parameters['enable_CRC'])
-        self.invert_IQ(self._parameters["invert_IQ"])
-
-        # set LowDataRateOptimize flag if symbol time > 16ms (default disable on reset)
-        # self.write_register(REG_MODEM_CONFIG_3, self.read_register(REG_MODEM_CONFIG_3) & 0xF7)  # default disable on reset
-        bw_parameter = self._parameters["signal_bandwidth"]
-        sf_parameter = self._parameters["spreading_factor"]
-
-        if 1000 / (bw_parameter / 2**sf_parameter) > 16:
-            self.write_register(
-                REG_MODEM_CONFIG_3, 
-                self.read_register(REG_MODEM_CONFIG_3) | 0x08
-            )
+        self.apply_config(parameters)
 
         # set base addresses
         self.write_register(REG_FIFO_TX_BASE_ADDR, FifoTxBaseAddr)
@@ -191,9 +283,9 @@ class SX127x:
         # check size
         size = min(size, (MAX_PKT_LENGTH - FifoTxBaseAddr - currentLength))
 
-        # write data
-        for i in range(size):
-            self.write_register(REG_FIFO, buffer[i])
+        # write data in a single burst transaction
+        if size:
+            self.write_fifo(memoryview(buffer)[:size])
 
         # update length
         self.write_register(REG_PAYLOAD_LENGTH, currentLength + size)
@@ -205,17 +297,92 @@ class SX127x:
     def println(self, msg, implicit_header = False):
         self.set_lock(True)  # wait until RX_Done, lock and begin writing.
 
+        airtime = self.transmit(msg, implicit_header = implicit_header)
+        self.wait_tx_done()
+
+        self.set_lock(False) # unlock when done writing
+        self.collect_garbage()
+        return airtime
+
+    def transmit(self, msg, on_done = None, implicit_header = False):
+        '''Loads msg into the FIFO, starts the transmission and returns
+        right away. DIO0 is mapped to TxDone, and on_done(self) is called
+        from the interrupt when the packet has left the antenna. If a
+        receive ring was active, reception resumes after TX_DONE.
+        Returns: the expected time on air in secs.
+        '''
+        self._tx_busy = True
+        self._on_tx_done = on_done
+
         self.begin_packet(implicit_header)
+        size = self.write(msg.encode() if isinstance(msg, str) else msg)
+        airtime = self.time_on_air(size)
+        self._tx_deadline = ticks_add(ticks_ms(), int(1000 * airtime) + TX_DONE_MARGIN_MS)
+        self.airtime_tx += airtime
+        self.packets_tx += 1
 
-        if isinstance(msg, str):
-            message = msg.encode()
-            
-        self.write(message)
+        if self._pin_rx_done:
+            self.write_register(REG_DIO_MAPPING_1, 0x40)    # DIO0 => TxDone
+            self._pin_rx_done.irq(
+                trigger=Pin.IRQ_RISING, handler = self.handle_on_tx_done
+            )
 
-        self.end_packet()
+        # put in TX mode, standby automatically on TX_DONE
+        self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_TX)
+        return airtime
 
-        self.set_lock(False) # unlock when done writing
-        self.collect_garbage()
+    def handle_on_tx_done(self, event_source):
+        if self.get_irq_flags() & IRQ_TX_DONE_MASK:
+            self.finish_transmit()
+        return True
+
+    def finish_transmit(self):
+        self._tx_busy = False
+        if self._rx_ring is not None:
+            self.receive_into_ring(self._rx_ring)
+        elif self._pin_rx_done:
+            self._pin_rx_done.irq(handler = None)
+
+        on_done = self._on_tx_done
+        self._on_tx_done = None
+        if on_done:
+            on_done(self)
+
+    def tx_done(self):
+        '''Returns True when no transmission is in progress. Without a DIO0
+        pin this polls the TX_DONE flag instead.
+        '''
+        if self._tx_busy and not self._pin_rx_done:
+            if self.read_register(REG_IRQ_FLAGS) & IRQ_TX_DONE_MASK:
+                self.write_register(REG_IRQ_FLAGS, IRQ_TX_DONE_MASK)
+                self.finish_transmit()
+        return not self._tx_busy
+
+    def wait_tx_done(self):
+        '''Blocks until the current transmission has finished, idling the
+        CPU between interrupts, at most until its time on air plus
+        TX_DONE_MARGIN_MS has passed (see check_tx_deadline).
+        '''
+        while not self.tx_done():
+            self.check_tx_deadline()
+            if self._pin_rx_done:
+                idle()
+
+    def check_tx_deadline(self):
+        '''Polls the TX_DONE flag once the current transmission is past its
+        deadline, in case the TxDone interrupt was missed, and completes it.
+        Raises: OSError if the flag is not set either.
+        '''
+        if not self._tx_busy or ticks_diff(ticks_ms(), self._tx_deadline) < 0:
+            return
+        if self.read_register(REG_IRQ_FLAGS) & IRQ_TX_DONE_MASK:
+            self.write_register(REG_IRQ_FLAGS, IRQ_TX_DONE_MASK)
+            self.finish_transmit()
+            return
+        self._tx_busy = False
+        self._on_tx_done = None
+        self.standby()
+        raise OSError('no TX_DONE {} ms past the time on air'.format(TX_DONE_MARGIN_MS))
 
     def get_irq_flags(self):
         irq_flags = self.read_register(REG_IRQ_FLAGS)
@@ -223,12 +390,17 @@ class SX127x:
         return irq_flags
 
     def packet_rssi(self):
-        rssi = self.read_register(REG_PKT_RSSI_VALUE)
-        return (rssi - (164 if self._frequency < 868E6 else 157))
+        return self.rssi_from_raw(self.read_register(REG_PKT_RSSI_VALUE))
 
     def packet_snr(self):
-        snr = self.read_register(REG_PKT_SNR_VALUE)
-        return snr * 0.25
+        return self.snr_from_raw(self.read_register(REG_PKT_SNR_VALUE))
+
+    def rssi_from_raw(self, rssi):
+        return (rssi - (164 if self._frequency < 868E6 else 157))
+
+    def snr_from_raw(self, snr):
+        # REG_PKT_SNR_VALUE is two's complement, in quarter dB
+        return (snr - 256 if snr > 127 else snr) * 0.25
 
     def standby(self):
         self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_STDBY)
@@ -260,6 +432,7 @@ class SX127x:
 
     def set_spreading_factor(self, sf):
         sf = min(max(sf, 6), 12)
+        self._spreading_factor = sf
         self.write_register(REG_DETECTION_OPTIMIZE, 0xc5 if sf == 6 else 0xc3)
         self.write_register(REG_DETECTION_THRESHOLD, 0x0c if sf == 6 else 0x0a)
         self.write_register(
@@ -268,17 +441,8 @@ class SX127x:
         )
 
     def set_signal_bandwidth(self, sbw):
-        bins = (7.8E3, 10.4E3, 15.6E3, 20.8E3, 31.25E3, 41.7E3, 62.5E3, 125E3, 250E3)
-
-        bw = 9
-
-        if sbw < 10:
-            bw = sbw
-        else:
-            for i in range(len(bins)):
-                if sbw <= bins[i]:
-                    bw = i
-                    break
+        bw = bandwidth_setting(sbw)
+        self._signal_bandwidth = BANDWIDTHS[bw]
 
         self.write_register(
             REG_MODEM_CONFIG_1, 
@@ -287,6 +451,7 @@ class SX127x:
 
     def set_coding_rate(self, denominator):
         denominator = min(max(denominator, 5), 8)
+        self._coding_rate = denominator
         cr = denominator - 4
         self.write_register(
             REG_MODEM_CONFIG_1, 
@@ -294,16 +459,18 @@ class SX127x:
         )
 
     def set_preamble_length(self, length):
+        self._preamble_length = length
         self.write_register(REG_PREAMBLE_MSB,  (length >> 8) & 0xff)
         self.write_register(REG_PREAMBLE_LSB,  (length >> 0) & 0xff)
 
     def enable_CRC(self, enable_CRC = False):
+        self._crc = enable_CRC
         modem_config_2 = self.read_register(REG_MODEM_CONFIG_2)
         config = modem_config_2 | 0x04 if enable_CRC else modem_config_2 & 0xfb
         self.write_register(REG_MODEM_CONFIG_2, config)
 
     def invert_IQ(self, invert_IQ):
-        self._parameters["invertIQ"] = invert_IQ
+        self._parameters["invert_IQ"] = invert_IQ
         if invert_IQ:
             self.write_register(
                 REG_INVERTIQ,
@@ -336,18 +503,91 @@ class SX127x:
     def set_sync_word(self, sw):
         self.write_register(REG_SYNC_WORD, sw)
 
+    def set_low_data_rate_optimize(self):
+        '''Enables auto AGC, and LowDataRateOptimize if the symbol time
+        exceeds 16 ms for the current spreading factor and bandwidth.
+        '''
+        symbol_ms = 1000 * self.symbol_time()
+        self.write_register(REG_MODEM_CONFIG_3, 0x0c if symbol_ms > 16 else 0x04)
+
+    def apply_config(self, parameters):
+        '''Applies a lora_parameters style dict. With the shadow enabled,
+        only registers whose value actually changes are written.
+        '''
+        setters = {
+            'frequency': self.set_frequency,
+            'tx_power_level': self.set_tx_power,
+            'signal_bandwidth': self.set_signal_bandwidth,
+            'spreading_factor': self.set_spreading_factor,
+            'coding_rate': self.set_coding_rate,
+            'preamble_length': self.set_preamble_length,
+            'implicit_header': self.implicit_header_mode,
+            'sync_word': self.set_sync_word,
+            'enable_CRC': self.enable_CRC,
+            'invert_IQ': self.invert_IQ,
+        }
+        for key in parameters:
+            if key in setters:
+                self._parameters[key] = parameters[key]
+                setters[key](parameters[key])
+        self.set_low_data_rate_optimize()
+
+    def symbol_time(self):
+        '''Returns the symbol time in secs for the live SF and bandwidth.'''
+        return 2**self._spreading_factor / self._signal_bandwidth
+
+    def time_on_air(self, payload_len):
+        '''Returns the time on air in secs of a payload_len byte packet with
+        the live modem settings, from the Semtech formula (SX1276
+        datasheet 4.1.1.7).
+        '''
+        sf = self._spreading_factor
+        symbol_time = self.symbol_time()
+        ldro = 1 if symbol_time > 0.016 else 0
+        ih = 1 if self._implicit_header_mode else 0
+        crc = 1 if self._crc else 0
+
+        numerator = 8 * payload_len - 4 * sf + 28 + 16 * crc - 20 * ih
+        denominator = 4 * (sf - 2 * ldro)
+        payload_symbols = 8 + max(-(-numerator // denominator) * self._coding_rate, 0)
+        return (self._preamble_length + 4.25 + payload_symbols) * symbol_time
+
+    def airtime(self):
+        '''Returns the cumulative time on air (secs) and packet counts per
+        direction.
+        '''
+        return {'tx': self.airtime_tx, 'rx': self.airtime_rx,
+                'tx_packets': self.packets_tx, 'rx_packets': self.packets_rx}
+
+    def channel_activity_detected(self):
+        '''Runs one Channel Activity Detection and returns True if a LoRa
+        preamble was seen. CAD listens for about two symbols, a fraction
+        of the energy and time of a receive window. If a receive ring is
+        active, reception resumes afterwards.
+        '''
+        symbol_ms = 1000 * self.symbol_time()
+
+        self.standby()
+        self.write_register(REG_IRQ_FLAGS, IRQ_CAD_DONE_MASK | IRQ_CAD_DETECTED_MASK)
+        self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_CAD)
+
+        # CAD takes about two symbols, only poll once it is nearly done
+        sleep_ms(int(2 * symbol_ms))
+        irq_flags = self.read_register(REG_IRQ_FLAGS)
+        polls = 0
+        while irq_flags & IRQ_CAD_DONE_MASK == 0 and polls < 100:
+            sleep_ms(1)
+            irq_flags = self.read_register(REG_IRQ_FLAGS)
+            polls += 1
+        self.write_register(REG_IRQ_FLAGS, IRQ_CAD_DONE_MASK | IRQ_CAD_DETECTED_MASK)
+
+        if self._rx_ring is not None:
+            self.receive_into_ring(self._rx_ring)
+        return bool(irq_flags & IRQ_CAD_DETECTED_MASK)
+
     def set_channel(self, parameters):
         self.standby()
-        for key in parameters:
-            if key == "frequency":
-                self.set_frequency(parameters[key])
-                continue
-            if key == "invert_IQ":
-                self.invert_IQ(parameters[key])
-                continue
-            if key == "tx_power_level":
-                self.set_tx_power(parameters[key])
-                continue
+        self.apply_config(parameters)
 
     def dump_registers(self):
         for i in range(128):
@@ -386,11 +626,82 @@ class SX127x:
                     trigger=Pin.IRQ_RISING, handler = self.handle_on_receive
                 )
             else:
-                self._pin_rx_done.detach_irq()
+                self._pin_rx_done.irq(handler = None)
+
+    def receive_into_ring(self, ring):
+        '''Starts interrupt-driven continuous reception. Every frame
+        signalled on DIO0 is copied into ring (a PacketRing) by
+        handle_on_receive; the radio stays in RX_CONTINUOUS throughout,
+        so nothing is lost between re-arms.
+        '''
+        self._rx_ring = ring
+        self.write_register(REG_FIFO_ADDR_PTR, FifoRxBaseAddr)
+        self.get_irq_flags()
+        if self._pin_rx_done:
+            self.write_register(REG_DIO_MAPPING_1, 0x00)    # DIO0 => RxDone
+            self._pin_rx_done.irq(
+                trigger=Pin.IRQ_RISING, handler = self.handle_on_receive
+            )
+        self.receive()
+
+    def stop_receiving(self):
+        '''Ends interrupt-driven reception and puts the radio in standby.'''
+        self._rx_ring = None
+        if self._pin_rx_done:
+            self._pin_rx_done.irq(handler = None)
+        self.standby()
+
+    def pop_packet(self):
+        '''Returns (payload, rssi, snr) of the oldest frame in the receive
+        ring, or None if it is empty.
+        '''
+        frame = self._rx_ring.pop() if self._rx_ring else None
+        if frame is None:
+            return None
+        payload, rssi, snr = frame
+        return payload, self.rssi_from_raw(rssi), self.snr_from_raw(snr)
+
+    def drain_to_ring(self, irq_flags):
+        '''Copies the frame that raised RX_DONE into a preallocated slot of
+        the receive ring. Runs in interrupt context.
+        '''
+        ring = self._rx_ring
+        if irq_flags & IRQ_RX_DONE_MASK == 0:
+            return
+        if irq_flags & IRQ_PAYLOAD_CRC_ERROR_MASK:
+            ring.dropped += 1
+            return
+        slot = ring.free_slot()
+        if slot is None:
+            ring.overruns += 1
+            return
+
+        self.write_register(
+            REG_FIFO_ADDR_PTR,
+            self.read_register(REG_FIFO_RX_CURRENT_ADDR)
+        )
+        if self._implicit_header_mode:
+            packet_length = self.read_register(REG_PAYLOAD_LENGTH)
+        else:
+            packet_length = self.read_register(REG_RX_NB_BYTES)
+        self.read_fifo_into(ring._views[slot][:packet_length])
+        self.airtime_rx += self.time_on_air(packet_length)
+        self.packets_rx += 1
+        ring.commit(
+            slot, packet_length,
+            self.read_register(REG_PKT_RSSI_VALUE),
+            self.read_register(REG_PKT_SNR_VALUE)
+        )
 
     def handle_on_receive(self, event_source):
-        self.set_lock(True)              # lock until TX_Done
         irq_flags = self.get_irq_flags()
+        if self._rx_ring is not None:
+            self.drain_to_ring(irq_flags)
+            if self.on_frame:
+                self.on_frame()
+            return True
+
+        self.set_lock(True)              # lock until TX_Done
 
         if (irq_flags == IRQ_RX_DONE_MASK):  # RX_DONE only, irq_flags should be 0x40
             # automatically standby when RX_DONE
@@ -413,6 +724,43 @@ class SX127x:
         self.collect_garbage()
         return True
 
+    def set_symbol_timeout(self, symbols):
+        '''Sets how many symbols RX_SINGLE searches for a preamble before
+        raising RX_TIMEOUT (4-1023).
+        '''
+        symbols = min(max(symbols, 4), 1023)
+        self.write_register(
+            REG_MODEM_CONFIG_2,
+            (self.read_register(REG_MODEM_CONFIG_2) & 0xfc) | (symbols >> 8)
+        )
+        self.write_register(REG_SYMB_TIMEOUT_LSB, symbols & 0xff)
+
+    def receive_single(self, symbol_timeout, timeout_ms):
+        '''Opens one RX_SINGLE window that gives up after symbol_timeout
+        symbols without a preamble, and waits up to timeout_ms for the
+        packet, sleeping a symbol between flag polls.
+        Returns: the payload, or None on timeout or CRC error.
+        '''
+        symbol_ms = 1000 * self.symbol_time()
+
+        self.set_symbol_timeout(symbol_timeout)
+        self.write_register(REG_FIFO_ADDR_PTR, FifoRxBaseAddr)
+        self.write_register(REG_IRQ_FLAGS, 0xff)
+        self.write_register(REG_OP_MODE, MODE_LONG_RANGE_MODE | MODE_RX_SINGLE)
+
+        waited = 0
+        irq_flags = self.read_register(REG_IRQ_FLAGS)
+        while irq_flags & (IRQ_RX_DONE_MASK | IRQ_RX_TIME_OUT_MASK) == 0 and waited < timeout_ms:
+            sleep_ms(int(symbol_ms) + 1)
+            waited += int(symbol_ms) + 1
+            irq_flags = self.read_register(REG_IRQ_FLAGS)
+        self.write_register(REG_IRQ_FLAGS, irq_flags)
+        self.standby()
+
+        if irq_flags & IRQ_RX_DONE_MASK and not irq_flags & IRQ_PAYLOAD_CRC_ERROR_MASK:
+            return self.read_payload()
+        return None
+
     def received_packet(self, size = 0):
         irq_flags = self.get_irq_flags()
 
@@ -452,32 +800,67 @@ class SX127x:
         else:
             packet_length = self.read_register(REG_RX_NB_BYTES)
 
-        payload = bytearray()
-        for i in range(packet_length):
-            payload.append(self.read_register(REG_FIFO))
+        # read the whole packet in a single burst transaction
+        self.read_fifo_into(self._fifo_view[:packet_length])
+        self.airtime_rx += self.time_on_air(packet_length)
+        self.packets_rx += 1
 
         self.collect_garbage()
-        return bytes(payload)
+        return bytes(self._fifo_view[:packet_length])
 
-    def read_register(self, address, byteorder = 'big', signed = False):
-        response = self.transfer(address & 0x7f)
-        return int.from_bytes(response, byteorder)
+    def read_register(self, address):
+        if self._shadow is not None and self._shadowed[address]:
+            return self._shadow[address]
+        return self._bus.transfer(address & 0x7f)
 
     def write_register(self, address, value):
-        self.transfer(address | 0x80, value)
-
-
-    def transfer(self, address, value = 0x00):
-        response = bytearray(1)
-
-        self._pin_ss.value(0)
-
-        self._SoftSPI.write(bytes([address]))
-        self._SoftSPI.write_readinto(bytes([value]), response)
-
-        self._pin_ss.value(1)
+        if self._shadow is not None and self._shadowed[address]:
+            if self._shadow[address] == value:
+                return
+            self._shadow[address] = value
+        self._bus.transfer(address | 0x80, value)
+
+    def load_shadow(self):
+        '''Fills the shadow copy with one burst read of registers
+        0x01-0x40 and starts serving the configuration registers from it.
+        '''
+        self._bus.read_burst_into(0x01, memoryview(self._shadow)[0x01:0x41])
+        for address in SHADOWED_REGISTERS:
+            self._shadowed[address] = 1
+
+    def verify_config(self):
+        '''Reads the version and a few configuration registers straight
+        from the chip and compares them with what the driver wrote.
+        Returns False if the radio stopped answering or was reset.
+        '''
+        if self._bus.transfer(REG_VERSION) == 0:
+            return False
+        if self._shadow is None:
+            return True
+        for address in (REG_MODEM_CONFIG_1, REG_MODEM_CONFIG_2, REG_SYNC_WORD, REG_FRF_MSB):
+            if self._bus.transfer(address) != self._shadow[address]:
+                return False
+        return True
 
-        return response
+    def invalidate_shadow(self):
+        '''Forgets the shadow copy, e.g. after the radio has been reset.
+        Call load_shadow() to start using it again.
+        '''
+        for address in SHADOWED_REGISTERS:
+            self._shadowed[address] = 0
+
+    def write_fifo(self, buffer):
+        '''Writes buffer to the FIFO in one SS-low burst transaction. The
+        SX127x keeps the address on REG_FIFO and advances FIFO_ADDR_PTR
+        for every byte clocked in.
+        '''
+        self._bus.write_burst(REG_FIFO, buffer)
+
+    def read_fifo_into(self, buffer):
+        '''Fills buffer (a bytearray or memoryview) from the FIFO in one
+        SS-low burst transaction, starting at FIFO_ADDR_PTR.
+        '''
+        self._bus.read_burst_into(REG_FIFO, buffer)
 
     def blink_led(self, times = 1, on_seconds = 0.1, off_seconds = 0.1):
         for i in range(times):
@@ -0,0 +1,150 @@
+'''Compact binary encoding of the message dicts exchanged by floppaSNCT
+and floppaREC. A frame is
+
+    version (1) | opcode (1) | presence bitmap (1) | fields
+
+where bit i of the presence bitmap says field i of the opcode's layout
+follows, packed little-endian with struct. Voltages travel as mV, flash
+times as tenths of a second and SNR as quarter dB. Any message the
+layouts cannot express is sent as JSON instead, which decode()
+recognises by its leading '{', so either end can be switched to JSON
+for debugging on its own.
+'''
+import json
+import struct
+
+WIRE_VERSION = 0x01
+
+OPCODES = {
+    'FLASHER_ON': 0x01,
+    'FLASHER_OFF': 0x02,
+    'FLASHER_FIRE': 0x03,
+    'FLASHER_CEASEFIRE': 0x04,
+    'FLASH_FLASHER': 0x05,
+    'BATT1_ON': 0x06,
+    'BATT1_OFF': 0x07,
+    'BATT2_ON': 0x08,
+    'BATT2_OFF': 0x09,
+    'VOLTAGE': 0x0a,
+    'RELAY_ON': 0x0b,
+    'RELAY_OFF': 0x0c,
+    'SET_DR': 0x0d,
+    'BATCH': 0x0e,
+    'TELEMETRY': 0x0f,
+}
+NAMES = {opcode: name for name, opcode in OPCODES.items()}
+COMMANDS = tuple(sorted(OPCODES, key = OPCODES.get))
+
+RELAYS = ('flasher_pin', 'hv_pin', 'batt1_pin', 'batt2_pin', 'solar_pin')
+STATUSES = ('OK', 'NOREPLY', 'UNKNOWN', 'ERROR')
+
+# (key, struct format, scale or tuple of enumerated values). A list field
+# has a tuple of (struct format, scale) item elements as its format and
+# None as its scale, and is packed as an item count byte and the items.
+COMMON_FIELDS = (
+    ('lsnr', 'b', 4),
+)
+FIELDS = {
+    'FLASH_FLASHER': (('time', 'H', 10),),
+    'VOLTAGE': (('SOLAR', 'H', 1000), ('BATT1', 'H', 1000), ('BATT2', 'H', 1000)),
+    'RELAY_ON': (('relay', 'B', RELAYS),),
+    'RELAY_OFF': (('relay', 'B', RELAYS),),
+    'SET_DR': (('dr', 'B', 1),),
+    'BATCH': (('steps', (('B', COMMANDS), ('H', 10)), None),
+              ('results', (('B', COMMANDS), ('B', STATUSES), ('H', 10)), None),
+              ('SOLAR', 'H', 1000), ('BATT1', 'H', 1000), ('BATT2', 'H', 1000)),
+    'TELEMETRY': (('SOLAR', 'H', 1000), ('BATT1', 'H', 1000), ('BATT2', 'H', 1000),
+                  ('cmd_rssi', 'h', 1), ('uptime', 'I', 1)),
+}
+
+def layout(name):
+    '''This function returns the field layout of message name.'''
+    return COMMON_FIELDS + FIELDS.get(name, ())
+
+def encode(msg, binary = True):
+    '''This function encodes a message dict as bytes, in the binary format
+    if binary is set and the message fits it, else as JSON.
+    '''
+    if binary:
+        try:
+            return encode_binary(msg)
+        except Exception:
+            pass
+    return json.dumps(msg).encode()
+
+def encode_binary(msg):
+    '''This function encodes a message dict in the binary format. It
+    raises KeyError or ValueError if the message does not fit it.
+    '''
+    name = msg['msg']
+    fields = layout(name)
+    keys = [field[0] for field in fields]
+    for key in msg:
+        if key != 'msg' and key not in keys:
+            raise KeyError(key)
+
+    presence = 0
+    body = bytearray()
+    for i, (key, fmt, scale) in enumerate(fields):
+        if key not in msg:
+            continue
+        presence |= 1 << i
+        if scale is not None:
+            body.extend(pack_value(fmt, scale, msg[key]))
+            continue
+        body.append(len(msg[key]))
+        for item in msg[key]:
+            if len(item) != len(fmt):
+                raise ValueError(key)
+            for (item_fmt, item_scale), value in zip(fmt, item):
+                body.extend(pack_value(item_fmt, item_scale, value))
+    return bytes((WIRE_VERSION, OPCODES[name], presence)) + bytes(body)
+
+def pack_value(fmt, scale, value):
+    '''This function packs one scaled or enumerated value.'''
+    if isinstance(scale, tuple):
+        return struct.pack('<' + fmt, scale.index(value))
+    return struct.pack('<' + fmt, int(round(value * scale)))
+
+def unpack_value(fmt, scale, payload, offset):
+    '''This function unpacks one scaled or enumerated value at offset.
+    Returns: (value, offset of the next value)
+    '''
+    raw = struct.unpack_from('<' + fmt, payload, offset)[0]
+    offset += struct.calcsize(fmt)
+    if isinstance(scale, tuple):
+        return scale[raw], offset
+    if scale == 1:
+        return raw, offset
+    return raw / scale, offset
+
+def decode(payload):
+    '''This function decodes a binary or JSON payload to a message dict.
+    It raises an exception on anything it cannot decode.
+    '''
+    if payload[:1] == b'{':
+        return json.loads(payload)
+    if len(payload) < 3 or payload[0] != WIRE_VERSION:
+        raise ValueError('unsupported wire version')
+
+    name = NAMES[payload[1]]
+    presence = payload[2]
+    msg = {'msg': name}
+    offset = 3
+    for i, (key, fmt, scale) in enumerate(layout(name)):
+        if not presence & (1 << i):
+            continue
+        if scale is not None:
+            msg[key], offset = unpack_value(fmt, scale, payload, offset)
+            continue
+        items = []
+        count = payload[offset]
+        offset += 1
+        for n in range(count):
+            item = []
+            for item_fmt, item_scale in fmt:
+                value, offset = unpack_value(item_fmt, item_scale, payload, offset)
+                item.append(value)
+            items.append(item)
+        msg[key] = items
+    return msg